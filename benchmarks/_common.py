@@ -0,0 +1,68 @@
+# Helpers shared by the benchmarks (and their fixtures in conftest.py)
+
+import csv
+import tracemalloc
+
+
+# Number of HITs generated and observed per round
+NUM_HITS = 1000
+NUM_ITEMS_PER_HIT = 5
+
+# Some sentences contain characters that must be escaped
+SENTENCE_TEMPLATES = (
+    'sentence {} about topic {}',
+    'a sentence with an & and a <tag> ({}, {})',
+    'a sentence with an emoji \U0001F600 ({}, {})',
+    'another "quoted", sentence {} {}',
+)
+
+
+def write_pool(pool_path, gold_path, pool_size, rng):
+    labels = rng.normal(0., 1., pool_size)
+    with open(pool_path, 'w', newline='') as pool_f, open(gold_path, 'w', newline='') as gold_f:
+        pool_writer = csv.writer(pool_f)
+        gold_writer = csv.writer(gold_f)
+        pool_writer.writerow(('id', 'sent'))
+        gold_writer.writerow(('id', 'sent', 'label'))
+        for i in range(pool_size):
+            sent = SENTENCE_TEMPLATES[i % len(SENTENCE_TEMPLATES)].format(i, i % 97)
+            pool_writer.writerow((i, sent))
+            gold_writer.writerow((i, sent, labels[i]))
+
+
+def write_results(results_path, pool_size, rng):
+    ids = rng.integers(pool_size, size=(NUM_HITS, NUM_ITEMS_PER_HIT))
+    scores = rng.integers(101, size=(NUM_HITS, NUM_ITEMS_PER_HIT))
+    is_na = rng.random((NUM_HITS, NUM_ITEMS_PER_HIT)) < 0.1
+    with open(results_path, 'w', newline='') as f:
+        writer = csv.writer(f)
+        writer.writerow(
+            ['Input.id{}'.format(i + 1) for i in range(NUM_ITEMS_PER_HIT)] +
+            ['Answer.range{}'.format(i + 1) for i in range(NUM_ITEMS_PER_HIT)] +
+            ['Answer.na{}'.format(i + 1) for i in range(NUM_ITEMS_PER_HIT)])
+        for j in range(NUM_HITS):
+            writer.writerow(
+                ids[j].tolist() + scores[j].tolist() + ['on' if na else '' for na in is_na[j].tolist()])
+
+
+def run_benchmark(benchmark, function, setup=None, rounds=None, pool_size=None):
+    """Time `function` with `benchmark` (calling `setup`, untimed, before
+    each call to create its arguments, as in benchmark.pedantic), then
+    call it once more under tracemalloc and record the peak memory it
+    allocated (in MiB) as `peak_memory_mib` in the benchmark's extra
+    info.  Pools of a million items or more are timed once by default,
+    smaller pools three times.
+    """
+    if rounds is None:
+        rounds = 1 if pool_size is not None and pool_size >= 10 ** 6 else 3
+    result = benchmark.pedantic(function, setup=setup, rounds=rounds, iterations=1)
+
+    (args, kwargs) = setup() if setup is not None else ((), {})
+    tracemalloc.start()
+    try:
+        function(*args, **kwargs)
+        (_, peak) = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    benchmark.extra_info['peak_memory_mib'] = peak / 2 ** 20
+    return result
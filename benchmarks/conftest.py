@@ -0,0 +1,50 @@
+import numpy as np
+from pytest import fixture
+
+from easl import EASL
+
+from _common import write_pool, write_results
+
+
+# Larger pools (as 100000 or 1000000) are opt-in through --pool-sizes
+DEFAULT_POOL_SIZES = '10000'
+
+
+def pytest_addoption(parser):
+    parser.addoption('--pool-sizes', default=DEFAULT_POOL_SIZES,
+                     help='Comma-separated numbers of items in the synthetic pools')
+
+
+def pytest_generate_tests(metafunc):
+    if 'pool_size' in metafunc.fixturenames:
+        pool_sizes = [int(s) for s in metafunc.config.getoption('pool_sizes').split(',')]
+        metafunc.parametrize('pool_size', pool_sizes, scope='session')
+
+
+@fixture(scope='session')
+def pool(tmp_path_factory, pool_size):
+    """Synthetic pool of `pool_size` items: a raw item file, a gold
+    standard file, an initial model (in CSV and binary formats), a
+    results file for one round of HITs, and the model updated with it.
+    """
+    rng = np.random.default_rng(pool_size)
+    pool_dir = tmp_path_factory.mktemp('pool_{}'.format(pool_size))
+    paths = dict(
+        dir=pool_dir,
+        pool=str(pool_dir / 'pool.csv'),
+        gold=str(pool_dir / 'gold.csv'),
+        model=str(pool_dir / 'pool_0.csv'),
+        binary_model=str(pool_dir / 'pool_0.easl'),
+        results=str(pool_dir / 'pool_result_1.csv'),
+        observed_model=str(pool_dir / 'pool_1.csv'),
+    )
+    write_pool(paths['pool'], paths['gold'], pool_size, rng)
+    model = EASL()
+    model.initItem(paths['pool'])
+    model.saveItem(paths['model'])
+    model.saveItem(paths['binary_model'])
+    write_results(paths['results'], pool_size, rng)
+    model.observe(paths['results'])
+    model.saveItem(paths['observed_model'])
+    paths['size'] = pool_size
+    return paths
@@ -0,0 +1,101 @@
+import numpy as np
+from pytest import importorskip, mark
+
+from easl import EASL, evaluate, initialize, profiling
+
+from _common import NUM_HITS, NUM_ITEMS_PER_HIT, run_benchmark
+
+importorskip('pytest_benchmark')
+
+
+PARAMS = {'param_hits': NUM_HITS, 'param_items': NUM_ITEMS_PER_HIT}
+
+# A narrow match quality (gamma = 0.02) on posteriors as after a number
+# of rounds (see test_get_next_k), so that a match window of 3 standard
+# deviations spans about a third of the modes
+GET_NEXT_K_PARAMS = {
+    'match': {'param_match': 0.02},
+    'match_window': {'param_match': 0.02, 'param_match_window': 3.},
+    'mean_windows': {'param_mean_windows': True},
+}
+
+
+def load_model(path, params=PARAMS):
+    model = EASL(params)
+    model.loadItem(path)
+    return model
+
+
+def test_init_item(benchmark, pool):
+    run_benchmark(benchmark, EASL(PARAMS).initItem, setup=lambda: ((pool['pool'],), {}),
+                  pool_size=pool['size'])
+
+
+def test_initialize(benchmark, pool):
+    model_path = str(pool['dir'] / 'initialized_0.csv')
+    run_benchmark(benchmark, initialize, setup=lambda: ((pool['pool'], model_path), {}),
+                  pool_size=pool['size'])
+
+
+@mark.parametrize('model_format', ['model', 'binary_model'])
+def test_load_item(benchmark, pool, model_format):
+    run_benchmark(benchmark, load_model, setup=lambda: ((pool[model_format],), {}),
+                  pool_size=pool['size'])
+
+
+@mark.parametrize('mode', sorted(GET_NEXT_K_PARAMS))
+def test_get_next_k(benchmark, pool, mode):
+    params = dict(PARAMS, **GET_NEXT_K_PARAMS[mode])
+    model = load_model(pool['model'], params)
+    # spread the posteriors out as after a number of rounds, but for one
+    # item that is still unobserved
+    rng = np.random.default_rng(0)
+    model.items.column('mode')[:] = rng.random(len(model.items))
+    model.items.column('var')[:] = rng.uniform(0.0001, 0.001, len(model.items))
+    model.items.column('var')[0] = 1 / 12.
+    run_benchmark(benchmark, model.get_next_k, setup=lambda: ((1,), {}), pool_size=pool['size'])
+
+    profiler = profiling.enable()
+    try:
+        model.get_next_k(1)
+    finally:
+        profiling.disable()
+    pairs_scored = profiler.counters['pairs_scored']
+    benchmark.extra_info['pairs_scored'] = pairs_scored
+    if mode == 'match_window':
+        assert pairs_scored < 0.5 * NUM_HITS * len(model.items)
+
+
+@mark.parametrize('hit_format', ['csv', 'jsonl.gz'])
+@mark.parametrize('hit_columns', ['all', 'template'])
+def test_generate_hits(benchmark, pool, hit_format, hit_columns):
+    params = dict(PARAMS, param_hit_columns=['id', 'sent'] if hit_columns == 'template' else None)
+    model = load_model(pool['model'], params)
+    next_items = model.get_next_k(0)
+    hit_path = str(pool['dir'] / ('pool_hit_1.' + hit_format))
+    run_benchmark(benchmark, model.generateHits, setup=lambda: ((hit_path, next_items), {}),
+                  pool_size=pool['size'])
+
+
+def test_observe(benchmark, pool):
+    def setup():
+        return ((load_model(pool['model']), pool['results']), {})
+
+    run_benchmark(benchmark, EASL.observe, setup=setup, pool_size=pool['size'])
+
+
+def test_update_posteriors(benchmark, pool):
+    model = load_model(pool['observed_model'], dict(PARAMS, param_na_adjust=True))
+    run_benchmark(benchmark, model.update_posteriors, setup=lambda: ((), {}), pool_size=pool['size'])
+
+
+@mark.parametrize('model_format', ['csv', 'easl'])
+def test_save_item(benchmark, pool, model_format):
+    model = load_model(pool['model'])
+    model_path = str(pool['dir'] / 'saved_1.{}'.format(model_format))
+    run_benchmark(benchmark, model.saveItem, setup=lambda: ((model_path,), {}), pool_size=pool['size'])
+
+
+def test_evaluate(benchmark, pool):
+    run_benchmark(benchmark, evaluate, setup=lambda: ((pool['observed_model'], pool['gold']), {}),
+                  pool_size=pool['size'])
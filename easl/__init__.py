@@ -1 +1 @@
-from .easl import EASL, run, evaluate  # noqa
+from .easl import EASL, Session, initialize, run, evaluate  # noqa
@@ -0,0 +1,62 @@
+# -*- coding: utf-8 -*-
+
+from csv import DictReader
+
+import numpy as np
+
+
+def load_gold(gold_standard_path):
+    """Load a gold standard CSV file (with `id` and `label` columns) into
+    a dictionary from item id to label."""
+    with open(gold_standard_path) as f:
+        return dict((row['id'], float(row['label'])) for row in DictReader(f))
+
+
+class GoldAnnotator(object):
+    """
+    Simulated annotator that scores items by their gold standard labels,
+    rescaled to [0, 1], plus Gaussian noise (clipped to [0, 1]), and marks
+    items N/A at random.
+    """
+
+    def __init__(self, gold, noise=0.1, na_rate=0., rng=None):
+        """
+        Args:
+            gold (dict or str): dictionary from item id to label, or path
+                to a gold standard CSV file (see load_gold)
+            noise (float): standard deviation of the noise added to the
+                rescaled labels
+            na_rate (float): probability of marking an item N/A
+            rng (numpy.random.Generator): random number generator
+        """
+        if isinstance(gold, str):
+            gold = load_gold(gold)
+        self.gold = gold
+        self.noise = noise
+        self.na_rate = na_rate
+        self.rng = np.random.default_rng() if rng is None else rng
+        labels = np.array(list(gold.values()), dtype=np.float64)
+        self.min_label = labels.min() if len(labels) else 0.
+        self.max_label = labels.max() if len(labels) else 1.
+
+    def true_scores(self, item_ids):
+        """Return the gold standard labels of the items, rescaled to
+        [0, 1], as an array."""
+        labels = np.array([self.gold[item_id] for item_id in item_ids], dtype=np.float64)
+        label_range = self.max_label - self.min_label
+        if label_range <= 0:
+            return np.full(len(labels), 0.5)
+        return (labels - self.min_label) / label_range
+
+    def annotate(self, item_ids):
+        """Score the items (as one HIT).
+
+        Returns:
+            pair of an array of scores in [0, 1] (rounded to hundredths,
+            as the slider in the HIT layouts) and a boolean array of N/A
+            flags, one entry per item
+        """
+        scores = self.true_scores(item_ids) + self.rng.normal(0., self.noise, len(item_ids))
+        scores = np.round(np.clip(scores, 0., 1.), 2)
+        is_na = self.rng.random(len(item_ids)) < self.na_rate
+        return (scores, is_na)
@@ -1,23 +1,48 @@
 # -*- coding: utf-8 -*-
 
 import csv
-import random
 import logging
 import os
-from csv import DictReader
+import re
+from collections import deque
 from math import ceil
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
 import html
 
 import numpy as np
 from scipy.stats import spearmanr
 
+from . import profiling
+from .annotator import load_gold
 from .encode_emoji import replace_emoji_characters
+from .hits import hit_fieldnames, template_columns, write_hit_batch
+from .match import sample_matches, sample_matches_windowed, MatchCache
+from .parallel import sample_matches_parallel, WorkerPool
+from .selection import top_k_random_ties, ModeOrder
+from .store import (
+    ItemStore, load_model, save_model, split_model_path, join_model_path, is_binary_model_path,
+    format_value, NUMERIC_COLUMNS,
+)
 
 
 LOGGER = logging.getLogger(__name__)
 
-np.random.seed(12345)
-random.seed(12345)
+# Number of rows read, sanitized and written at a time by initialize
+DEFAULT_CHUNK_SIZE = 10000
+
+# Characters that sanitize_value replaces (HTML special characters and
+# 4-byte characters)
+UNSAFE_CHARACTERS_RE = re.compile(u'[&<>"\'\U00010000-\U0010ffff]')
+
+
+def sanitize_value(value):
+    """Escape the HTML special characters in an item value and replace
+    its 4-byte characters with HTML spans (see replace_emoji_characters),
+    skipping the (common) values that contain neither.
+    """
+    if UNSAFE_CHARACTERS_RE.search(value) is None:
+        return value
+    return replace_emoji_characters(html.escape(value))
 
 
 class EASL(object):
@@ -33,6 +58,16 @@ class EASL(object):
         param_overlap=0,
         param_sample_var=False,
         param_na_adjust=False,
+        param_running_stats=False,
+        param_score_log=None,
+        param_snapshot_interval=0,
+        param_match_window=0.,
+        param_match_cache=False,
+        param_workers=1,
+        param_seed=12345,
+        param_hit_columns=None,
+        param_hit_template=None,
+        param_hit_format='csv',
     )
 
     INITIAL_ITEM_STATE = dict(
@@ -44,68 +79,253 @@ class EASL(object):
         scores='',
     )
 
+    # Item state replacing the `scores` history when running statistics
+    # (count, mean, and sum of squared deviations) are used
+    RUNNING_STATS_STATE = dict(
+        score_count=0,
+        score_mean=0.,
+        score_m2=0.,
+    )
+
     def __init__(self, params=None):
         if params is None:
             params = {}
 
         self.params = params
-        self.items = {}
-        self.headerModel = []
-        self.headerHits = []
+        # all random draws are made from this model's own generator;
+        # parallel generation uses child streams spawned from seed_seq
+        self.seed_seq = np.random.SeedSequence(self.get_param('param_seed'))
+        self.rng = np.random.default_rng(self.seed_seq.spawn(1)[0])
+        self.items = ItemStore()
+        self._loaded_header = None
+        # order of the items by mode, kept up to date (for mean windows)
+        self._mode_order = None
+        # match weights of the last anchors, kept up to date (if
+        # param_match_cache is set)
+        self._match_cache = None
+        # score log lines not yet written (see _log_scores)
+        self._unlogged_scores = []
+        # processes HITs are generated in (if param_workers is above 1),
+        # kept from call to call until the model is closed
+        self._worker_pool = None
+        # bound on the fraction of match quality mass not scored for each
+        # anchor in the last call to get_next_k (with a match window)
+        self.dropped_mass = None
         LOGGER.info("model parameters: {}".format(self.params))
 
+    @property
+    def headerModel(self):
+        return self.items.header
+
+    @property
+    def headerHits(self):
+        return hit_fieldnames(self.hit_columns(), self.get_param('param_items'))
+
+    def hit_columns(self):
+        """Return the model columns written to HIT batch files: those
+        in `param_hit_columns`, or those referenced by the HIT template
+        at `param_hit_template`, or (by default) all columns.
+        """
+        columns = self.get_param('param_hit_columns')
+        if not columns and self.get_param('param_hit_template'):
+            columns = template_columns(self.get_param('param_hit_template'))
+        if not columns:
+            return list(self.headerModel)
+        unknown_columns = [column for column in columns if column not in self.headerModel]
+        if unknown_columns:
+            raise Exception('HIT columns not in model: {}'.format(', '.join(unknown_columns)))
+        return list(columns)
+
     def get_param(self, param_name):
         return self.params.get(param_name, self.DEFAULT_PARAMS[param_name])
 
+    def uses_running_stats(self):
+        return self.get_param('param_running_stats') or 'scores' not in self.items.header
+
+    def initial_item_state(self):
+        item_state = dict(self.INITIAL_ITEM_STATE)
+        if self.get_param('param_running_stats'):
+            del item_state['scores']
+            item_state.update(self.RUNNING_STATS_STATE)
+        return item_state
+
+    @profiling.timed('init_items')
     def initItem(self, filePath):
+        item_state = self.initial_item_state()
         with open(filePath) as f:
             csvReader = csv.DictReader(f)
-            self.headerModel = csvReader.fieldnames + list(self.INITIAL_ITEM_STATE.keys())
+            self.items = ItemStore(csvReader.fieldnames + list(item_state.keys()))
             for row in csvReader:
                 if not ('id' in row and 'sent' in row):
                     raise Exception("Columns must have at least length of two (e.g., id, sent)")
 
                 out_row = dict(
-                    (k, replace_emoji_characters(html.escape(v)))
+                    (k, sanitize_value(v))
                     for (k, v) in row.items()
                 )
-                out_row.update(self.INITIAL_ITEM_STATE)
-                self.items[out_row["id"]] = out_row
+                out_row.update(item_state)
+                self.items.append(out_row)
+        profiling.count('items_initialized', len(self.items))
 
     def loadItem(self, filePath):
-        csvReader = csv.DictReader(open(filePath, 'r'))
-        self.headerModel = csvReader.fieldnames
-        for _h in self.headerModel:
-            for _i in range(1, self.get_param("param_items") + 1):
-                self.headerHits.append(_h + str(_i))
-
-        for row in csvReader:
-            self.items[row["id"]] = row
-
-    def saveItem(self, newModelPath):
-        csvWriter = csv.DictWriter(open(newModelPath, 'w', newline=''), fieldnames=self.headerModel)
-        csvWriter.writeheader()
-        for row in self.items.values():
-            csvWriter.writerow(row)
+        self.items = load_model(filePath)
+        self._unlogged_scores = []
+        self._loaded_header = list(self.items.header)
+        if 'scores' not in self.items.header:
+            for column in self.RUNNING_STATS_STATE:
+                self.items.add_column(column)
+        elif self.get_param('param_running_stats'):
+            self._convert_scores_to_running_stats()
+
+    def _convert_scores_to_running_stats(self):
+        # replace the score history of each item with its count, mean,
+        # and sum of squared deviations (moving the history to the score
+        # log, if there is one)
+        score_strs = self.items.column('scores')
+        for column in self.RUNNING_STATS_STATE:
+            self.items.add_column(column)
+        count = self.items.column('score_count')
+        mean = self.items.column('score_mean')
+        m2 = self.items.column('score_m2')
+        log_entries = []
+        for (index, score_str) in enumerate(score_strs):
+            scores = np.array([float(s) for s in score_str.split()])
+            count[index] = len(scores)
+            if len(scores) > 0:
+                mean[index] = scores.mean()
+                m2[index] = np.sum((scores - mean[index]) ** 2)
+                log_entries.append((np.full(len(scores), index), scores))
+        if log_entries:
+            self._log_scores(
+                np.concatenate([indices for (indices, _) in log_entries]),
+                np.concatenate([scores for (_, scores) in log_entries]))
+        self.items.drop_column('scores')
+
+    def _log_scores(self, indices, scores):
+        # scores are appended to the score log when the model is saved
+        # (see reset_changes), so that a model that is converted to
+        # running statistics but not saved does not log its history
+        if self.get_param('param_score_log'):
+            item_ids = self.items.ids
+            self._unlogged_scores.extend(
+                '{},{:.2f}\n'.format(item_ids[index], s_i)
+                for (index, s_i) in zip(indices.tolist(), scores.tolist()))
+
+    def _flush_score_log(self):
+        if self._unlogged_scores:
+            with open(self.get_param('param_score_log'), 'a') as f:
+                f.writelines(self._unlogged_scores)
+            self._unlogged_scores = []
+
+    def use_delta(self, iter_num):
+        """Return whether the model for iteration `iter_num` should be
+        saved as a delta (changed items only) rather than a snapshot.
+        A delta can only be written if the columns are the same as in
+        the model that was last loaded or saved.
+        """
+        snapshot_interval = self.get_param('param_snapshot_interval')
+        return (bool(snapshot_interval) and iter_num % snapshot_interval != 0 and
+                self.items.header == self._loaded_header)
+
+    def saveItem(self, newModelPath, delta=False):
+        save_model(self.items, newModelPath, delta=delta)
+        self.reset_changes()
+
+    def reset_changes(self):
+        """Mark the current items as saved: subsequent deltas only
+        contain items changed after this call, and the scores observed
+        (or converted to running statistics) so far are appended to the
+        score log.
+        """
+        self._loaded_header = list(self.items.header)
+        self._flush_score_log()
+        # keep the changes that the mode order and match cache have not
+        # been updated with
+        epochs = [
+            reader.epoch for reader in (self._mode_order, self._match_cache)
+            if reader is not None and reader.store is self.items
+        ]
+        self.items.clear_touched(keep_since=min(epochs) if epochs else None)
+
+    def mode_order(self):
+        """Return the order of the items by mode (see ModeOrder), updated
+        with the items changed since it was last returned.
+        """
+        if self._mode_order is not None and self._mode_order.store is self.items:
+            try:
+                self._mode_order.update()
+                return self._mode_order
+            except ValueError:
+                # the changes since the last update were discarded
+                pass
+        self._mode_order = ModeOrder(self.items, rng=self.rng)
+        return self._mode_order
+
+    def worker_pool(self, workers):
+        """Return the pool of `workers` processes (see WorkerPool) that
+        HITs are generated in, starting a new one if the number of
+        workers has changed.
+        """
+        if self._worker_pool is None or self._worker_pool.workers != workers:
+            self.close()
+            self._worker_pool = WorkerPool(workers)
+        return self._worker_pool
+
+    def close(self):
+        """Stop the processes HITs are generated in (if any)."""
+        if self._worker_pool is not None:
+            self._worker_pool.close()
+            self._worker_pool = None
+
+    def match_cache(self, gamma):
+        """Return the cache of match weights (see MatchCache) for
+        parameter `gamma`, starting a new one if the items or `gamma`
+        have changed or the changes since it was last used were
+        discarded.
+        """
+        cache = self._match_cache
+        if cache is None or cache.store is not self.items or cache.gamma != gamma:
+            self._match_cache = MatchCache(self.items, gamma)
+        else:
+            try:
+                self.items.touched_since(cache.epoch)
+            except ValueError:
+                self._match_cache = MatchCache(self.items, gamma)
+        return self._match_cache
 
+    @profiling.timed('write_hits')
     def generateHits(self, filePath, hitItems):
-        csvWriter = csv.DictWriter(open(filePath, 'w', newline=''), fieldnames=self.headerHits)
-        csvWriter.writeheader()
-
+        # HITs with fewer than param_items items are padded with -1
+        # (written as empty values)
         hit_item_pairs = list(hitItems.items())
-        random.shuffle(hit_item_pairs)
-        for itemID, compareIDs in hit_item_pairs:
+        self.rng.shuffle(hit_item_pairs)
+        hit_indices = np.full((len(hit_item_pairs), self.get_param('param_items')), -1, dtype=np.intp)
+        for (hit_num, (itemID, compareIDs)) in enumerate(hit_item_pairs):
             ids = [itemID] + list(compareIDs)
-            random.shuffle(ids)
-            rowDict = {}
-
-            for i, id_i in enumerate(ids):
-                for headerItem in self.headerModel:
-                    rowDict[headerItem + str(i + 1)] = self.items[id_i][headerItem]
-            csvWriter.writerow(rowDict)
-
-    def get_next_k(self, iter_num):
-        k = self.get_param('param_hits')
+            self.rng.shuffle(ids)
+            hit_indices[hit_num, :len(ids)] = [self.items.index[id_i] for id_i in ids]
+        write_hit_batch(filePath, self.items, hit_indices, self.hit_columns())
+        profiling.count('hits_written', len(hit_item_pairs))
+
+    @profiling.timed('get_next_k')
+    def get_next_k(self, iter_num, k=None, exclude=()):
+        """Select items for the next HITs.
+
+        Args:
+            iter_num (int): current iteration number
+            k (int): number of HITs (by default, `param_hits`, or enough
+                HITs to cover all items if that is zero)
+            exclude (iterable of str): ids of items that may not be
+                selected as the first item of a HIT, or, for mean
+                windows, in any HIT (ignored in the first iteration); at
+                most as many HITs as there are other items are selected
+
+        Returns:
+            dictionary from the first item id of each HIT to the list of
+            the other item ids of the HIT
+        """
+        if k is None:
+            k = self.get_param('param_hits')
         if not k:
             k = ceil(len(self.items) / self.get_param('param_items'))
 
@@ -116,7 +336,7 @@ class EASL(object):
             id_list = []
             while len(id_list) < k * self.get_param('param_items'):
                 id_sublist = list(self.items.keys())
-                random.shuffle(id_sublist)
+                self.rng.shuffle(id_sublist)
                 id_list += id_sublist
 
             for hit_num in range(k):
@@ -126,105 +346,167 @@ class EASL(object):
 
         else:
             if self.get_param('param_mean_windows'):
-                # sort items by mode
-                mode_list = sorted([
-                    (float(row['mode']), random.random(), row['id'])
-                    for row in self.items.values()])
-
-                # compute number of items needed to make `k` hits with
-                # `self.get_param('param_items']` items per hit, where each
-                # hit overlaps with its adjacent hits by `overlap` items
-                overlap = self.get_param('param_overlap')
-                num_items_per_hit = self.get_param('param_items')
-                total_num_items_needed = k * num_items_per_hit - (k - 1) * overlap
-                if total_num_items_needed > len(mode_list):
-                    raise Exception(
-                        'there are not enough items to generate {} hits with {} '
-                        'items each and overlap {}'.format(
-                            k, num_items_per_hit, overlap))
-
-                # compute number of hits to skip at the beginning of
-                # `modeList`
-                start = int((len(mode_list) - total_num_items_needed) / 2)
+                # take `k` windows of `param_items` items, each overlapping
+                # with the next by `param_overlap` items, from the middle
+                # of the items sorted by mode
+                windows = self.mode_order().windows(
+                    k, self.get_param('param_items'), self.get_param('param_overlap'),
+                    exclude=[self.items.index[item_id] for item_id in exclude])
 
                 # create hits (`k_items` is a dictionary from the first item
                 # the hit to a list of the other `k - 1` items)
-                for hit_num in range(k):
-                    hit_start = start + hit_num * (num_items_per_hit - overlap)
-                    k_items[mode_list[hit_start][2]] = [
-                        item_id
-                        for (item_mode, _, item_id)
-                        in mode_list[hit_start + 1:hit_start + num_items_per_hit]]
+                item_ids = self.items.ids
+                for window in windows.tolist():
+                    k_items[item_ids[window[0]]] = [item_ids[i] for i in window[1:]]
             else:
                 # 1. select k different items according to variance
-                var_list = []    # [(itemID, var), (itemID, var), ...]
-                index_set = set([])
-
-                for item_id, row in self.items.items():
-                    var_list.append((row["id"], float(row["var"]), random.random()))
-                    index_set.add(item_id)
-
-                var_list = sorted(var_list, key=lambda x: (-x[1], x[2]))
-                k_item_list = var_list[:k]
+                item_ids = self.items.ids
+                modes = self.items.column('mode')
+                variances = self.items.column('var')
+                anchor_variances = variances
+                if exclude:
+                    exclude_indices = np.unique([self.items.index[item_id] for item_id in exclude])
+                    anchor_variances = np.array(variances)
+                    anchor_variances[exclude_indices] = -np.inf
+                    k = min(k, len(self.items) - len(exclude_indices))
+                k_indices = top_k_random_ties(anchor_variances, k, rng=self.rng)
 
                 # 2. for each k, choose m items according to matching quality
-                for _k in k_item_list:
-                    _j = _k[0]  # itemID
-                    candidate_id = []
-                    candidate_prob = []
-                    sum_prob = 0.
-                    m_j = float(self.items[_j]["mode"])
-                    var_j = float(self.items[_j]["var"])
-                    param_gamma = float(self.get_param("param_match"))
-
-                    for _i in index_set:
-                        if _i != _j:
-                            m_i = float(self.items[_i]["mode"])
-                            var_i = float(self.items[_i]["var"])
-                            csq = 2. * param_gamma**2 + var_j + var_i
-                            match_quality = np.sqrt(
-                                2.0 * param_gamma**2 / csq
-                            ) * np.exp(
-                                -((m_j - m_i)**2) / (2.0 * csq))
-                            sum_prob += match_quality
-                            candidate_id.append(_i)
-                            candidate_prob.append(match_quality)
-
-                    candidate_prob = [p / sum_prob for p in candidate_prob]
-                    selected_ids = np.random.choice(
-                        candidate_id,
-                        self.get_param("param_items") - 1,
-                        p=candidate_prob,
-                        replace=False)
-                    k_items[_j] = selected_ids
-
+                param_gamma = float(self.get_param("param_match"))
+                num_matches = self.get_param("param_items") - 1
+                window = self.get_param("param_match_window")
+                workers = self.get_param("param_workers")
+                # the items sorted by mode are kept from round to round
+                # (see ModeOrder) rather than sorted again
+                mode_order = self.mode_order().order if window else None
+                if workers > 1:
+                    (selected_indices, dropped_mass) = sample_matches_parallel(
+                        k_indices, modes, variances, param_gamma, num_matches, workers,
+                        self.seed_seq.spawn(1)[0], window=window, mode_order=mode_order,
+                        pool=self.worker_pool(workers))
+                elif window:
+                    (selected_indices, dropped_mass) = sample_matches_windowed(
+                        k_indices, modes, variances, param_gamma, num_matches, window, rng=self.rng,
+                        mode_order=mode_order)
+                else:
+                    cache = self.match_cache(param_gamma) if self.get_param('param_match_cache') else None
+                    selected_indices = sample_matches(
+                        k_indices, modes, variances, param_gamma, num_matches, rng=self.rng, cache=cache)
+                if window:
+                    self.dropped_mass = dropped_mass
+                    LOGGER.info("match window dropped at most {:.3g} of the match quality "
+                                "mass of any anchor".format(dropped_mass.max(initial=0.)))
+                for (_j, selected) in zip(k_indices.tolist(), selected_indices.tolist()):
+                    k_items[item_ids[_j]] = [item_ids[i] for i in selected]
+
+        profiling.count('hits_selected', len(k_items))
         return k_items
 
-    def observe(self, observe_path):
-        csvReader = csv.DictReader(open(observe_path, 'r'))
-        for row in csvReader:
+    @profiling.timed('parse_results')
+    def parse_results(self, rows):
+        """Parse MTurk result rows (dictionaries, as read from a results
+        CSV file) into arrays of item indices, scores (in [0, 1]), and
+        N/A flags, one entry per answer.
+        """
+        indices = []
+        scores = []
+        is_na = []
+        for row in rows:
             for _i in range(1, self.get_param("param_items") + 1):
-                id_i = row["Input.id{}".format(_i)]
+                indices.append(self.items.index[row["Input.id{}".format(_i)]])
                 if row.get("Answer.na{}".format(_i), "off").lower() == "on":
-                    self.items[id_i]["na_count"] = int(self.items[id_i]["na_count"]) + 1
+                    scores.append(0.)
+                    is_na.append(True)
                 else:
-                    s_i = float(row["Answer.range{}".format(_i)]) / 100.
-                    self.items[id_i]["alpha"] = float(self.items[id_i]["alpha"]) + s_i
-                    self.items[id_i]["beta"] = float(self.items[id_i]["beta"]) + (1. - s_i)
-                    self.items[id_i]["scores"] += ' {:.2f}'.format(s_i)
-                self.items[id_i]["mode"] = self.mode(
-                    self.items[id_i]["alpha"],
-                    self.items[id_i]["beta"],
-                    self.items[id_i]["na_count"],
-                    self.items[id_i]["scores"])
-                self.items[id_i]["var"] = self.variance(
-                    self.items[id_i]["alpha"],
-                    self.items[id_i]["beta"],
-                    self.items[id_i]["na_count"],
-                    self.items[id_i]["scores"])
+                    scores.append(float(row["Answer.range{}".format(_i)]) / 100.)
+                    is_na.append(False)
+        return (
+            np.array(indices, dtype=np.intp),
+            np.array(scores, dtype=np.float64),
+            np.array(is_na, dtype=bool),
+        )
+
+    def observe(self, observe_path):
+        with open(observe_path, 'r') as f:
+            self.observe_batch(*self.parse_results(csv.DictReader(f)))
+
+    @profiling.timed('update_model')
+    def observe_batch(self, indices, scores, is_na):
+        """Update the model with a batch of answers given as parallel
+        arrays of item indices, scores, and N/A flags (as returned by
+        parse_results), then recompute the mode and variance of each
+        item that was answered.
+        """
+        alpha = self.items.column('alpha')
+        beta = self.items.column('beta')
+        na_count = self.items.column('na_count')
+
+        touched = np.unique(indices)
+        profiling.count('answers_observed', len(indices))
+        profiling.count('items_updated', len(touched))
+
+        np.add.at(na_count, indices[is_na], 1)
+        indices = indices[~is_na]
+        scores = scores[~is_na]
+        np.add.at(alpha, indices, scores)
+        np.add.at(beta, indices, 1. - scores)
+
+        if self.uses_running_stats():
+            self._update_running_stats(indices, scores)
+            self._log_scores(indices, scores)
+        else:
+            # append scores to each item's history, in answer order
+            score_strs = self.items.column('scores')
+            for (index, s_i) in zip(indices.tolist(), scores.tolist()):
+                score_strs[index] += ' {:.2f}'.format(s_i)
+
+        self.update_posteriors(touched)
+
+    def _update_running_stats(self, indices, scores):
+        # combine the running statistics of each item with those of its
+        # new scores (Chan et al.'s parallel variant of Welford's
+        # algorithm); scores are rounded as in the score history
+        scores = np.round(scores, 2)
+        (batch_indices, inverse) = np.unique(indices, return_inverse=True)
+        batch_count = np.bincount(inverse)
+        batch_mean = np.bincount(inverse, weights=scores) / batch_count
+        batch_m2 = np.bincount(inverse, weights=(scores - batch_mean[inverse]) ** 2)
+
+        count = self.items.column('score_count')
+        mean = self.items.column('score_mean')
+        m2 = self.items.column('score_m2')
+        old_count = count[batch_indices]
+        new_count = old_count + batch_count
+        delta = batch_mean - mean[batch_indices]
+        mean[batch_indices] += delta * batch_count / new_count
+        m2[batch_indices] += batch_m2 + delta ** 2 * old_count * batch_count / new_count
+        count[batch_indices] = new_count
+
+    def update_posteriors(self, indices=None):
+        """Recompute the mode and variance of the items at positions
+        `indices` (by default, of all items) from their state, for
+        example after changing `param_na_adjust` or `param_sample_var`.
+        """
+        if indices is None:
+            indices = np.arange(len(self.items))
+        alpha = self.items.column('alpha')[indices]
+        beta = self.items.column('beta')[indices]
+        na_count = self.items.column('na_count')[indices]
+        (score_count, score_m2) = (None, None)
+        if self.get_param('param_sample_var'):
+            if self.uses_running_stats():
+                score_count = self.items.column('score_count')[indices]
+                score_m2 = self.items.column('score_m2')[indices]
+            else:
+                score_strs = self.items.column('scores')
+                (score_count, score_m2) = score_history_stats(
+                    [score_strs[index] for index in indices.tolist()])
+        self.items.column('mode')[indices] = self.modes(alpha, beta, na_count)
+        self.items.column('var')[indices] = self.variances(alpha, beta, na_count, score_count, score_m2)
+        self.items.mark_touched(indices)
 
     def get_scores(self):
-        return dict((item['id'], item['mode']) for item in self.items.values())
+        return dict(zip(self.items.ids, self.items.column('mode').tolist()))
 
     def _process_params(self, alpha, beta, na_count, scores):
         return (
@@ -236,74 +518,328 @@ class EASL(object):
 
     def mode(self, alpha, beta, na_count, scores):
         alpha, beta, na_count, scores = self._process_params(alpha, beta, na_count, scores)
-        if self.get_param('param_na_adjust'):
-            diff = alpha - beta
-            na_count = float(na_count)
-            if diff < 0:
-                alpha += min(na_count, -diff)
-            else:
-                beta += min(na_count, diff)
-            na_count -= min(na_count, abs(diff))
-            alpha += na_count / 2.
-            beta += na_count / 2.
-
-        if alpha == 1. and beta == 1.:
-            return 0.5
-        else:
-            assert alpha + beta > 2.0
-            if alpha < 1.0 and beta < 1.0:
-                raise Exception("alpha={}, beta={}".format(str(alpha), str(beta)))
-            return (alpha - 1.0) / (alpha + beta - 2.0)
+        return self.modes(np.array([alpha]), np.array([beta]), np.array([na_count])).item()
 
     def mean(self, alpha, beta, na_count, scores):
         alpha, beta, na_count, scores = self._process_params(alpha, beta, na_count, scores)
-        return alpha / (alpha + beta)
+        return self.means(np.array([alpha]), np.array([beta]), np.array([na_count])).item()
 
     def variance(self, alpha, beta, na_count, scores):
         alpha, beta, na_count, scores = self._process_params(alpha, beta, na_count, scores)
+        (score_count, score_m2) = score_stats(np.array(scores))
+        return self.variances(
+            np.array([alpha]), np.array([beta]), np.array([na_count]),
+            np.array([score_count]), np.array([score_m2])).item()
+
+    def sample_variance(self, count, m2):
+        return self.sample_variances(np.array([count]), np.array([m2])).item()
+
+    def modes(self, alpha, beta, na_count):
+        """Return the modes of the (Beta) posteriors given by arrays
+        `alpha`, `beta` and `na_count`, redistributing the N/A counts
+        between alpha and beta first if `param_na_adjust` is set (toward
+        the smaller of the two, then evenly).
+        """
+        alpha = np.asarray(alpha, dtype=np.float64)
+        beta = np.asarray(beta, dtype=np.float64)
+        if self.get_param('param_na_adjust'):
+            na_count = np.asarray(na_count, dtype=np.float64)
+            diff = alpha - beta
+            shift = np.minimum(na_count, np.abs(diff))
+            alpha = alpha + np.where(diff < 0, shift, 0.)
+            beta = beta + np.where(diff < 0, 0., shift)
+            na_count = na_count - shift
+            alpha = alpha + na_count / 2.
+            beta = beta + na_count / 2.
+
+        uniform = (alpha == 1.) & (beta == 1.)
+        invalid = ~uniform & ((alpha + beta <= 2.) | ((alpha < 1.) & (beta < 1.)))
+        if invalid.any():
+            i = np.flatnonzero(invalid)[0]
+            raise Exception("alpha={}, beta={}".format(str(alpha[i]), str(beta[i])))
+        with np.errstate(divide='ignore', invalid='ignore'):
+            return np.where(uniform, 0.5, (alpha - 1.0) / (alpha + beta - 2.0))
+
+    def means(self, alpha, beta, na_count):
+        """Return the means of the posteriors given by arrays `alpha`,
+        `beta` and `na_count`."""
+        alpha = np.asarray(alpha, dtype=np.float64)
+        beta = np.asarray(beta, dtype=np.float64)
+        return alpha / (alpha + beta)
+
+    def variances(self, alpha, beta, na_count, score_count=None, score_m2=None):
+        """Return the variances of the items given by arrays `alpha`,
+        `beta` and `na_count`: the sample variances of their scores
+        (given by arrays `score_count` and `score_m2`, see
+        sample_variances) if `param_sample_var` is set, otherwise the
+        variances of their posteriors (counting N/A answers toward the
+        number of observations if `param_na_adjust` is set).
+        """
         if self.get_param("param_sample_var"):
-            if len(scores) == 0:
-                return 1.
-            elif len(scores) == 1:
-                return 0.75
-            else:
-                return np.var(scores, ddof=1)
-        elif self.get_param("param_na_adjust"):
-            return (alpha * beta) / ((np.power(alpha + beta + na_count, 2.0)) * (alpha + beta + na_count + 1))
+            return self.sample_variances(score_count, score_m2)
+        alpha = np.asarray(alpha, dtype=np.float64)
+        beta = np.asarray(beta, dtype=np.float64)
+        if self.get_param("param_na_adjust"):
+            total = alpha + beta + na_count
         else:
-            return (alpha * beta) / ((np.power(alpha + beta, 2.0)) * (alpha + beta + 1))
-
-
-def run(operation, model_path, params):
-    if operation not in ('update', 'update-generate', 'generate'):
-        raise ValueError('unknown operation {}'.format(operation))
+            total = alpha + beta
+        return (alpha * beta) / ((np.power(total, 2.0)) * (total + 1))
+
+    def sample_variances(self, count, m2):
+        """Return the sample variances of items with `count` scores whose
+        sums of squared deviations from their means are `m2` (arrays),
+        using variance 1 for items with no scores and 0.75 for items
+        with one score.
+        """
+        count = np.asarray(count)
+        m2 = np.asarray(m2, dtype=np.float64)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            return np.where(count == 0, 1., np.where(count == 1, 0.75, m2 / (count - 1)))
+
+
+def score_stats(scores):
+    """Return the number of `scores` (an array) and the sum of their
+    squared deviations from their mean."""
+    if len(scores) < 2:
+        return (len(scores), 0.)
+    return (len(scores), np.sum((scores - scores.mean()) ** 2))
+
+
+def score_history_stats(score_strs):
+    """Return arrays of the number of scores and of the sum of squared
+    deviations of the scores from their mean (see score_stats) for each
+    of the score histories `score_strs` (strings of space-separated
+    scores).
+    """
+    count = np.zeros(len(score_strs), dtype=np.int64)
+    m2 = np.zeros(len(score_strs), dtype=np.float64)
+    for (i, score_str) in enumerate(score_strs):
+        (count[i], m2[i]) = score_stats(np.array([float(s) for s in score_str.split()]))
+    return (count, m2)
 
-    model = EASL(params)
 
-    model_dir = os.path.dirname(model_path)
-    model_name = "_".join(os.path.basename(model_path).split('_')[:-1])
-    iter_num = int(os.path.splitext(os.path.basename(model_path))[0].split('_')[-1])
+class Session(object):
+    """
+    Long-running EASL session that keeps the model for a sequence of
+    rounds in memory.  Each round, HIT results are applied to the model
+    (observe_results), a new model is saved (checkpoint), and a new HIT
+    batch is generated (next_batch).
+    """
 
-    if operation in ("update", "update-generate"):
-        # update the model
-        observe_path = os.path.join(model_dir, model_name + '_result_' + str(iter_num + 1) + os.extsep + "csv")
+    def __init__(self, model_path, params=None):
+        self.model = EASL(params)
+        (self.model_dir, self.model_name, self.iter_num, self.model_ext) = split_model_path(model_path)
+        self.model.loadItem(model_path)
+        self.checkpoint_iter_num = self.iter_num
+        self._executor = None
+        self._pending = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def model_path(self, iter_num=None):
+        if iter_num is None:
+            iter_num = self.iter_num
+        return join_model_path(self.model_dir, self.model_name, iter_num, self.model_ext)
+
+    def result_path(self, iter_num=None):
+        if iter_num is None:
+            iter_num = self.iter_num + 1
+        return os.path.join(self.model_dir, self.model_name + '_result_' + str(iter_num) + os.extsep + "csv")
+
+    def hit_path(self, iter_num=None):
+        if iter_num is None:
+            iter_num = self.iter_num + 1
+        return os.path.join(self.model_dir, self.model_name + '_hit_' + str(iter_num) + os.extsep +
+                            self.model.get_param('param_hit_format'))
+
+    def observe_results(self, rows):
+        """Update the model with HIT result rows (dictionaries, as read
+        from a results CSV file) and advance to the next iteration.
+        """
+        self.model.observe_batch(*self.model.parse_results(rows))
+        self.iter_num += 1
+
+    @profiling.timed('observe')
+    def observe_file(self, observe_path=None):
+        """Update the model with the HIT results CSV file for the next
+        iteration (or the file at `observe_path`) and advance to the next
+        iteration.
+        """
+        if observe_path is None:
+            observe_path = self.result_path()
         if not os.path.exists(observe_path):
             raise Exception("Mturk result file is not found. {} is expected.".format(observe_path))
+        with open(observe_path, 'r') as f:
+            self.observe_results(csv.DictReader(f))
+
+    @profiling.timed('next_batch')
+    def next_batch(self, hit_path=None, k=None, exclude=()):
+        """Generate HITs from the current model, write them to the HIT
+        batch CSV file for the next iteration (or `hit_path`), and return
+        the path of that file.  `k` and `exclude` are passed to
+        EASL.get_next_k.
+        """
+        if hit_path is None:
+            hit_path = self.hit_path()
+        next_items = self.model.get_next_k(self.iter_num, k=k, exclude=exclude)
+        self.model.generateHits(hit_path, next_items)
+        return hit_path
+
+    @profiling.timed('checkpoint')
+    def checkpoint(self, background=False):
+        """Save the model for the current iteration.  If `background` is
+        true, save a copy of the model in a background thread and return
+        a future for the save; otherwise save the model and return its
+        path.
+        """
+        model_path = self.model_path()
+        # deltas are only valid relative to the previous iteration
+        delta = self.model.use_delta(self.iter_num) and self.checkpoint_iter_num == self.iter_num - 1
+        self.checkpoint_iter_num = self.iter_num
+        if background:
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(max_workers=1)
+            items = self.model.items.copy()
+            self.model.reset_changes()
+            future = self._executor.submit(save_model, items, model_path, delta)
+            self._pending.append(future)
+            return future
+        else:
+            self.wait()
+            self.model.saveItem(model_path, delta=delta)
+            return model_path
+
+    def wait(self):
+        """Wait for background checkpoints to finish (raising any errors
+        they raised).
+        """
+        pending = self._pending
+        self._pending = []
+        for future in pending:
+            future.result()
+
+    def close(self):
+        self.wait()
+        if self._executor is not None:
+            self._executor.shutdown()
+            self._executor = None
+        self.model.close()
+
+
+def _format_cell(column, value):
+    # format a value as ItemStore.format_row formats it once stored
+    if column in NUMERIC_COLUMNS:
+        if isinstance(value, str):
+            value = float(value)
+        value = np.asarray(value, dtype=NUMERIC_COLUMNS[column])[()]
+    return format_value(value)
+
+
+def _sanitize_rows(rows):
+    return [[sanitize_value(value) for value in row] for row in rows]
+
+
+def _iter_chunks(iterable, chunk_size):
+    chunk = []
+    for x in iterable:
+        chunk.append(x)
+        if len(chunk) >= chunk_size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+def _map_chunks(function, chunks, workers):
+    # map `function` over `chunks` (in order) in a pool of `workers`
+    # processes, with at most 2 * workers chunks in flight
+    if workers <= 1:
+        for chunk in chunks:
+            yield function(chunk)
+        return
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        pending = deque()
+        for chunk in chunks:
+            pending.append(executor.submit(function, chunk))
+            if len(pending) >= 2 * workers:
+                yield pending.popleft().result()
+        while pending:
+            yield pending.popleft().result()
+
+
+@profiling.timed('init_items')
+def initialize(items_path, model_path, params=None, chunk_size=DEFAULT_CHUNK_SIZE, workers=1):
+    """Write the initial EASL model for the items in the CSV file at
+    `items_path` (with columns id, sent) to `model_path`, as initItem
+    followed by saveItem would, but streaming: rows are read, sanitized
+    and written `chunk_size` at a time, sanitizing the chunks in a pool
+    of `workers` processes, so the items are never all in memory.
+    Binary models are built in memory.
+    """
+    model = EASL(params)
+    if is_binary_model_path(model_path):
+        model.initItem(items_path)
+        model.saveItem(model_path)
+        return
+
+    item_state = model.initial_item_state()
+    with open(items_path) as in_f, open(model_path, 'w', newline='') as out_f:
+        reader = csv.reader(in_f)
+        fieldnames = next(reader, [])
+        if not ('id' in fieldnames and 'sent' in fieldnames):
+            raise Exception("Columns must have at least length of two (e.g., id, sent)")
+        # (as in a csv.DictReader row, the last of any duplicate columns
+        # holds the value)
+        positions = dict((column, i) for (i, column) in enumerate(fieldnames))
+        header = ItemStore(fieldnames + list(item_state.keys())).header
+        state_cells = dict((column, _format_cell(column, value)) for (column, value) in item_state.items())
+        numeric_columns = [
+            column for column in positions
+            if column in NUMERIC_COLUMNS and column not in state_cells]
+        id_position = positions['id']
+
+        writer = csv.writer(out_f)
+        writer.writerow(header)
+        item_ids = set()
+        # (csv.DictReader skips empty rows)
+        rows = (row for row in reader if row)
+        for chunk in _map_chunks(_sanitize_rows, _iter_chunks(rows, chunk_size), workers):
+            out_rows = []
+            for row in chunk:
+                if len(row) != len(fieldnames):
+                    raise Exception('row {} has {} fields; expected {}'.format(
+                        len(item_ids) + len(out_rows) + 1, len(row), len(fieldnames)))
+                item_id = row[id_position]
+                if item_id in item_ids:
+                    raise ValueError('duplicate item id {}'.format(item_id))
+                item_ids.add(item_id)
+                for column in numeric_columns:
+                    row[positions[column]] = _format_cell(column, row[positions[column]])
+                out_rows.append([
+                    state_cells[column] if column in state_cells else row[positions[column]]
+                    for column in header
+                ])
+            writer.writerows(out_rows)
+        profiling.count('items_initialized', len(item_ids))
+
 
-        new_model_path = os.path.join(model_dir, model_name + '_' + str(iter_num + 1) + os.extsep + "csv")
-        model.loadItem(model_path)
-        model.observe(observe_path)
-        model.saveItem(new_model_path)
+def run(operation, model_path, params):
+    if operation not in ('update', 'update-generate', 'generate'):
+        raise ValueError('unknown operation {}'.format(operation))
 
-        model_path = new_model_path
-        iter_num += 1
+    with Session(model_path, params) as session:
+        if operation in ("update", "update-generate"):
+            # update the model
+            session.observe_file()
+            session.checkpoint()
 
-    if operation in ("generate", "update-generate"):
-        # generate next hits
-        model.loadItem(model_path)
-        hit_path = os.path.join(model_dir, model_name + '_hit_' + str(iter_num + 1) + os.extsep + "csv")
-        next_items = model.get_next_k(iter_num)
-        model.generateHits(hit_path, next_items)
+        if operation in ("generate", "update-generate"):
+            # generate next hits
+            session.next_batch()
 
 
 def evaluate(model_path, gold_standard_path):
@@ -313,10 +849,7 @@ def evaluate(model_path, gold_standard_path):
     ids = sorted(model_scores_map.keys())
     model_scores = [model_scores_map[id_] for id_ in ids]
 
-    gold_labels_map = dict()
-    with open(gold_standard_path) as f:
-        for row in DictReader(f):
-            gold_labels_map[row['id']] = float(row['label'])
+    gold_labels_map = load_gold(gold_standard_path)
     gold_labels = [gold_labels_map[id_] for id_ in ids]
 
     print(spearmanr(gold_labels, model_scores).correlation)
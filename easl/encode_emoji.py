@@ -6,6 +6,34 @@ import re
 import sys
 
 
+# The procedure for stripping Emoji characters is based on this
+# StackOverflow post:
+#   http://stackoverflow.com/questions/12636489/python-convert-4-byte-char-to-avoid-mysql-error-incorrect-string-value
+if sys.maxunicode == 1114111:
+    # Python was built with '--enable-unicode=ucs4'
+    HIGHPOINTS_RE = re.compile(u'[\U00010000-\U0010ffff]')
+elif sys.maxunicode == 65535:
+    # Python was built with '--enable-unicode=ucs2'
+    HIGHPOINTS_RE = re.compile(u'[\uD800-\uDBFF][\uDC00-\uDFFF]')
+else:
+    raise UnicodeError(
+        "Unable to determine if Python was built using UCS-2 or UCS-4")
+
+
+def _emoji_match_to_span(emoji_match):
+    """
+    Args:
+        emoji_match (MatchObject):
+
+    Returns:
+        Unicode string
+    """
+    bytes = codecs.encode(emoji_match.group(), 'utf-8')
+    bytes_as_json = json.dumps([b for b in bytearray(bytes)])
+    return u"<span class='emoji-bytes' data-emoji-bytes='%s'></span>" % \
+        bytes_as_json
+
+
 def replace_emoji_characters(s):
     """Replace 4-byte characters with HTML spans with bytes as JSON array
 
@@ -21,33 +49,7 @@ def replace_emoji_characters(s):
         Unicode string with all 4-byte Unicode characters in the source
         string replaced with HTML spans
     """
-    def _emoji_match_to_span(emoji_match):
-        """
-        Args:
-            emoji_match (MatchObject):
-
-        Returns:
-            Unicode string
-        """
-        bytes = codecs.encode(emoji_match.group(), 'utf-8')
-        bytes_as_json = json.dumps([b for b in bytearray(bytes)])
-        return u"<span class='emoji-bytes' data-emoji-bytes='%s'></span>" % \
-            bytes_as_json
-
-    # The procedure for stripping Emoji characters is based on this
-    # StackOverflow post:
-    #   http://stackoverflow.com/questions/12636489/python-convert-4-byte-char-to-avoid-mysql-error-incorrect-string-value
-    if sys.maxunicode == 1114111:
-        # Python was built with '--enable-unicode=ucs4'
-        highpoints = re.compile(u'[\U00010000-\U0010ffff]')
-    elif sys.maxunicode == 65535:
-        # Python was built with '--enable-unicode=ucs2'
-        highpoints = re.compile(u'[\uD800-\uDBFF][\uDC00-\uDFFF]')
-    else:
-        raise UnicodeError(
-            "Unable to determine if Python was built using UCS-2 or UCS-4")
-
-    return highpoints.sub(_emoji_match_to_span, s)
+    return HIGHPOINTS_RE.sub(_emoji_match_to_span, s)
 
 
 def main():
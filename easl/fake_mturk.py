@@ -0,0 +1,258 @@
+# -*- coding: utf-8 -*-
+
+from datetime import datetime, timedelta, timezone
+from time import monotonic, sleep
+import threading
+
+import numpy as np
+from botocore.exceptions import ClientError
+
+from .annotator import GoldAnnotator
+from .mturk import ID_RE
+
+
+# Number of results per page returned by the paginators (the MTurk
+# maximum)
+PAGE_SIZE = 100
+
+ANSWER_XML_HEAD = (
+    '<?xml version="1.0" encoding="UTF-8"?>'
+    '<QuestionFormAnswers xmlns="http://mechanicalturk.amazonaws.com/'
+    'AWSMechanicalTurkDataSchemas/2005-10-01/QuestionFormAnswers.xsd">')
+ANSWER_XML_TAIL = '</QuestionFormAnswers>'
+ANSWER_FIELD_XML = ('<Answer><QuestionIdentifier>{}</QuestionIdentifier>'
+                    '<FreeText>{}</FreeText></Answer>')
+
+
+def answer_xml(answers):
+    """Return a QuestionFormAnswers XML document for a list of (question
+    identifier, free text) pairs."""
+    return ANSWER_XML_HEAD + ''.join(
+        ANSWER_FIELD_XML.format(name, value) for (name, value) in answers
+    ) + ANSWER_XML_TAIL
+
+
+class FakePaginator(object):
+    def __init__(self, method):
+        self.method = method
+
+    def paginate(self, **kwargs):
+        next_token = None
+        while True:
+            page_kwargs = dict(kwargs)
+            if next_token is not None:
+                page_kwargs['NextToken'] = next_token
+            page = self.method(**page_kwargs)
+            yield page
+            next_token = page.get('NextToken')
+            if next_token is None:
+                break
+
+
+class FakeMTurkClient(object):
+    """
+    In-process stand-in for the boto3 MTurk client, implementing the
+    requests used by easl.mturk.  Every request takes `latency` seconds
+    and fails with a ThrottlingException with probability
+    `throttle_rate`.  Each assignment of a HIT is submitted a random
+    time (uniform in `work_time`, in seconds) after the HIT is created,
+    with answers given by `annotator` (a GoldAnnotator, or the path of a
+    gold standard CSV file to create one from).  Its workers accept a
+    HIT when it is created, so they still submit the assignments of an
+    expired HIT.  The client is thread safe.
+    """
+
+    def __init__(self, annotator, latency=0., throttle_rate=0., work_time=(0., 0.),
+                 num_workers=10, seed=None):
+        if isinstance(annotator, str):
+            annotator = GoldAnnotator(annotator, rng=np.random.default_rng(seed))
+        self.annotator = annotator
+        self.latency = latency
+        self.throttle_rate = throttle_rate
+        self.work_time = work_time
+        self.num_workers = num_workers
+        self.rng = np.random.default_rng(seed)
+        # throttling draws have their own generator, so that which
+        # requests are throttled does not depend on thread scheduling
+        self.throttle_rng = np.random.default_rng(None if seed is None else [seed, 1])
+        self.lock = threading.Lock()
+        self.hits = dict()
+        self.hit_ids_by_token = dict()
+        self.assignments = dict()
+        # HIT id -> list of (submit time, assignment id) pairs of
+        # assignments not yet submitted
+        self.pending = dict()
+        self.num_requests = 0
+        self.num_throttled = 0
+
+    def _request(self, operation_name):
+        with self.lock:
+            self.num_requests += 1
+            throttle = self.throttle_rng.random() < self.throttle_rate
+            if throttle:
+                self.num_throttled += 1
+        if self.latency:
+            sleep(self.latency)
+        if throttle:
+            raise ClientError(
+                {'Error': {'Code': 'ThrottlingException', 'Message': 'Rate exceeded'}},
+                operation_name)
+
+    def _request_error(self, operation_name, message):
+        return ClientError({'Error': {'Code': 'RequestError', 'Message': message}}, operation_name)
+
+    def _submit_due_assignments(self, hit_ids=None):
+        # submit the assignments (of the specified HITs, or all HITs)
+        # whose work time has passed, holding the lock
+        now = monotonic()
+        if hit_ids is None:
+            hit_ids = list(self.pending)
+        for hit_id in hit_ids:
+            pending = self.pending.get(hit_id)
+            if not pending or pending[0][0] > now:
+                continue
+            due = [assignment_id for (submit_time, assignment_id) in pending if submit_time <= now]
+            pending = [(submit_time, assignment_id) for (submit_time, assignment_id) in pending
+                       if submit_time > now]
+            for assignment_id in due:
+                self._submit_assignment(self.assignments[assignment_id])
+            if pending:
+                self.pending[hit_id] = pending
+            else:
+                del self.pending[hit_id]
+                self.hits[hit_id]['HITStatus'] = 'Reviewable'
+
+    def _submit_assignment(self, assignment):
+        hit = self.hits[assignment['HITId']]
+        params = hit['_Params']
+        num_items = len([name for name in params if ID_RE.match(name)])
+        item_ids = [params['id{}'.format(i)] for i in range(1, num_items + 1)]
+        (scores, is_na) = self.annotator.annotate(item_ids)
+        answers = []
+        for (i, (score, na)) in enumerate(zip(scores.tolist(), is_na.tolist())):
+            answers.append(('range{}'.format(i + 1), int(round(score * 100))))
+            if na:
+                answers.append(('na{}'.format(i + 1), 'on'))
+        now = datetime.now(timezone.utc)
+        assignment.update(
+            AssignmentStatus='Submitted',
+            AcceptTime=now - timedelta(seconds=assignment.pop('_WorkTime')),
+            SubmitTime=now,
+            Answer=answer_xml(answers),
+        )
+
+    def _public(self, record):
+        return dict((k, v) for (k, v) in record.items() if not k.startswith('_'))
+
+    def _page(self, results, result_key, NextToken=None, MaxResults=PAGE_SIZE):
+        start = int(NextToken) if NextToken is not None else 0
+        end = start + MaxResults
+        page = {result_key: results[start:end], 'NumResults': len(results[start:end])}
+        if end < len(results):
+            page['NextToken'] = str(end)
+        return page
+
+    def get_paginator(self, operation_name):
+        if operation_name == 'list_assignments_for_hit':
+            return FakePaginator(self.list_assignments_for_hit)
+        elif operation_name == 'list_reviewable_hits':
+            return FakePaginator(self.list_reviewable_hits)
+        else:
+            raise ValueError('unsupported operation {}'.format(operation_name))
+
+    def create_hit_with_hit_type(self, HITTypeId, LifetimeInSeconds, MaxAssignments=1,
+                                 UniqueRequestToken=None, HITLayoutId=None,
+                                 HITLayoutParameters=(), RequesterAnnotation='', **kwargs):
+        self._request('CreateHITWithHITType')
+        with self.lock:
+            if UniqueRequestToken is not None and UniqueRequestToken in self.hit_ids_by_token:
+                # the real service rejects a reused token; its HIT
+                # already exists
+                raise self._request_error(
+                    'CreateHITWithHITType',
+                    'The HIT with ID "{}" already exists.'.format(self.hit_ids_by_token[UniqueRequestToken]))
+            hit_id = 'HIT{:08d}'.format(len(self.hits))
+            if UniqueRequestToken is not None:
+                self.hit_ids_by_token[UniqueRequestToken] = hit_id
+            now = datetime.now(timezone.utc)
+            hit = dict(
+                HITId=hit_id,
+                HITTypeId=HITTypeId,
+                HITLayoutId=HITLayoutId,
+                RequesterAnnotation=RequesterAnnotation,
+                MaxAssignments=MaxAssignments,
+                HITStatus='Assignable',
+                CreationTime=now,
+                Expiration=now + timedelta(seconds=LifetimeInSeconds),
+                _Params=dict((p['Name'], p['Value']) for p in HITLayoutParameters),
+                _AssignmentIds=[],
+            )
+            self.hits[hit_id] = hit
+            self.pending[hit_id] = []
+            created = monotonic()
+            for _ in range(MaxAssignments):
+                assignment_id = 'ASSIGNMENT{:08d}'.format(len(self.assignments))
+                work_time = self.rng.uniform(*self.work_time)
+                self.assignments[assignment_id] = dict(
+                    AssignmentId=assignment_id,
+                    WorkerId='WORKER{}'.format(self.rng.integers(self.num_workers)),
+                    HITId=hit_id,
+                    AssignmentStatus='Pending',
+                    _WorkTime=work_time,
+                )
+                hit['_AssignmentIds'].append(assignment_id)
+                self.pending[hit_id].append((created + work_time, assignment_id))
+            self.pending[hit_id].sort()
+            return dict(HIT=self._public(hit))
+
+    def list_assignments_for_hit(self, HITId, AssignmentStatuses=('Submitted', 'Approved'),
+                                 NextToken=None, MaxResults=PAGE_SIZE):
+        self._request('ListAssignmentsForHIT')
+        with self.lock:
+            if HITId not in self.hits:
+                raise self._request_error('ListAssignmentsForHIT', 'HIT {} does not exist.'.format(HITId))
+            self._submit_due_assignments([HITId])
+            assignments = [
+                self._public(self.assignments[assignment_id])
+                for assignment_id in self.hits[HITId]['_AssignmentIds']
+                if self.assignments[assignment_id]['AssignmentStatus'] in AssignmentStatuses
+            ]
+        return self._page(assignments, 'Assignments', NextToken=NextToken, MaxResults=MaxResults)
+
+    def list_reviewable_hits(self, HITTypeId=None, Status='Reviewable', NextToken=None, MaxResults=PAGE_SIZE):
+        self._request('ListReviewableHITs')
+        with self.lock:
+            self._submit_due_assignments()
+            hits = [
+                self._public(hit) for hit in self.hits.values()
+                if hit['HITStatus'] == Status and (HITTypeId is None or hit['HITTypeId'] == HITTypeId)
+            ]
+        return self._page(hits, 'HITs', NextToken=NextToken, MaxResults=MaxResults)
+
+    def update_expiration_for_hit(self, HITId, ExpireAt):
+        self._request('UpdateExpirationForHIT')
+        with self.lock:
+            if HITId not in self.hits:
+                raise self._request_error('UpdateExpirationForHIT', 'HIT {} does not exist.'.format(HITId))
+            self.hits[HITId]['Expiration'] = ExpireAt
+        return dict()
+
+    def approve_assignment(self, AssignmentId, RequesterFeedback=None, OverrideRejection=False):
+        self._request('ApproveAssignment')
+        with self.lock:
+            assignment = self.assignments.get(AssignmentId)
+            if assignment is None or assignment['AssignmentStatus'] != 'Submitted':
+                raise self._request_error(
+                    'ApproveAssignment', 'Assignment {} is not submitted.'.format(AssignmentId))
+            assignment['AssignmentStatus'] = 'Approved'
+            assignment['ApprovalTime'] = datetime.now(timezone.utc)
+        return dict()
+
+    def get_assignment(self, AssignmentId):
+        self._request('GetAssignment')
+        with self.lock:
+            assignment = self.assignments.get(AssignmentId)
+            if assignment is None:
+                raise self._request_error('GetAssignment', 'Assignment {} does not exist.'.format(AssignmentId))
+            self._submit_due_assignments([assignment['HITId']])
+            return dict(Assignment=self._public(assignment), HIT=self._public(self.hits[assignment['HITId']]))
@@ -0,0 +1,126 @@
+# -*- coding: utf-8 -*-
+
+import csv
+import gzip
+import io
+import json
+import re
+
+import numpy as np
+
+
+# HIT batch file formats (and file extensions): CSV or JSON lines, either
+# of which may be gzip-compressed
+HIT_FORMATS = ('csv', 'jsonl', 'csv.gz', 'jsonl.gz')
+
+# Size of the write buffer of HIT batch files
+BUFFER_SIZE = 1 << 20
+
+# Placeholder of a HIT parameter in a template (as `${sent1}`), capturing
+# the column name
+TEMPLATE_PARAM_RE = re.compile(r'\$\{([A-Za-z_][A-Za-z0-9_]*?)\d+\}')
+
+# Form field of a HIT template (an input, text area or selection),
+# capturing the name under which its answer is submitted
+TEMPLATE_ANSWER_RE = re.compile(r'<(?:input|textarea|select)\b[^>]*?\bname="([^"]+)"', re.IGNORECASE)
+
+
+def hit_batch_format(path):
+    """Return the format of the HIT batch file at `path` (`csv` or
+    `jsonl`, by extension, defaulting to `csv`) and whether it is
+    gzip-compressed (if `path` ends in `.gz`).
+    """
+    compressed = path.endswith('.gz')
+    if compressed:
+        path = path[:-len('.gz')]
+    return ('jsonl' if path.endswith('.jsonl') else 'csv', compressed)
+
+
+def open_hit_batch(path, mode='r'):
+    """Open the (possibly gzip-compressed) HIT batch file at `path` in
+    text mode `mode` (`r` or `w`)."""
+    (_, compressed) = hit_batch_format(path)
+    if compressed:
+        return gzip.open(path, mode + 't', encoding='utf-8', newline='')
+    elif mode == 'w':
+        return io.open(path, mode, encoding='utf-8', newline='', buffering=BUFFER_SIZE)
+    else:
+        return io.open(path, mode, encoding='utf-8', newline='')
+
+
+def template_columns(template_path):
+    """Return the model columns referenced by the HIT template (HTML
+    file) at `template_path`, in order of first reference: a template
+    referencing `${id1}` and `${sent1}` references columns `id` and
+    `sent`.
+    """
+    with open(template_path) as f:
+        return list(dict.fromkeys(TEMPLATE_PARAM_RE.findall(f.read())))
+
+
+def template_answer_names(template_path):
+    """Return the names of the answer fields of the HIT template (HTML
+    file) at `template_path` (the names of its form fields, such as
+    `range1`, `na1` and `Comments`), in order of first appearance.
+    """
+    with open(template_path) as f:
+        return list(dict.fromkeys(TEMPLATE_ANSWER_RE.findall(f.read())))
+
+
+def hit_fieldnames(columns, num_items):
+    """Return the names of the fields of a HIT batch with `num_items`
+    items per HIT: each of `columns`, numbered from 1 to `num_items`.
+    """
+    return [column + str(i) for column in columns for i in range(1, num_items + 1)]
+
+
+def write_hit_batch(path, store, hit_indices, columns=None):
+    """Write a HIT batch file with one HIT per row of `hit_indices` (a
+    two-dimensional integer array of item positions in `store`, padded
+    with -1 for HITs with fewer items), holding the (formatted) values
+    of `columns` (by default, all columns of `store`) for each item.
+    The values are gathered column by column rather than item by item.
+
+    The format is chosen by the extension of `path` (see
+    hit_batch_format): CSV (as the MTurk web interface expects) or JSON
+    lines, either of which may be gzip-compressed.
+    """
+    if columns is None:
+        columns = store.header
+    hit_indices = np.asarray(hit_indices, dtype=np.intp)
+    num_items = hit_indices.shape[1]
+    padding = hit_indices < 0
+    gather_indices = np.where(padding, 0, hit_indices)
+
+    fields = []
+    for column in columns:
+        for i in range(num_items):
+            values = store.format_column(column, gather_indices[:, i])
+            for j in np.flatnonzero(padding[:, i]).tolist():
+                values[j] = ''
+            fields.append(values)
+
+    fieldnames = hit_fieldnames(columns, num_items)
+    (batch_format, _) = hit_batch_format(path)
+    with open_hit_batch(path, 'w') as f:
+        if batch_format == 'jsonl':
+            for row in zip(*fields):
+                f.write(json.dumps(dict(zip(fieldnames, row))) + '\n')
+        else:
+            writer = csv.writer(f)
+            writer.writerow(fieldnames)
+            writer.writerows(zip(*fields))
+
+
+def iter_hit_batch(path):
+    """Generate the HITs in the HIT batch file at `path` (see
+    write_hit_batch) as dictionaries from field name to value."""
+    (batch_format, _) = hit_batch_format(path)
+    with open_hit_batch(path) as f:
+        if batch_format == 'jsonl':
+            for line in f:
+                if line.strip():
+                    yield json.loads(line)
+        else:
+            for row in csv.DictReader(f):
+                yield row
@@ -0,0 +1,338 @@
+# -*- coding: utf-8 -*-
+
+import numpy as np
+
+from . import profiling
+from .selection import gumbel_top_k
+
+
+# Maximum number of anchor/candidate pairs scored at a time; bounds the
+# size of the intermediate (anchors x items) matrices.
+DEFAULT_BLOCK_SIZE = 2 ** 22
+
+# Maximum size (in bytes) of the log match weights held by a MatchCache
+# (256 MiB, the weights of 2 ** 25 anchor/candidate pairs)
+DEFAULT_MAX_CACHE_BYTES = 2 ** 28
+
+# Anchors whose match windows are scored together (see
+# sample_matches_windowed) score at most this many times as many pairs
+# as their windows hold
+MAX_WINDOW_GROWTH = 1.1
+
+
+def match_quality(anchor_modes, anchor_vars, modes, variances, gamma):
+    """Compute the EASL match quality between anchors and candidates
+
+    The match quality between anchor j and candidate i is
+
+      sqrt(2 gamma^2 / c^2) exp(-(m_j - m_i)^2 / (2 c^2))
+
+    where c^2 = 2 gamma^2 + var_j + var_i.
+
+    Args:
+        anchor_modes (array of k floats): modes of the anchor items
+        anchor_vars (array of k floats): variances of the anchor items
+        modes (array of N floats): modes of the candidate items
+        variances (array of N floats): variances of the candidate items
+        gamma (float): match quality parameter
+
+    Returns:
+        k x N float array of match qualities
+    """
+    return np.exp(log_match_quality(anchor_modes, anchor_vars, modes, variances, gamma))
+
+
+def log_match_quality(anchor_modes, anchor_vars, modes, variances, gamma):
+    """Compute the logarithm of the EASL match quality (see
+    match_quality) between anchors and candidates, as a k x N float
+    array.
+    """
+    anchor_modes = np.asarray(anchor_modes, dtype=np.float64)[:, np.newaxis]
+    anchor_vars = np.asarray(anchor_vars, dtype=np.float64)[:, np.newaxis]
+    modes = np.asarray(modes, dtype=np.float64)[np.newaxis, :]
+    variances = np.asarray(variances, dtype=np.float64)[np.newaxis, :]
+
+    two_gamma_sq = 2.0 * gamma ** 2
+    csq = two_gamma_sq + anchor_vars + variances
+    diff = anchor_modes - modes
+    return 0.5 * np.log(two_gamma_sq / csq) - (diff * diff) / (2.0 * csq)
+
+
+def iter_log_match_weights(anchor_indices, modes, variances, gamma,
+                           block_size=DEFAULT_BLOCK_SIZE):
+    """Compute, for each anchor, the unnormalized log-probability of
+    selecting each item as a comparison item (the log match quality,
+    or -inf for the anchor itself).
+
+    Anchors are processed in blocks so that at most (approximately)
+    `block_size` anchor/candidate pairs are scored at once.
+
+    Args:
+        anchor_indices (array of k ints): indices of the anchor items
+        modes (array of N floats): modes of all items
+        variances (array of N floats): variances of all items
+        gamma (float): match quality parameter
+        block_size (int): maximum number of pairs scored at once
+
+    Yields:
+        (start, end, log_weights) triples where `log_weights` is a
+        (end - start) x N float array holding the log weights for anchors
+        `anchor_indices[start:end]`
+    """
+    anchor_indices = np.asarray(anchor_indices, dtype=np.intp)
+    modes = np.asarray(modes, dtype=np.float64)
+    variances = np.asarray(variances, dtype=np.float64)
+    anchors_per_block = max(1, block_size // max(1, len(modes)))
+    for start in range(0, len(anchor_indices), anchors_per_block):
+        end = min(start + anchors_per_block, len(anchor_indices))
+        block_indices = anchor_indices[start:end]
+        log_weights = log_match_quality(
+            modes[block_indices], variances[block_indices],
+            modes, variances, gamma)
+        log_weights[np.arange(end - start), block_indices] = -np.inf
+        profiling.count('pairs_scored', log_weights.size)
+        yield (start, end, log_weights)
+
+
+def sample_matches(anchor_indices, modes, variances, gamma, num_matches,
+                   rng=None, block_size=DEFAULT_BLOCK_SIZE, cache=None):
+    """Sample `num_matches` comparison items for each anchor, without
+    replacement, with probability proportional to match quality.  If
+    `cache` (a MatchCache for `gamma`) is specified, the match weights
+    of anchors it holds are reused rather than recomputed.
+
+    Returns:
+        k x num_matches int array of item indices
+    """
+    if cache is None:
+        log_weight_blocks = iter_log_match_weights(
+            anchor_indices, modes, variances, gamma, block_size=block_size)
+    else:
+        log_weight_blocks = cache.iter_log_match_weights(
+            anchor_indices, modes, variances, block_size=block_size)
+    selected = np.zeros((len(anchor_indices), num_matches), dtype=np.intp)
+    for (start, end, log_weights) in log_weight_blocks:
+        selected[start:end] = gumbel_top_k(log_weights, num_matches, rng=rng)
+    return selected
+
+
+def variance_buckets(variances, gamma):
+    """Partition items by variance into buckets within which
+    2 gamma^2 + var_i varies by less than a factor of 2: item i is in
+    bucket floor(log2((2 gamma^2 + var_i) / (2 gamma^2 + min_i var_i))).
+
+    Returns:
+        array of N ints holding the bucket of each item
+    """
+    csq = 2.0 * gamma ** 2 + np.asarray(variances, dtype=np.float64)
+    base = max(csq.min(initial=np.inf), np.finfo(np.float64).tiny)
+    return np.floor(np.log2(np.maximum(csq, base) / base)).astype(np.intp)
+
+
+def sample_matches_windowed(anchor_indices, modes, variances, gamma, num_matches,
+                            window, rng=None, mode_order=None, block_size=DEFAULT_BLOCK_SIZE):
+    """Sample comparison items as in sample_matches, but only score the
+    candidates whose modes are near each anchor's mode.
+
+    The candidates are split into buckets by variance (see
+    variance_buckets) and, within the bucket with largest variance
+    max_b, every candidate whose mode is within `window` standard
+    deviations sqrt(2 gamma^2 + var_j + max_b) of the mode of anchor j
+    is scored, so one high-variance item only widens the window of its
+    own bucket.  The anchors are sorted by mode and scored in blocks of
+    nearby anchors (of at most about `block_size` pairs) against the
+    union of their windows.  If at most `num_matches` candidates are in
+    an anchor's windows, all items are scored for that anchor.
+
+    Args:
+        anchor_indices (array of k ints): indices of the anchor items
+        modes (array of N floats): modes of all items
+        variances (array of N floats): variances of all items
+        gamma (float): match quality parameter
+        num_matches (int): number of items to sample for each anchor
+        window (float): number of standard deviations to score
+        rng (numpy.random.Generator): random number generator
+        mode_order (array of N ints): item indices sorted by mode
+            (computed if not specified)
+        block_size (int): maximum number of pairs scored at once
+
+    Returns:
+        pair of a k x num_matches int array of item indices and an array
+        of k floats bounding, for each anchor, the fraction of the total
+        match quality mass that was not scored
+    """
+    anchor_indices = np.asarray(anchor_indices, dtype=np.intp)
+    modes = np.asarray(modes, dtype=np.float64)
+    variances = np.asarray(variances, dtype=np.float64)
+    if mode_order is None:
+        mode_order = np.argsort(modes, kind='stable')
+    mode_order = np.asarray(mode_order, dtype=np.intp)
+
+    # the items of each bucket, sorted by mode
+    sorted_buckets = variance_buckets(variances, gamma)[mode_order]
+    bucket_orders = [
+        mode_order[sorted_buckets == bucket]
+        for bucket in np.flatnonzero(np.bincount(sorted_buckets, minlength=1)).tolist()]
+    bucket_modes = [modes[order] for order in bucket_orders]
+    bucket_vars = [variances[order] for order in bucket_orders]
+    bucket_sizes = np.array([len(order) for order in bucket_orders])
+    min_vars = np.array([v.min() for v in bucket_vars])
+    max_vars = np.array([v.max() for v in bucket_vars])
+
+    two_gamma_sq = 2.0 * gamma ** 2
+    anchor_modes = modes[anchor_indices]
+    anchor_vars = variances[anchor_indices]
+    # k x B windows of the anchors in the buckets
+    half_widths = window * np.sqrt(two_gamma_sq + anchor_vars[:, np.newaxis] + max_vars)
+    starts = np.stack([
+        np.searchsorted(m, anchor_modes - half_widths[:, b], side='left')
+        for (b, m) in enumerate(bucket_modes)], axis=1)
+    ends = np.stack([
+        np.searchsorted(m, anchor_modes + half_widths[:, b], side='right')
+        for (b, m) in enumerate(bucket_modes)], axis=1)
+    counts = (ends - starts).sum(axis=1)
+
+    # every item of bucket b outside the window has match quality at
+    # most sqrt(2 gamma^2 / (2 gamma^2 + var_j + min_b)) exp(-window^2 / 2)
+    max_dropped_quality = np.sqrt(
+        two_gamma_sq / (two_gamma_sq + anchor_vars[:, np.newaxis] + min_vars)
+    ) * np.exp(-window ** 2 / 2.0)
+
+    selected = np.zeros((len(anchor_indices), num_matches), dtype=np.intp)
+    dropped_mass = np.zeros(len(anchor_indices))
+
+    full = np.flatnonzero(counts <= num_matches)
+    for (start, end, log_weights) in iter_log_match_weights(
+            anchor_indices[full], modes, variances, gamma, block_size=block_size):
+        selected[full[start:end]] = gumbel_top_k(log_weights, num_matches, rng=rng)
+
+    windowed = np.flatnonzero(counts > num_matches)
+    windowed = windowed[np.argsort(anchor_modes[windowed], kind='stable')]
+    for block in _anchor_blocks(windowed, starts, ends, counts, block_size):
+        (block_starts, block_ends) = (starts[block].min(axis=0), ends[block].max(axis=0))
+        candidates = np.concatenate([
+            order[s:e] for (order, s, e) in zip(bucket_orders, block_starts, block_ends)])
+        log_weights = log_match_quality(
+            anchor_modes[block], anchor_vars[block],
+            np.concatenate([m[s:e] for (m, s, e) in zip(bucket_modes, block_starts, block_ends)]),
+            np.concatenate([v[s:e] for (v, s, e) in zip(bucket_vars, block_starts, block_ends)]),
+            gamma)
+        log_weights[candidates == anchor_indices[block, np.newaxis]] = -np.inf
+        profiling.count('pairs_scored', log_weights.size)
+        selected[block] = candidates[gumbel_top_k(log_weights, num_matches, rng=rng)]
+
+        dropped_bound = (max_dropped_quality[block] * (bucket_sizes - (block_ends - block_starts))).sum(axis=1)
+        kept_mass = np.exp(log_weights).sum(axis=1)
+        dropped_mass[block] = np.where(dropped_bound > 0, dropped_bound / (kept_mass + dropped_bound), 0.)
+    return (selected, dropped_mass)
+
+
+def _anchor_blocks(anchors, starts, ends, counts, block_size):
+    # split `anchors` (positions sorted by mode) into consecutive blocks
+    # of at most about `block_size` pairs, each scoring (against the
+    # union of the windows of its anchors) at most MAX_WINDOW_GROWTH
+    # times as many pairs as the windows hold
+    position = 0
+    while position < len(anchors):
+        j = anchors[position]
+        (block_starts, block_ends, total) = (starts[j], ends[j], counts[j])
+        end = position + 1
+        while end < len(anchors):
+            j = anchors[end]
+            (next_starts, next_ends) = (np.minimum(block_starts, starts[j]), np.maximum(block_ends, ends[j]))
+            pairs = (end - position + 1) * (next_ends - next_starts).sum()
+            if pairs > block_size or pairs > MAX_WINDOW_GROWTH * (total + counts[j]):
+                break
+            (block_starts, block_ends, total) = (next_starts, next_ends, total + counts[j])
+            end += 1
+        yield anchors[position:end]
+        position = end
+
+
+class MatchCache(object):
+    """
+    Cache of the log match weights (see iter_log_match_weights) of the
+    anchors of the last call, kept up to date from call to call: the
+    weights of each cached anchor are rescored only for the items
+    changed since (according to the item store's touch log), and the
+    weights of anchors that changed themselves are dropped.
+
+    The cache holds at most `max_bytes` of weights (as many rows of N
+    weights as fit): rows of anchors not in a call are evicted first,
+    and the weights of new anchors are only cached while there is room.
+    """
+
+    def __init__(self, store, gamma, max_bytes=DEFAULT_MAX_CACHE_BYTES):
+        self.store = store
+        self.gamma = gamma
+        self.max_bytes = max_bytes
+        self.epoch = store.touch_epoch()
+        # dictionary from anchor index to array of N log weights
+        self.log_weights = {}
+
+    def max_rows(self, num_items):
+        """Return the number of anchors whose weights (over `num_items`
+        items) fit in the cache."""
+        return self.max_bytes // (np.dtype(np.float64).itemsize * max(1, num_items))
+
+    def update(self, modes, variances):
+        """Rescore the cached weights of the items changed since the
+        last update."""
+        touched = self.store.touched_since(self.epoch)
+        self.epoch = self.store.touch_epoch()
+        if len(touched) == 0 or not self.log_weights:
+            return
+        if touched[-1] >= len(next(iter(self.log_weights.values()))):
+            # items were added
+            self.log_weights = {}
+            return
+        for anchor_index in touched.tolist():
+            self.log_weights.pop(anchor_index, None)
+        for (anchor_index, log_weights) in self.log_weights.items():
+            log_weights[touched] = log_match_quality(
+                modes[anchor_index:anchor_index + 1], variances[anchor_index:anchor_index + 1],
+                modes[touched], variances[touched], self.gamma)[0]
+        profiling.count('pairs_scored', len(touched) * len(self.log_weights))
+
+    def iter_log_match_weights(self, anchor_indices, modes, variances,
+                               block_size=DEFAULT_BLOCK_SIZE):
+        """Compute the log match weights of each anchor as
+        iter_log_match_weights does (block by block, scoring only the
+        anchors of each block that are not cached), reusing (and
+        updating) the cached weights of anchors of the last call and
+        caching the weights of these anchors (only, up to the size of
+        the cache) for the next call.
+        """
+        anchor_indices = np.asarray(anchor_indices, dtype=np.intp)
+        modes = np.asarray(modes, dtype=np.float64)
+        variances = np.asarray(variances, dtype=np.float64)
+        anchor_set = set(anchor_indices.tolist())
+        self.log_weights = dict(
+            (anchor_index, log_weights)
+            for (anchor_index, log_weights) in self.log_weights.items()
+            if anchor_index in anchor_set)
+        self.update(modes, variances)
+        max_rows = self.max_rows(len(modes))
+
+        anchors_per_block = max(1, block_size // max(1, len(modes)))
+        for start in range(0, len(anchor_indices), anchors_per_block):
+            end = min(start + anchors_per_block, len(anchor_indices))
+            block_indices = anchor_indices[start:end]
+            log_weights = np.empty((end - start, len(modes)))
+            missing = []
+            for (j, anchor_index) in enumerate(block_indices.tolist()):
+                if anchor_index in self.log_weights:
+                    log_weights[j] = self.log_weights[anchor_index]
+                else:
+                    missing.append(j)
+            profiling.count('match_cache_hits', end - start - len(missing))
+            if missing:
+                missing = np.array(missing, dtype=np.intp)
+                (_, _, missing_log_weights) = next(iter_log_match_weights(
+                    block_indices[missing], modes, variances, self.gamma, block_size=len(missing) * len(modes)))
+                log_weights[missing] = missing_log_weights
+                for j in missing.tolist():
+                    if len(self.log_weights) >= max_rows:
+                        break
+                    self.log_weights[int(block_indices[j])] = log_weights[j].copy()
+            yield (start, end, log_weights)
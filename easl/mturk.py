@@ -1,21 +1,56 @@
 from csv import DictReader, DictWriter
+from datetime import datetime
 from uuid import uuid4
 from time import sleep
+from concurrent.futures import ThreadPoolExecutor
+import random
 import re
-import os
 import logging
 import json
+from io import BytesIO
+from xml.etree import ElementTree
+import math
 
 import boto3
-import xmltodict
+from botocore.exceptions import ClientError
 
 import easl
+from easl import profiling
+from easl.hits import iter_hit_batch, template_answer_names
 
 SANDBOX_ENDPOINT_URL = 'https://mturk-requester-sandbox.us-east-1.amazonaws.com'
 PRODUCTION_ENDPOINT_URL = 'https://mturk-requester.us-east-1.amazonaws.com'
 
 DEFAULT_LIFETIME = 60 * 60 * 24 * 7
 DEFAULT_MAX_ASSIGNMENTS = 1
+DEFAULT_CONCURRENCY = 1
+DEFAULT_MAX_RETRIES = 5
+DEFAULT_BACKOFF = 1.
+DEFAULT_MAX_INTERVAL = 60 * 10
+
+# Expiration time (in the past) that expires a HIT immediately
+EXPIRE_AT = datetime(2015, 1, 1)
+
+# Error codes of throttled (or otherwise retryable) requests
+RETRYABLE_ERROR_CODES = frozenset((
+    'Throttling',
+    'ThrottlingException',
+    'TooManyRequestsException',
+    'RequestLimitExceeded',
+    'ServiceUnavailable',
+))
+
+# Columns of a results CSV file other than the HIT layout parameters
+# (Input.*) and answer fields (Answer.*)
+RESULT_FIELDNAMES = (
+    'HITId',
+    'HITTypeId',
+    'HITLayoutId',
+    'RequesterAnnotation',
+    'AssignmentId',
+    'WorkerId',
+    'WorkTimeInSeconds',
+)
 
 ID_RE = re.compile(r'^id(\d+)$')
 PARAM_RE = re.compile(r'^(?:id\d+|sent\d+)$')
@@ -23,86 +58,291 @@ PARAM_RE = re.compile(r'^(?:id\d+|sent\d+)$')
 LOGGER = logging.getLogger(__name__)
 
 
-def loop(model_path, params, hit_type_id, hit_layout_id, num_rounds, client=None, interval=60):
-    easl.run('generate', model_path, params)
-    model_pieces = os.path.basename(os.path.splitext(model_path)[0]).split('_')
-    model_dirname = os.path.dirname(model_path)
-    model_name = '_'.join(model_pieces[:-1])
-    model_start_index = int(model_pieces[-1])
+def loop(model_path, params, hit_type_id, hit_layout_id, num_rounds, client=None, interval=60,
+         concurrency=DEFAULT_CONCURRENCY, completion=1., background_approval=True):
+    if client is None:
+        client = boto3.client('mturk')
 
+    # approvals run in the background (if `background_approval` is true)
+    # while the model is updated; their reports are logged at the end
+    with easl.Session(model_path, params) as session, ThreadPoolExecutor(max_workers=1) as approver:
+        approvals = []
+        # HIT id -> (HIT, layout parameters) of the HITs expired before
+        # they completed (with `completion` below 1), whose assignments
+        # may still be submitted by workers who accepted them
+        stragglers = dict()
+        hit_path = session.next_batch()
+
+        for round_num in range(num_rounds):
+            with profiling.span('round', round=round_num):
+                LOGGER.info('starting round {} (model index {})'.format(round_num, session.iter_num))
+
+                LOGGER.info('submitting batch')
+                batch_data = publish_batch(
+                    hit_type_id,
+                    hit_layout_id,
+                    hit_path,
+                    client=client,
+                    concurrency=concurrency)
+                hits = batch_data['hits']
+                hit_params = batch_data['hit_params']
+                hit_ids = [hit['HITId'] for hit in hits]
+
+                LOGGER.info('waiting on results')
+                hit_assignments = wait_hits(hit_ids, client=client, interval=interval,
+                                            completion=completion, concurrency=concurrency)
+                incomplete = [hit_id for hit_id in hit_ids if not hit_assignments[hit_id]]
+                if incomplete:
+                    LOGGER.info('expiring {} incomplete HITs'.format(len(incomplete)))
+                    expire_hits(incomplete, client=client, concurrency=concurrency)
+
+                # the late assignments of HITs expired in earlier rounds
+                # are applied with this round's
+                (late_hits, late_assignments) = collect_stragglers(stragglers, client=client,
+                                                                   concurrency=concurrency)
+                for hit in late_hits:
+                    hit_params[hit['HITId']] = stragglers.pop(hit['HITId'])[1]
+                for hit in hits:
+                    if not hit_assignments[hit['HITId']]:
+                        stragglers[hit['HITId']] = (hit, hit_params[hit['HITId']])
+                hits = hits + late_hits
+                hit_assignments.update(late_assignments)
+
+                LOGGER.info('approving assignments')
+                approvals.append(approver.submit(
+                    approve_assignments,
+                    [assignment_id
+                     for assignments in hit_assignments.values()
+                     for assignment_id in submitted_assignment_ids(assignments)],
+                    client=client,
+                    concurrency=concurrency))
+                if not background_approval:
+                    log_approval_report(approvals.pop().result())
+
+                LOGGER.info('writing results')
+                results_path = session.result_path()
+                write_results(
+                    results_path,
+                    (
+                        (hit, assignment, hit_params[hit['HITId']])
+                        for hit in hits
+                        for assignment in hit_assignments[hit['HITId']]
+                    ),
+                    answer_names=model_answer_names(session.model))
+
+                LOGGER.info('updating model')
+                session.observe_file(results_path)
+                # save the model while the next batch is generated and
+                # published
+                session.checkpoint(background=True)
+                if round_num + 1 < num_rounds:
+                    LOGGER.info('generating new HITs')
+                    hit_path = session.next_batch()
+
+        # assignments of expired HITs submitted after the last round are
+        # approved, but not applied to the model
+        (late_hits, late_assignments) = collect_stragglers(stragglers, client=client, concurrency=concurrency)
+        if late_hits:
+            LOGGER.info('approving {} late assignments'.format(
+                sum(len(assignments) for assignments in late_assignments.values())))
+            approvals.append(approver.submit(
+                approve_assignments,
+                [assignment_id
+                 for assignments in late_assignments.values()
+                 for assignment_id in submitted_assignment_ids(assignments)],
+                client=client,
+                concurrency=concurrency))
+        if len(stragglers) > len(late_hits):
+            LOGGER.warning('{} expired HITs have no assignments'.format(len(stragglers) - len(late_hits)))
+
+        for approval in approvals:
+            log_approval_report(approval.result())
+
+
+def collect_stragglers(stragglers, client=None, concurrency=DEFAULT_CONCURRENCY):
+    """Poll the expired HITs in `stragglers` (a dictionary from HIT id
+    to (HIT, layout parameters) pair) once, and return the list of those
+    HITs with assignments and a dictionary from their ids to their
+    assignments.
+    """
+    polled = poll_assignments(list(stragglers), client=client, concurrency=concurrency)
+    late_assignments = dict((hit_id, assignments) for (hit_id, assignments) in polled if assignments)
+    return ([stragglers[hit_id][0] for hit_id in late_assignments], late_assignments)
+
+
+def hit_item_ids(params):
+    """Return the list of item ids in a HIT, given its layout
+    parameters."""
+    return [v for (k, v) in params.items() if ID_RE.match(k)]
+
+
+def stream(model_path, params, hit_type_id, hit_layout_id, num_hits, hits_in_flight,
+           client=None, interval=60, max_interval=DEFAULT_MAX_INTERVAL,
+           concurrency=DEFAULT_CONCURRENCY, background_approval=True):
+    """Run EASL as a pipeline rather than in rounds: keep
+    `hits_in_flight` HITs published, and whenever HITs complete, apply
+    their assignments to the model (as one iteration) and immediately
+    publish replacement HITs generated from the updated model, until
+    `num_hits` HITs have completed.  Items in HITs still in flight are
+    not selected as the first items of replacement HITs (or, with
+    `param_mean_windows`, in replacement HITs at all).
+
+    Each iteration writes the same results, model and HIT batch files as
+    an iteration of loop; HITs still in flight at the end are left
+    published.
+    """
     if client is None:
         client = boto3.client('mturk')
 
-    for round_num in range(num_rounds):
-        model_index = model_start_index + round_num
-        LOGGER.info('starting round {} (model index {})'.format(round_num, model_index))
-
-        LOGGER.info('submitting batch')
-        batch_data = publish_batch(
-            hit_type_id,
-            hit_layout_id,
-            os.path.join(
-                model_dirname,
-                '{}_hit_{}{}csv'.format(model_name, model_index + 1, os.extsep)),
-            client=client)
-        hits = batch_data['hits']
-        hit_params = batch_data['hit_params']
-        hit_ids = [hit['HITId'] for hit in hits]
-
-        LOGGER.info('waiting on results')
-        hit_assignments = wait_hits(hit_ids, client=client, interval=interval)
-
-        LOGGER.info('approving assignments')
-        for (hit_id, assignments) in hit_assignments.items():
-            approve_assignments([assignment['AssignmentId']
-                                 for assignment in assignments
-                                 if assignment['AssignmentStatus'] == 'Submitted'],
-                                client=client)
-
-        LOGGER.info('writing results')
-        write_results(
-            os.path.join(
-                model_dirname,
-                '{}_result_{}{}csv'.format(model_name, model_index + 1, os.extsep)),
-            [
-                (hit, assignment, hit_params[hit['HITId']])
-                for hit in hits
-                for assignment in hit_assignments[hit['HITId']]
-            ])
-
-        if round_num + 1 < num_rounds:
-            operation = 'update-generate'
-            LOGGER.info('updating model and generating new HITs')
-        else:
-            operation = 'update'
-            LOGGER.info('updating model')
-        easl.run(
-            operation,
-            os.path.join(
-                model_dirname,
-                '{}_{}{}csv'.format(model_name, model_index, os.extsep)),
-            params)
-
-
-def ensure_list(x):
-    return x if isinstance(x, list) else [x]
+    with easl.Session(model_path, params) as session, ThreadPoolExecutor(max_workers=1) as approver:
+        approvals = []
+        # HIT id -> (HIT, layout parameters)
+        in_flight = dict()
+        num_published = 0
+        num_complete = 0
+
+        def publish(k):
+            hit_path = session.next_batch(
+                k=k,
+                exclude=set(item_id
+                            for (_, hit_params) in in_flight.values()
+                            for item_id in hit_item_ids(hit_params)))
+            LOGGER.info('submitting {} HITs'.format(k))
+            batch_data = publish_batch(hit_type_id, hit_layout_id, hit_path, client=client,
+                                       concurrency=concurrency)
+            for hit in batch_data['hits']:
+                in_flight[hit['HITId']] = (hit, batch_data['hit_params'][hit['HITId']])
+            return len(batch_data['hits'])
+
+        num_published += publish(min(hits_in_flight, num_hits))
+        delay = interval
+        while num_complete < num_hits:
+            polled = poll_assignments(list(in_flight), client=client, concurrency=concurrency)
+            completed = [(hit_id, assignments) for (hit_id, assignments) in polled if assignments]
+            if not completed:
+                delay = next_poll_interval(delay, False, interval, max_interval)
+                LOGGER.info('{} HITs in flight; polling again in {} s'.format(len(in_flight), delay))
+                sleep(delay)
+                continue
+            delay = interval
+
+            LOGGER.info('{} HITs complete (model index {})'.format(len(completed), session.iter_num))
+            approvals.append(approver.submit(
+                approve_assignments,
+                [assignment_id
+                 for (_, assignments) in completed
+                 for assignment_id in submitted_assignment_ids(assignments)],
+                client=client,
+                concurrency=concurrency))
+            if not background_approval:
+                log_approval_report(approvals.pop().result())
+            results_path = session.result_path()
+            write_results(
+                results_path,
+                (
+                    (in_flight[hit_id][0], assignment, in_flight[hit_id][1])
+                    for (hit_id, assignments) in completed
+                    for assignment in assignments
+                ),
+                answer_names=model_answer_names(session.model))
+            for (hit_id, _) in completed:
+                del in_flight[hit_id]
+            num_complete += len(completed)
+
+            session.observe_file(results_path)
+            session.checkpoint(background=True)
+
+            num_replacements = min(len(completed), num_hits - num_published)
+            if num_replacements > 0:
+                num_published += publish(num_replacements)
+
+        for approval in approvals:
+            log_approval_report(approval.result())
+
+
+def _local_name(tag):
+    # strip the namespace from an element tag
+    return tag.rsplit('}', 1)[-1]
 
 
 def parse_answer(answer):
-    xml_doc = xmltodict.parse(answer)
-    return dict(
-        (
-            answer_field['QuestionIdentifier'],
-            answer_field.get('SelectionIdentifier',
-                             answer_field.get('FreeText', None))
-        )
-        for answer_field in ensure_list(xml_doc['QuestionFormAnswers']['Answer']))
-
-
-def write_results(results_path, hit_assignment_params_triples):
-    with open(results_path, 'w', newline='') as f:
+    """Parse a QuestionFormAnswers XML document into a dictionary from
+    each question identifier to its answer (the selection identifier, if
+    any, otherwise the free text).
+    """
+    answers = dict()
+    fields = dict()
+    for (_, element) in ElementTree.iterparse(BytesIO(answer.encode('utf-8'))):
+        name = _local_name(element.tag)
+        if name in ('QuestionIdentifier', 'SelectionIdentifier', 'FreeText'):
+            fields.setdefault(name, element.text)
+        elif name == 'Answer':
+            answers[fields.get('QuestionIdentifier')] = fields.get(
+                'SelectionIdentifier', fields.get('FreeText'))
+            fields = dict()
+            element.clear()
+    return answers
+
+
+def default_answer_names(param_names):
+    """Return the answer fields of the EASL HIT layouts for HITs with
+    the specified layout parameters: a range (slider) and N/A checkbox
+    for each item.
+    """
+    answer_names = []
+    for param_name in param_names:
+        m = ID_RE.match(param_name)
+        if m is not None:
+            answer_names.extend(('range' + m.group(1), 'na' + m.group(1)))
+    return answer_names
+
+
+def model_answer_names(model):
+    """Return the answer fields of the HITs generated by `model`: those
+    of its HIT template (`param_hit_template`), if any, otherwise None
+    (the default answer fields, see default_answer_names).
+    """
+    template_path = model.get_param('param_hit_template')
+    return template_answer_names(template_path) if template_path else None
+
+
+def results_fieldnames(param_names, answer_names=None):
+    """Return the (sorted) columns of a results CSV file for HITs with
+    the specified layout parameters and answer fields (by default, see
+    default_answer_names).
+    """
+    if answer_names is None:
+        answer_names = default_answer_names(param_names)
+    return sorted(
+        list(RESULT_FIELDNAMES) +
+        ['Input.{}'.format(k) for k in param_names] +
+        ['Answer.{}'.format(k) for k in answer_names])
+
+
+@profiling.timed('write_results')
+def write_results(results_path, hit_assignment_params_triples, param_names=None, answer_names=None):
+    """Write a results CSV file for an iterable of (HIT, assignment, HIT
+    layout parameters) triples, one row per triple.  The triples are
+    consumed (and the rows written to the file) one at a time.
+
+    The columns are determined by `param_names` (by default, the layout
+    parameter names of the first triple) and `answer_names` (see
+    results_fieldnames) rather than by the rows.  A row with fields not
+    in the columns (such as an answer field missing from `answer_names`)
+    widens them: the rows written so far are rewritten under the widened
+    header (with empty values for the new fields), so no field is lost.
+    """
+    triples = iter(hit_assignment_params_triples)
+    with open(results_path, 'w+', newline='') as f:
         writer = None
-        for (hit, assignment, params) in hit_assignment_params_triples:
+        for (hit, assignment, params) in triples:
+            if writer is None:
+                if param_names is None:
+                    param_names = list(params)
+                fieldnames = results_fieldnames(param_names, answer_names)
+                writer = DictWriter(f, fieldnames=fieldnames)
+                writer.writeheader()
+
             row = dict(
                 HITId=hit['HITId'],
                 HITTypeId=hit['HITTypeId'],
@@ -114,31 +354,148 @@ def write_results(results_path, hit_assignment_params_triples):
                     (assignment['SubmitTime'] -
                      assignment['AcceptTime']).total_seconds()),
             )
-            row.update(dict(
-                ('Input.{}'.format(k), v)
-                for (k, v) in params.items()
-            ))
-            row.update(dict(
-                ('Answer.{}'.format(k), v)
-                for (k, v) in parse_answer(assignment['Answer']).items()
-            ))
-            if writer is None:
-                writer = DictWriter(f, fieldnames=sorted(row.keys()))
-                writer.writeheader()
+            for (k, v) in params.items():
+                row['Input.' + k] = v
+            for (k, v) in parse_answer(assignment['Answer']).items():
+                row['Answer.' + k] = v
+
+            extra_names = set(row).difference(fieldnames)
+            if extra_names:
+                LOGGER.info('adding fields to the results schema: {}'.format(
+                    ', '.join(sorted(extra_names))))
+                fieldnames = sorted(set(fieldnames).union(extra_names))
+                writer = _rewrite_results(f, fieldnames)
             writer.writerow(row)
-
-
-def approve_assignments(assignment_ids, client=None):
+            f.flush()
+            profiling.count('results_written')
+
+
+def _rewrite_results(f, fieldnames):
+    # rewrite the results file open as `f` under the (widened) columns
+    # `fieldnames`, returning a writer appending to it
+    f.seek(0)
+    rows = list(DictReader(f))
+    f.seek(0)
+    f.truncate()
+    writer = DictWriter(f, fieldnames=fieldnames)
+    writer.writeheader()
+    writer.writerows(rows)
+    return writer
+
+
+@profiling.timed('approve_assignments')
+def approve_assignments(assignment_ids, client=None, concurrency=DEFAULT_CONCURRENCY,
+                        max_retries=DEFAULT_MAX_RETRIES, backoff=DEFAULT_BACKOFF):
+    """Approve the specified assignments, using up to `concurrency`
+    concurrent requests and retrying throttled requests.  An assignment
+    that cannot be approved does not stop the others from being
+    approved.
+
+    Returns:
+        dictionary with the list of ids of the assignments that were
+        approved (`approved`) and a dictionary from the id of each
+        assignment that could not be approved to the error (`failed`)
+    """
     if client is None:
         client = boto3.client('mturk')
-    for assignment_id in assignment_ids:
-        LOGGER.info('approving assignment {}'.format(assignment_id))
-        client.approve_assignment(AssignmentId=assignment_id)
 
+    def approve(assignment_id):
+        LOGGER.info('approving assignment {}'.format(assignment_id))
+        try:
+            call_with_retry(client.approve_assignment, max_retries=max_retries, backoff=backoff,
+                            AssignmentId=assignment_id)
+            return None
+        except ClientError as e:
+            LOGGER.warning('could not approve assignment {}: {}'.format(assignment_id, e))
+            return e
+
+    assignment_ids = list(assignment_ids)
+    errors = map_concurrently(approve, assignment_ids, concurrency=concurrency)
+    profiling.count('assignments_approved', sum(error is None for error in errors))
+    profiling.count('approval_failures', sum(error is not None for error in errors))
+    return dict(
+        approved=[
+            assignment_id for (assignment_id, error) in zip(assignment_ids, errors) if error is None],
+        failed=dict(
+            (assignment_id, error) for (assignment_id, error) in zip(assignment_ids, errors)
+            if error is not None),
+    )
+
+
+@profiling.timed('expire_hits')
+def expire_hits(hit_ids, client=None, concurrency=DEFAULT_CONCURRENCY,
+                max_retries=DEFAULT_MAX_RETRIES, backoff=DEFAULT_BACKOFF):
+    """Expire the specified HITs immediately, using up to `concurrency`
+    concurrent requests and retrying throttled requests.  No more
+    workers can accept an expired HIT, but workers who already accepted
+    it can still submit their assignments.
+    """
+    if client is None:
+        client = boto3.client('mturk')
 
+    def expire(hit_id):
+        LOGGER.info('expiring HIT {}'.format(hit_id))
+        call_with_retry(client.update_expiration_for_hit, max_retries=max_retries, backoff=backoff,
+                        HITId=hit_id, ExpireAt=EXPIRE_AT)
+
+    map_concurrently(expire, hit_ids, concurrency=concurrency)
+    profiling.count('hits_expired', len(hit_ids))
+
+
+def log_approval_report(report):
+    LOGGER.info('approved {} assignments'.format(len(report['approved'])))
+    for (assignment_id, error) in report['failed'].items():
+        LOGGER.error('failed to approve assignment {}: {}'.format(assignment_id, error))
+
+
+def submitted_assignment_ids(assignments):
+    return [assignment['AssignmentId']
+            for assignment in assignments
+            if assignment['AssignmentStatus'] == 'Submitted']
+
+
+def is_retryable_error(error):
+    return (isinstance(error, ClientError) and
+            error.response.get('Error', {}).get('Code') in RETRYABLE_ERROR_CODES)
+
+
+def call_with_retry(method, max_retries=DEFAULT_MAX_RETRIES, backoff=DEFAULT_BACKOFF, **kwargs):
+    """Call `method(**kwargs)`, retrying up to `max_retries` times if the
+    request is throttled, after waiting a random time of up to
+    `backoff * 2 ** attempt` seconds (exponential backoff with jitter).
+    """
+    attempt = 0
+    while True:
+        profiling.count('api_calls')
+        try:
+            return method(**kwargs)
+        except ClientError as e:
+            if attempt >= max_retries or not is_retryable_error(e):
+                profiling.count('api_errors')
+                raise
+            profiling.count('api_retries')
+            delay = random.uniform(0, backoff * 2 ** attempt)
+            attempt += 1
+            LOGGER.warning('request throttled ({}); retrying in {:.2f} s (attempt {})'.format(
+                e.response['Error']['Code'], delay, attempt))
+            sleep(delay)
+
+
+def map_concurrently(function, iterable, concurrency=DEFAULT_CONCURRENCY):
+    """Return the list of results of `function` applied to each element
+    of `iterable` (in order), using up to `concurrency` threads.
+    """
+    if concurrency <= 1:
+        return list(map(function, iterable))
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        return list(executor.map(function, iterable))
+
+
+@profiling.timed('publish_batch')
 def publish_batch(hit_type_id, hit_layout_id, batch_csv_path, batch_id=None,
                   lifetime=DEFAULT_LIFETIME, max_assignments=DEFAULT_MAX_ASSIGNMENTS,
-                  client=None):
+                  client=None, concurrency=DEFAULT_CONCURRENCY,
+                  max_retries=DEFAULT_MAX_RETRIES, backoff=DEFAULT_BACKOFF):
     if batch_id is None:
         batch_id = str(uuid4())
     LOGGER.info('batch id: {}'.format(batch_id))
@@ -146,66 +503,171 @@ def publish_batch(hit_type_id, hit_layout_id, batch_csv_path, batch_id=None,
     if client is None:
         client = boto3.client('mturk')
 
-    hits = []
-    hit_params = dict()
-
-    with open(batch_csv_path) as f:
-        reader = DictReader(f)
-        for (i, row) in enumerate(reader):
-            request_token = str(uuid4())
-            LOGGER.info('submitting HIT {} (request token {})'.format(i + 1, request_token))
-            params = dict((k, v) for (k, v) in row.items() if PARAM_RE.match(k))
-            response = client.create_hit_with_hit_type(
-                HITTypeId=hit_type_id,
-                MaxAssignments=max_assignments,
-                LifetimeInSeconds=lifetime,
-                UniqueRequestToken=request_token,
-                HITLayoutId=hit_layout_id,
-                HITLayoutParameters=[
-                    dict(Name=k, Value=v) for (k, v) in params.items()
-                ],
-                RequesterAnnotation=json.dumps(dict(
-                    batch_id=batch_id,
-                )),
-            )
-            hit = response['HIT']
-            hits.append(hit)
-            hit_id = hit['HITId']
-            hit_params[hit_id] = params
-            LOGGER.info('submitted HIT (id {})'.format(hit_id))
+    # each HIT keeps its request token across retries, so a retried
+    # request cannot create a duplicate HIT
+    requests = [
+        (i, str(uuid4()), dict((k, v) for (k, v) in row.items() if PARAM_RE.match(k)))
+        for (i, row) in enumerate(iter_hit_batch(batch_csv_path))
+    ]
+
+    def create_hit(request):
+        (i, request_token, params) = request
+        LOGGER.info('submitting HIT {} (request token {})'.format(i + 1, request_token))
+        response = call_with_retry(
+            client.create_hit_with_hit_type,
+            max_retries=max_retries,
+            backoff=backoff,
+            HITTypeId=hit_type_id,
+            MaxAssignments=max_assignments,
+            LifetimeInSeconds=lifetime,
+            UniqueRequestToken=request_token,
+            HITLayoutId=hit_layout_id,
+            HITLayoutParameters=[
+                dict(Name=k, Value=v) for (k, v) in params.items()
+            ],
+            RequesterAnnotation=json.dumps(dict(
+                batch_id=batch_id,
+            )),
+        )
+        hit = response['HIT']
+        LOGGER.info('submitted HIT (id {})'.format(hit['HITId']))
+        return hit
+
+    hits = map_concurrently(create_hit, requests, concurrency=concurrency)
+    profiling.count('hits_published', len(hits))
+    hit_params = dict(
+        (hit['HITId'], params)
+        for (hit, (_, _, params)) in zip(hits, requests))
 
     return dict(batch_id=batch_id, hits=hits, hit_params=hit_params)
 
 
-def wait_hits(hit_ids, interval=60, client=None):
+def list_hit_assignments(hit_id, client=None, max_retries=DEFAULT_MAX_RETRIES, backoff=DEFAULT_BACKOFF):
+    """Return the list of all assignments of the HIT with id `hit_id`,
+    retrying the listing if it is throttled.
+    """
     if client is None:
         client = boto3.client('mturk')
 
-    hit_assignments = dict()
-    for hit_id in hit_ids:
-        LOGGER.info('waiting on HIT {}'.format(hit_id))
-        hit_assignments[hit_id] = wait_hit(hit_id, interval=interval, client=client)
-
-    return hit_assignments
-
+    def list_all(HITId):
+        assignment_paginator = client.get_paginator('list_assignments_for_hit')
+        assignment_pages = assignment_paginator.paginate(HITId=HITId)
+        return [
+            assignment
+            for assignment_page in assignment_pages
+            for assignment in assignment_page['Assignments']
+        ]
+
+    return call_with_retry(list_all, max_retries=max_retries, backoff=backoff, HITId=hit_id)
+
+
+@profiling.timed('poll_assignments')
+def poll_assignments(hit_ids, client=None, concurrency=DEFAULT_CONCURRENCY,
+                     max_retries=DEFAULT_MAX_RETRIES, backoff=DEFAULT_BACKOFF):
+    """Poll the specified HITs once (using up to `concurrency` threads)
+    and return the list of (HIT id, list of assignments) pairs.
+    """
+    if client is None:
+        client = boto3.client('mturk')
 
-def wait_hit(hit_id, interval=60, client=None):
+    def list_hit(hit_id):
+        return list_hit_assignments(hit_id, client=client, max_retries=max_retries, backoff=backoff)
+
+    return list(zip(hit_ids, map_concurrently(list_hit, hit_ids, concurrency=concurrency)))
+
+
+def next_poll_interval(delay, arrived, interval, max_interval):
+    """Return the number of seconds to wait before the next poll, given
+    the previous wait `delay` and whether any new assignments `arrived`
+    in the last poll: `interval` seconds if they did, otherwise twice the
+    previous wait, up to `max_interval` seconds.
+    """
+    return interval if arrived else min(2 * delay, max(interval, max_interval))
+
+
+def collect_assignments(hit_ids, interval=60, max_interval=DEFAULT_MAX_INTERVAL, completion=1.,
+                        client=None, concurrency=DEFAULT_CONCURRENCY,
+                        max_retries=DEFAULT_MAX_RETRIES, backoff=DEFAULT_BACKOFF):
+    """Poll all outstanding HITs together, yielding (HIT id, assignment)
+    pairs as the assignments arrive.
+
+    A HIT is complete once it has at least one assignment; complete
+    HITs are no longer polled.  Each round polls every outstanding HIT
+    (see poll_assignments), then waits `interval` seconds if any new
+    assignments arrived or otherwise twice as long as the previous wait,
+    up to `max_interval` seconds.  Collection stops once a fraction
+    `completion` of the HITs are complete.
+
+    Args:
+        hit_ids (list of str): ids of HITs to wait on
+        interval (float): minimum number of seconds between polls
+        max_interval (float): maximum number of seconds between polls
+        completion (float): fraction of HITs to wait on, in (0, 1]
+        client: MTurk client
+        concurrency (int): maximum number of concurrent requests
+        max_retries (int): maximum number of retries of a throttled
+            request
+        backoff (float): base delay of retries of a throttled request
+
+    Yields:
+        (HIT id, assignment) pairs
+    """
     if client is None:
         client = boto3.client('mturk')
 
-    assignments = []
+    outstanding = list(hit_ids)
+    # (allow for rounding error, as in 0.95 * 20 > 19)
+    num_required = int(math.ceil(completion * len(outstanding) - 1e-9))
+    num_complete = 0
+    seen_assignment_ids = set()
+    delay = interval
+
+    while outstanding and num_complete < num_required:
+        LOGGER.info('polling {} outstanding HITs'.format(len(outstanding)))
+        polled = poll_assignments(outstanding, client=client, concurrency=concurrency,
+                                  max_retries=max_retries, backoff=backoff)
+
+        still_outstanding = []
+        arrived = False
+        for (hit_id, assignments) in polled:
+            for assignment in assignments:
+                if assignment['AssignmentId'] not in seen_assignment_ids:
+                    seen_assignment_ids.add(assignment['AssignmentId'])
+                    arrived = True
+                    profiling.count('assignments_collected')
+                    yield (hit_id, assignment)
+            if assignments:
+                num_complete += 1
+            else:
+                still_outstanding.append(hit_id)
+        outstanding = still_outstanding
+
+        if outstanding and num_complete < num_required:
+            delay = next_poll_interval(delay, arrived, interval, max_interval)
+            LOGGER.info('{} of {} HITs complete; polling again in {} s'.format(
+                num_complete, num_complete + len(outstanding), delay))
+            sleep(delay)
+
+
+@profiling.timed('wait_hits')
+def wait_hits(hit_ids, interval=60, client=None, completion=1., max_interval=DEFAULT_MAX_INTERVAL,
+              concurrency=DEFAULT_CONCURRENCY):
+    """Wait until a fraction `completion` of the specified HITs have
+    assignments (see collect_assignments) and return a dictionary
+    mapping each HIT id to its list of assignments (empty for HITs
+    that did not complete).
+    """
+    hit_assignments = dict((hit_id, []) for hit_id in hit_ids)
+    for (hit_id, assignment) in collect_assignments(
+            hit_ids, interval=interval, max_interval=max_interval, completion=completion,
+            client=client, concurrency=concurrency):
+        hit_assignments[hit_id].append(assignment)
+
+    return hit_assignments
 
-    while not assignments:
-        assignment_paginator = client.get_paginator('list_assignments_for_hit')
-        assignment_paginate_args = dict(HITId=hit_id)
-        assignment_pages = assignment_paginator.paginate(**assignment_paginate_args)
-        for assignment_page in assignment_pages:
-            for assignment in assignment_page['Assignments']:
-                assignments.append(assignment)
-        if not assignments:
-            sleep(interval)
 
-    return assignments
+def wait_hit(hit_id, interval=60, client=None):
+    return wait_hits([hit_id], interval=interval, client=client)[hit_id]
 
 
 def hit_in_batch(hit, batch_id):
@@ -242,19 +704,29 @@ def iter_hit_assignment_pairs(hit_type_id=None, batch_id=None, requester_annotat
 
 
 def list_assignments(hit_type_id=None, batch_id=None, requester_annotation=None,
-                     client=None, approve=False):
+                     client=None, approve=False, concurrency=DEFAULT_CONCURRENCY):
     if client is None:
         client = boto3.client('mturk')
+    hit_assignment_pairs = iter_hit_assignment_pairs(hit_type_id=hit_type_id, batch_id=batch_id,
+                                                     requester_annotation=requester_annotation,
+                                                     client=client)
+    if approve:
+        hit_assignment_pairs = list(hit_assignment_pairs)
+        report = approve_assignments(
+            submitted_assignment_ids(assignment for (_, assignment) in hit_assignment_pairs),
+            client=client, concurrency=concurrency)
+        log_approval_report(report)
+        approved = set(report['approved'])
+    else:
+        approved = set()
+
     hit_id = None
-    for (hit, assignment) in iter_hit_assignment_pairs(hit_type_id=hit_type_id, batch_id=batch_id,
-                                                       requester_annotation=requester_annotation,
-                                                       client=client):
+    for (hit, assignment) in hit_assignment_pairs:
         if hit_id is None or hit['HITId'] != hit_id:
             print(hit['HITId'] + '\t' + hit.get('RequesterAnnotation', ''))
             hit_id = hit['HITId']
-        if assignment['AssignmentStatus'] == 'Submitted' and approve:
-            client.approve_assignment(AssignmentId=assignment['AssignmentId'])
-            assignment = client.get_assignment(AssignmentId=assignment['AssignmentId'])['Assignment']
+        if assignment['AssignmentId'] in approved:
+            assignment = dict(assignment, AssignmentStatus='Approved')
         print(assignment['WorkerId'] +
               '\t' + assignment['AssignmentId'] +
               '\t' + assignment['AssignmentStatus'] +
@@ -0,0 +1,180 @@
+# -*- coding: utf-8 -*-
+
+from concurrent.futures import ProcessPoolExecutor
+import multiprocessing
+from multiprocessing import resource_tracker, shared_memory
+
+import numpy as np
+
+from . import profiling
+from .match import sample_matches, sample_matches_windowed
+
+
+# Arrays shared with the parent process, keyed by name, and the shared
+# memory blocks backing them (set in each worker by _attach_arrays for
+# the duration of a task)
+_SHARED_ARRAYS = {}
+_SHARED_MEMORY = []
+
+# Methods of starting worker processes, by preference: workers are not
+# forked from the (possibly multithreaded) parent process itself
+START_METHODS = ('forkserver', 'spawn')
+
+
+def _share_arrays(arrays):
+    # copy each array into a new shared memory block, returning the
+    # blocks and the specification (name -> (block name, shape, dtype))
+    # workers use to attach to them
+    blocks = []
+    specs = {}
+    for (name, array) in arrays.items():
+        array = np.ascontiguousarray(array)
+        block = shared_memory.SharedMemory(create=True, size=max(1, array.nbytes))
+        blocks.append(block)
+        np.ndarray(array.shape, dtype=array.dtype, buffer=block.buf)[...] = array
+        specs[name] = (block.name, array.shape, array.dtype.str)
+    return (blocks, specs)
+
+
+def _attach_shared_memory(block_name):
+    try:
+        return shared_memory.SharedMemory(name=block_name, track=False)
+    except TypeError:
+        # before Python 3.13, attaching registers the block with the
+        # resource tracker, which may then unlink it when the worker
+        # exits; the parent process is responsible for unlinking it
+        register = resource_tracker.register
+        resource_tracker.register = lambda name, rtype: None
+        try:
+            return shared_memory.SharedMemory(name=block_name)
+        finally:
+            resource_tracker.register = register
+
+
+def _attach_arrays(specs):
+    for (name, (block_name, shape, dtype)) in specs.items():
+        block = _attach_shared_memory(block_name)
+        _SHARED_MEMORY.append(block)
+        _SHARED_ARRAYS[name] = np.ndarray(shape, dtype=np.dtype(dtype), buffer=block.buf)
+
+
+def _detach_arrays():
+    _SHARED_ARRAYS.clear()
+    for block in _SHARED_MEMORY:
+        block.close()
+    del _SHARED_MEMORY[:]
+
+
+def _sample_matches_chunk(args):
+    # returns the selected indices, the dropped mass (or None), and the
+    # counts recorded in the worker (if the parent is profiling)
+    (specs, anchor_indices, gamma, num_matches, window, seed_seq, profile) = args
+    rng = np.random.default_rng(seed_seq)
+    profiler = profiling.enable() if profile else None
+    _attach_arrays(specs)
+    try:
+        if window:
+            (selected, dropped_mass) = sample_matches_windowed(
+                anchor_indices, _SHARED_ARRAYS['modes'], _SHARED_ARRAYS['variances'],
+                gamma, num_matches, window, rng=rng, mode_order=_SHARED_ARRAYS['mode_order'])
+        else:
+            selected = sample_matches(
+                anchor_indices, _SHARED_ARRAYS['modes'], _SHARED_ARRAYS['variances'],
+                gamma, num_matches, rng=rng)
+            dropped_mass = None
+    finally:
+        _detach_arrays()
+        if profile:
+            profiling.disable()
+    return (selected, dropped_mass, dict(profiler.counters) if profile else {})
+
+
+class WorkerPool(object):
+    """
+    Pool of `workers` processes for sample_matches_parallel, started on
+    first use (with the first of START_METHODS available) and kept until
+    closed, so that processes are not started on every call.
+    """
+
+    def __init__(self, workers):
+        self.workers = workers
+        self._executor = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def executor(self):
+        if self._executor is None:
+            start_method = next(
+                method for method in START_METHODS if method in multiprocessing.get_all_start_methods())
+            context = multiprocessing.get_context(start_method)
+            if start_method == 'forkserver':
+                # workers are forked from a server that has imported
+                # this module (and numpy) once, rather than each
+                # importing it
+                context.set_forkserver_preload([__name__])
+            self._executor = ProcessPoolExecutor(max_workers=self.workers, mp_context=context)
+        return self._executor
+
+    def close(self):
+        if self._executor is not None:
+            self._executor.shutdown()
+            self._executor = None
+
+
+def sample_matches_parallel(anchor_indices, modes, variances, gamma, num_matches,
+                            workers, seed_seq, window=0., mode_order=None, pool=None):
+    """Sample comparison items for each anchor (as sample_matches, or
+    sample_matches_windowed if `window` is nonzero) in a pool of
+    `workers` processes that share the item arrays through shared
+    memory.  The anchors are split into `workers` contiguous chunks and
+    the chunk with index i is sampled with a random number generator
+    seeded by the i-th child of `seed_seq` (a numpy.random.SeedSequence),
+    so the result is determined by `seed_seq` and `workers`.  With a
+    window, `mode_order` (item indices sorted by mode, computed if not
+    specified) is shared with the workers.  The processes of `pool` (a
+    WorkerPool of at least `workers` processes) are used if specified;
+    otherwise a pool is started for the call.
+
+    Returns:
+        pair of a k x num_matches int array of item indices and an array
+        of k floats bounding the fraction of match quality mass that was
+        not scored for each anchor (None if `window` is zero)
+    """
+    anchor_indices = np.asarray(anchor_indices, dtype=np.intp)
+    chunks = np.array_split(anchor_indices, max(1, min(workers, len(anchor_indices))))
+    seeds = seed_seq.spawn(len(chunks))
+
+    arrays = dict(
+        modes=np.asarray(modes, dtype=np.float64),
+        variances=np.asarray(variances, dtype=np.float64),
+    )
+    if window:
+        if mode_order is None:
+            mode_order = np.argsort(arrays['modes'], kind='stable')
+        arrays['mode_order'] = np.asarray(mode_order, dtype=np.intp)
+    (blocks, specs) = _share_arrays(arrays)
+    profile = profiling.active_profiler() is not None
+    try:
+        tasks = [(specs, chunk, gamma, num_matches, window, seed, profile) for (chunk, seed) in zip(chunks, seeds)]
+        if pool is None:
+            with WorkerPool(len(chunks)) as call_pool:
+                results = list(call_pool.executor().map(_sample_matches_chunk, tasks))
+        else:
+            results = list(pool.executor().map(_sample_matches_chunk, tasks))
+    finally:
+        for block in blocks:
+            block.close()
+            block.unlink()
+
+    selected = np.concatenate([chunk_selected for (chunk_selected, _, _) in results])
+    if window:
+        dropped_mass = np.concatenate([chunk_dropped_mass for (_, chunk_dropped_mass, _) in results])
+    else:
+        dropped_mass = None
+    for (_, _, counters) in results:
+        profiling.merge_counts(counters)
+    return (selected, dropped_mass)
@@ -0,0 +1,174 @@
+# -*- coding: utf-8 -*-
+
+from collections import Counter
+from contextlib import contextmanager
+from time import perf_counter, time
+import cProfile
+import functools
+import json
+import threading
+
+
+# Profiler that spans and counts are recorded in (None if profiling is
+# disabled)
+_PROFILER = None
+
+
+class Profiler(object):
+    """
+    Recorder of timed spans (phases of work, which may be nested) and
+    named counters.  Spans and counts may be recorded from several
+    threads.
+    """
+
+    def __init__(self):
+        self.start_time = time()
+        self._start = perf_counter()
+        self.spans = []
+        self.counters = Counter()
+        self._lock = threading.Lock()
+        self._local = threading.local()
+
+    @contextmanager
+    def span(self, name, **attributes):
+        """Time the enclosed block as a span named `name` with the
+        specified attributes."""
+        stack = self._local.__dict__.setdefault('stack', [])
+        parent = stack[-1] if stack else None
+        stack.append(name)
+        start = perf_counter()
+        try:
+            yield
+        finally:
+            end = perf_counter()
+            stack.pop()
+            record = dict(
+                name=name,
+                parent=parent,
+                start=start - self._start,
+                duration=end - start,
+            )
+            if attributes:
+                record['attributes'] = attributes
+            with self._lock:
+                self.spans.append(record)
+
+    def count(self, name, n=1):
+        """Add `n` to the counter named `name`."""
+        with self._lock:
+            self.counters[name] += n
+
+    def report(self):
+        """Return a (JSON-serializable) dictionary holding the spans (in
+        order of completion), the total duration and number of the spans
+        with each name, and the counters.
+        """
+        with self._lock:
+            spans = list(self.spans)
+            counters = dict(self.counters)
+        totals = dict()
+        for span in spans:
+            total = totals.setdefault(span['name'], dict(count=0, duration=0.))
+            total['count'] += 1
+            total['duration'] += span['duration']
+        return dict(
+            start_time=self.start_time,
+            duration=perf_counter() - self._start,
+            spans=spans,
+            totals=totals,
+            counters=counters,
+        )
+
+    def write_report(self, path):
+        """Write the report (see report) to `path` as JSON, or, if `path`
+        ends in `.jsonl`, append it to `path` as one line of JSON (so the
+        reports of a series of runs can be collected in one file).
+        """
+        if path.endswith('.jsonl'):
+            with open(path, 'a') as f:
+                f.write(json.dumps(self.report()) + '\n')
+        else:
+            with open(path, 'w') as f:
+                json.dump(self.report(), f, indent=2)
+
+
+def enable(profiler=None):
+    """Record spans and counts in `profiler` (a new Profiler by
+    default) and return it."""
+    global _PROFILER
+    _PROFILER = Profiler() if profiler is None else profiler
+    return _PROFILER
+
+
+def disable():
+    """Stop recording spans and counts and return the profiler they were
+    recorded in (if any)."""
+    global _PROFILER
+    profiler = _PROFILER
+    _PROFILER = None
+    return profiler
+
+
+def active_profiler():
+    return _PROFILER
+
+
+@contextmanager
+def span(name, **attributes):
+    """Time the enclosed block as a span in the active profiler (if
+    profiling is enabled)."""
+    profiler = _PROFILER
+    if profiler is None:
+        yield
+    else:
+        with profiler.span(name, **attributes):
+            yield
+
+
+def count(name, n=1):
+    """Add `n` to a counter in the active profiler (if profiling is
+    enabled)."""
+    profiler = _PROFILER
+    if profiler is not None:
+        profiler.count(name, n)
+
+
+def timed(name):
+    """Decorator that times each call of the decorated function as a
+    span named `name` (if profiling is enabled)."""
+    def decorator(function):
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            with span(name):
+                return function(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def merge_counts(counters):
+    """Add counts recorded elsewhere (for example, in a worker process)
+    to the active profiler (if profiling is enabled)."""
+    for (name, n) in counters.items():
+        count(name, n)
+
+
+def profile_call(profile_path, function, *args, **kwargs):
+    """Call `function(*args, **kwargs)` and return its result, profiling
+    the call: if `profile_path` ends in `.prof`, write cProfile
+    statistics to it; otherwise record spans and counts and write their
+    report to it (see Profiler.write_report).
+    """
+    if profile_path.endswith('.prof'):
+        profile = cProfile.Profile()
+        try:
+            return profile.runcall(function, *args, **kwargs)
+        finally:
+            profile.dump_stats(profile_path)
+    else:
+        profiler = enable()
+        try:
+            with profiler.span('total'):
+                return function(*args, **kwargs)
+        finally:
+            disable()
+            profiler.write_report(profile_path)
@@ -0,0 +1,147 @@
+# -*- coding: utf-8 -*-
+
+import numpy as np
+
+
+def top_k_random_ties(values, k, rng=None):
+    """Select the indices of the `k` largest values, breaking ties
+    uniformly at random, using a partial sort.
+
+    Args:
+        values (array of N floats): values to select from
+        k (int): number of indices to select (at most N are returned)
+        rng (numpy.random.Generator): random number generator
+
+    Returns:
+        array of min(k, N) indices, in decreasing order of value (and in
+        random order among equal values)
+    """
+    if rng is None:
+        rng = np.random.default_rng()
+    values = np.asarray(values)
+    k = min(k, len(values))
+    if k <= 0:
+        return np.zeros(0, dtype=np.intp)
+
+    # all values greater than the k-th largest value are selected; the
+    # rest of the k are drawn from the values equal to it
+    threshold = np.partition(values, len(values) - k)[len(values) - k]
+    above = np.flatnonzero(values > threshold)
+    ties = np.flatnonzero(values == threshold)
+    selected = np.concatenate((above, rng.permutation(ties)[:k - len(above)]))
+
+    order = np.lexsort((rng.random(len(selected)), -values[selected]))
+    return selected[order]
+
+
+def gumbel_top_k(log_weights, m, rng=None):
+    """Sample `m` indices without replacement with probabilities
+    proportional to `exp(log_weights)` (drawing one index at a time and
+    renormalizing, as numpy.random.choice does) using the Gumbel-top-k
+    trick: perturb each log weight with independent Gumbel noise and
+    take the indices of the `m` largest results.
+
+    Args:
+        log_weights (N floats or k x N floats): unnormalized log
+            probabilities (-inf for indices that may not be selected);
+            each row of a 2D array is sampled from independently
+        m (int): number of indices to sample from each row
+        rng (numpy.random.Generator): random number generator
+
+    Returns:
+        array of m indices (or k x m indices if `log_weights` is 2D), in
+        the order in which they were drawn
+    """
+    if rng is None:
+        rng = np.random.default_rng()
+    log_weights = np.asarray(log_weights, dtype=np.float64)
+    if np.any(np.sum(np.isfinite(log_weights), axis=-1) < m):
+        raise ValueError('Fewer non-zero entries in p than size')
+    if m <= 0:
+        return np.zeros(log_weights.shape[:-1] + (0,), dtype=np.intp)
+
+    keys = log_weights + rng.gumbel(size=log_weights.shape)
+    if m < keys.shape[-1]:
+        top = np.argpartition(-keys, m - 1, axis=-1)[..., :m]
+    else:
+        top = np.broadcast_to(np.arange(keys.shape[-1]), keys.shape)
+    order = np.argsort(-np.take_along_axis(keys, top, axis=-1), axis=-1)
+    return np.take_along_axis(top, order, axis=-1)
+
+
+class ModeOrder(object):
+    """
+    Order of the items of an ItemStore by mode, with ties broken by a
+    random key drawn when an item's mode last changed, maintained from
+    round to round: update removes the items changed since the last
+    update (according to the store's touch log) and merges them back in
+    at their new positions, instead of sorting all items again.
+    """
+
+    def __init__(self, store, rng=None):
+        if rng is None:
+            rng = np.random.default_rng()
+        self.store = store
+        self.rng = rng
+        modes = store.column('mode')
+        self.keys = rng.random(len(modes))
+        self.epoch = store.touch_epoch()
+        # item positions in sorted order, and their modes and keys
+        self.order = np.lexsort((self.keys, modes))
+        self.sorted_modes = modes[self.order]
+        self.sorted_keys = self.keys[self.order]
+
+    def __len__(self):
+        return len(self.order)
+
+    def update(self):
+        """Re-sort the items added or changed since the last update."""
+        touched = self.store.touched_since(self.epoch)
+        self.epoch = self.store.touch_epoch()
+        if len(touched) == 0:
+            return
+        modes = self.store.column('mode')
+        if len(modes) > len(self.keys):
+            self.keys = np.concatenate((self.keys, np.zeros(len(modes) - len(self.keys))))
+        self.keys[touched] = self.rng.random(len(touched))
+
+        is_touched = np.zeros(len(modes), dtype=bool)
+        is_touched[touched] = True
+        kept = ~is_touched[self.order]
+        order = self.order[kept]
+        sorted_modes = self.sorted_modes[kept]
+        sorted_keys = self.sorted_keys[kept]
+
+        touched = touched[np.lexsort((self.keys[touched], modes[touched]))]
+        touched_modes = modes[touched]
+        touched_keys = self.keys[touched]
+        # find each touched item's position by mode, then by key among
+        # the untouched items of equal mode
+        positions = np.searchsorted(sorted_modes, touched_modes, side='left')
+        ends = np.searchsorted(sorted_modes, touched_modes, side='right')
+        for i in np.flatnonzero(ends > positions).tolist():
+            positions[i] += np.searchsorted(sorted_keys[positions[i]:ends[i]], touched_keys[i])
+
+        self.order = np.insert(order, positions, touched)
+        self.sorted_modes = np.insert(sorted_modes, positions, touched_modes)
+        self.sorted_keys = np.insert(sorted_keys, positions, touched_keys)
+
+    def windows(self, k, num_items, overlap=0, exclude=None):
+        """Return `k` windows of `num_items` consecutive items each (as a
+        k x `num_items` array of item positions), where each window
+        overlaps with the next by `overlap` items, centered in the order
+        of the items other than those at positions `exclude`.
+        """
+        order = self.order
+        if exclude is not None and len(exclude) > 0:
+            is_excluded = np.zeros(len(self.keys), dtype=bool)
+            is_excluded[exclude] = True
+            order = order[~is_excluded[order]]
+        total_num_items = k * num_items - (k - 1) * overlap
+        if total_num_items > len(order):
+            raise Exception(
+                'there are not enough items to generate {} hits with {} '
+                'items each and overlap {}'.format(k, num_items, overlap))
+        start = int((len(order) - total_num_items) / 2)
+        starts = start + np.arange(k) * (num_items - overlap)
+        return order[starts[:, np.newaxis] + np.arange(num_items)]
@@ -0,0 +1,125 @@
+# -*- coding: utf-8 -*-
+
+from concurrent.futures import ProcessPoolExecutor
+import itertools as it
+import logging
+
+import numpy as np
+from scipy.stats import spearmanr
+
+from .annotator import GoldAnnotator, load_gold
+from .easl import EASL
+
+DEFAULT_NOISE = 0.1
+DEFAULT_NA_RATE = 0.
+
+LOGGER = logging.getLogger(__name__)
+
+
+def simulate(items_path, gold_standard_path, params, num_rounds,
+             noise=DEFAULT_NOISE, na_rate=DEFAULT_NA_RATE, seed=None):
+    """Simulate `num_rounds` rounds of EASL in memory: each round, HITs
+    are generated from the model (as get_next_k), answered by a
+    simulated annotator (see GoldAnnotator) and applied to the model (as
+    observe_batch), without writing any files.
+
+    Args:
+        items_path (str): path to CSV file of items (with columns id,
+            sent), as for initItem
+        gold_standard_path (str): path to gold standard CSV file (with
+            columns id, sent, label)
+        params (dict): EASL parameters
+        num_rounds (int): number of rounds to simulate
+        noise (float): standard deviation of the annotators' noise
+        na_rate (float): probability that an annotator marks an item N/A
+        seed (int): seed for the annotators' random number generator
+
+    Returns:
+        list of one dictionary per round holding the round number
+        (`round`), the number of HITs in the round (`hits`), the total
+        number of item annotations so far (`annotations`), and the
+        Spearman correlation between the item modes and the gold
+        standard after the round (`spearman`, as evaluate)
+    """
+    model = EASL(params)
+    model.initItem(items_path)
+    gold = load_gold(gold_standard_path)
+    annotator = GoldAnnotator(gold, noise=noise, na_rate=na_rate,
+                              rng=np.random.default_rng(None if seed is None else [seed, 1]))
+    gold_labels = np.array([gold[item_id] for item_id in model.items.ids])
+
+    records = []
+    num_annotations = 0
+    try:
+        for iter_num in range(num_rounds):
+            next_items = model.get_next_k(iter_num)
+            hit_item_ids = [
+                item_id
+                for (anchor_id, compare_ids) in next_items.items()
+                for item_id in [anchor_id] + list(compare_ids)
+            ]
+            (scores, is_na) = annotator.annotate(hit_item_ids)
+            indices = np.array([model.items.index[item_id] for item_id in hit_item_ids], dtype=np.intp)
+            model.observe_batch(indices, scores, is_na)
+
+            num_annotations += len(hit_item_ids)
+            records.append(dict(
+                round=iter_num + 1,
+                hits=len(next_items),
+                annotations=num_annotations,
+                spearman=spearmanr(gold_labels, model.items.column('mode')).correlation,
+            ))
+    finally:
+        model.close()
+    return records
+
+
+def _simulate_job(args):
+    (items_path, gold_standard_path, params, num_rounds, noise, na_rate, seed) = args
+    return simulate(items_path, gold_standard_path, params, num_rounds,
+                    noise=noise, na_rate=na_rate, seed=seed)
+
+
+def iter_param_grid(param_grid):
+    """Generate the parameter dictionaries in the Cartesian product of
+    `param_grid` (a dictionary from parameter name to list of values)."""
+    names = sorted(param_grid)
+    for values in it.product(*[param_grid[name] for name in names]):
+        yield dict(zip(names, values))
+
+
+def sweep(items_path, gold_standard_path, param_grid, num_rounds, repeats=1, workers=1,
+          noise=DEFAULT_NOISE, na_rate=DEFAULT_NA_RATE, seed=0):
+    """Simulate EASL (see simulate) for each combination of parameters in
+    `param_grid` (a dictionary from EASL parameter name to list of
+    values), `repeats` times each, in a pool of `workers` processes.
+    Repeat r uses seed `seed + r` for both the model and the annotators.
+
+    Returns:
+        list of the records of all rounds of all simulations (see
+        simulate), each also holding its parameters and its repeat number
+        (`repeat`)
+    """
+    jobs = []
+    for params in iter_param_grid(param_grid):
+        for repeat in range(repeats):
+            jobs.append((params, repeat))
+
+    job_args = [
+        (items_path, gold_standard_path, dict(params, param_seed=seed + repeat), num_rounds,
+         noise, na_rate, seed + repeat)
+        for (params, repeat) in jobs
+    ]
+    if workers > 1:
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            results = list(executor.map(_simulate_job, job_args))
+    else:
+        results = list(map(_simulate_job, job_args))
+
+    records = []
+    for ((params, repeat), job_records) in zip(jobs, results):
+        LOGGER.info('simulated {} (repeat {}): final correlation {:.4f}'.format(
+            params, repeat, job_records[-1]['spearman'] if job_records else float('nan')))
+        for record in job_records:
+            records.append(dict(params, repeat=repeat, **record))
+    return records
@@ -0,0 +1,502 @@
+# -*- coding: utf-8 -*-
+
+import csv
+import json
+import os
+import shutil
+from collections.abc import Mapping, MutableMapping
+
+import numpy as np
+
+from . import profiling
+
+
+# Columns of the model that hold numeric item state, and their types.
+# All other columns (`id`, `sent`, `scores`, and any additional input
+# columns) are stored as text.
+NUMERIC_COLUMNS = dict(
+    alpha=np.float64,
+    beta=np.float64,
+    mode=np.float64,
+    var=np.float64,
+    na_count=np.int64,
+    score_count=np.int64,
+    score_mean=np.float64,
+    score_m2=np.float64,
+)
+
+INITIAL_CAPACITY = 16
+
+# Extension of binary models, which are directories holding one .npy
+# file per numeric column (memory-mapped on load), a CSV file of text
+# columns, and a JSON file giving the column order and number of items.
+BINARY_MODEL_EXTENSION = 'easl'
+BINARY_HEADER_FILE_NAME = 'header.json'
+BINARY_TEXT_FILE_NAME = 'text.csv'
+
+# Suffix (before the extension) of delta model files, which hold only
+# the items changed since the previous model
+DELTA_MODEL_SUFFIX = 'delta'
+
+
+def format_value(value):
+    """Format a numeric or text value for output to a model or HIT CSV
+    file.  Integral floats are written without a decimal point (as they
+    are in a freshly initialized model), and other floats are written
+    with full precision.
+    """
+    if isinstance(value, (float, np.floating)):
+        value = float(value)
+        if value.is_integer() and abs(value) < 2 ** 53:
+            return str(int(value))
+        return repr(value)
+    elif isinstance(value, (int, np.integer)):
+        return str(int(value))
+    else:
+        return value
+
+
+class ItemView(MutableMapping):
+    """
+    Dictionary-like view of a single item (row) in an ItemStore
+    """
+
+    def __init__(self, store, index):
+        self.store = store
+        self.index = index
+
+    def __getitem__(self, column):
+        return self.store.get_value(self.index, column)
+
+    def __setitem__(self, column, value):
+        self.store.set_value(self.index, column, value)
+
+    def __delitem__(self, column):
+        raise TypeError('cannot delete columns from an item')
+
+    def __iter__(self):
+        return iter(self.store.header)
+
+    def __len__(self):
+        return len(self.store.header)
+
+    def __repr__(self):
+        return 'ItemView({!r})'.format(dict(self))
+
+
+class ItemStore(Mapping):
+    """
+    Columnar store of EASL items: numeric state is kept in typed NumPy
+    arrays indexed by item position, text columns are kept in lists, and
+    `index` maps item ids to positions.  The store behaves as a mapping
+    from item id to a dictionary-like view of that item's row.
+    """
+
+    def __init__(self, header=None):
+        self.header = []
+        self.ids = []
+        self.index = {}
+        self.text = {}
+        self.numeric = {}
+        self._capacity = INITIAL_CAPACITY
+        # path of a binary model text file holding the current text
+        # columns, if they are unchanged since the store was loaded
+        self.text_path = None
+        # indices (ints or arrays) of items added or changed, in order,
+        # starting at epoch _touch_start; touched_since returns the items
+        # changed since epoch _saved_epoch by default
+        self._touch_log = []
+        self._touch_start = 0
+        self._saved_epoch = 0
+        for column in (header or []):
+            self.add_column(column)
+
+    def add_column(self, column):
+        if column in self.header:
+            return
+        self.header.append(column)
+        if column in NUMERIC_COLUMNS:
+            self.numeric[column] = np.zeros(self._capacity, dtype=NUMERIC_COLUMNS[column])
+        else:
+            self.text[column] = [''] * len(self.ids)
+            self.text_path = None
+
+    def copy(self):
+        """Return a copy of this store that does not share any mutable
+        state with it.
+        """
+        store = ItemStore()
+        store.header = list(self.header)
+        store.ids = list(self.ids)
+        store.index = dict(self.index)
+        store.text = dict((column, list(values)) for (column, values) in self.text.items())
+        store.numeric = dict(
+            (column, np.array(self.column(column))) for column in self.numeric)
+        store._capacity = len(self.ids)
+        store.text_path = self.text_path
+        store._touch_log = list(self._touch_log)
+        store._touch_start = self._touch_start
+        store._saved_epoch = self._saved_epoch
+        return store
+
+    def drop_column(self, column):
+        self.header.remove(column)
+        if column in self.numeric:
+            del self.numeric[column]
+        else:
+            del self.text[column]
+            self.text_path = None
+
+    def _reserve(self, size):
+        if size <= self._capacity:
+            return
+        capacity = max(size, 2 * self._capacity)
+        for (column, values) in self.numeric.items():
+            new_values = np.zeros(capacity, dtype=values.dtype)
+            new_values[:len(self.ids)] = values[:len(self.ids)]
+            self.numeric[column] = new_values
+        self._capacity = capacity
+
+    def append(self, row):
+        """Add a new item given by `row` (a dictionary from column name
+        to value) to the end of the store and return its index.
+        """
+        item_id = row['id']
+        if item_id in self.index:
+            raise ValueError('duplicate item id {}'.format(item_id))
+        for column in row:
+            self.add_column(column)
+        index = len(self.ids)
+        self._reserve(index + 1)
+        self.text_path = None
+        self.ids.append(item_id)
+        self.index[item_id] = index
+        for values in self.text.values():
+            values.append('')
+        for (column, value) in row.items():
+            self._set_value(index, column, value)
+        self._touch_log.append(index)
+        return index
+
+    def mark_touched(self, indices):
+        """Record that the items at positions `indices` have changed."""
+        self._touch_log.append(np.asarray(indices, dtype=np.intp))
+
+    def touch_epoch(self):
+        """Return a marker that can be passed to touched_since to get the
+        items changed after this call.
+        """
+        return self._touch_start + len(self._touch_log)
+
+    def touched_since(self, epoch=None):
+        """Return the sorted indices of the items added or changed since
+        `epoch` (as returned by touch_epoch; by default, since the last
+        call to clear_touched).  Raise ValueError if the changes since
+        `epoch` have been discarded (see clear_touched).
+        """
+        if epoch is None:
+            epoch = self._saved_epoch
+        if epoch < self._touch_start:
+            raise ValueError('changes since touch epoch {} have been discarded'.format(epoch))
+        entries = self._touch_log[epoch - self._touch_start:]
+        if not entries:
+            return np.zeros(0, dtype=np.intp)
+        return np.unique(np.concatenate([np.atleast_1d(entry) for entry in entries]))
+
+    def clear_touched(self, keep_since=None):
+        """Mark all items as unchanged (for touched_since with the
+        default epoch), discarding the record of the changes made before
+        epoch `keep_since` (by default, of all changes).
+        """
+        self._saved_epoch = self.touch_epoch()
+        if keep_since is None:
+            keep_since = self._saved_epoch
+        if keep_since > self._touch_start:
+            del self._touch_log[:keep_since - self._touch_start]
+            self._touch_start = keep_since
+
+    def column(self, column):
+        """Return the values of a numeric column (as a NumPy array view
+        that can be updated in place) or a text column (as a list).
+        """
+        if column in self.numeric:
+            return self.numeric[column][:len(self.ids)]
+        else:
+            # the caller may modify the list in place
+            self.text_path = None
+            return self.text[column]
+
+    def get_value(self, index, column):
+        if column in self.numeric:
+            return self.numeric[column][index].item()
+        else:
+            return self.text[column][index]
+
+    def set_value(self, index, column, value):
+        self._set_value(index, column, value)
+        self._touch_log.append(index)
+
+    def _set_value(self, index, column, value):
+        self.add_column(column)
+        if column in self.numeric:
+            if isinstance(value, str):
+                value = float(value)
+            self.numeric[column][index] = value
+        elif value != self.text[column][index]:
+            if column == 'id' and value != self.ids[index]:
+                raise ValueError('cannot change item id')
+            self.text[column][index] = value
+            self.text_path = None
+
+    def format_row(self, index, columns=None):
+        """Return a dictionary from column name to formatted (string)
+        value for the item at position `index`.
+        """
+        if columns is None:
+            columns = self.header
+        return dict(
+            (column, format_value(self.get_value(index, column)))
+            for column in columns)
+
+    def format_column(self, column, indices):
+        """Return the formatted (string) values of `column` for the
+        items at positions `indices` (an integer array), as format_row.
+        """
+        if column in self.numeric:
+            return [format_value(value) for value in self.numeric[column][indices].tolist()]
+        else:
+            values = self.text[column]
+            return [values[index] for index in indices.tolist()]
+
+    def __getitem__(self, item_id):
+        return ItemView(self, self.index[item_id])
+
+    def __setitem__(self, item_id, row):
+        row = dict(row)
+        row.setdefault('id', item_id)
+        if item_id in self.index:
+            index = self.index[item_id]
+            for (column, value) in row.items():
+                self.set_value(index, column, value)
+        else:
+            self.append(row)
+
+    def __iter__(self):
+        return iter(self.ids)
+
+    def __len__(self):
+        return len(self.ids)
+
+    def __contains__(self, item_id):
+        return item_id in self.index
+
+
+def load_csv(path):
+    """Load an ItemStore from the EASL model CSV file at `path`."""
+    with open(path) as f:
+        reader = csv.DictReader(f)
+        store = ItemStore(reader.fieldnames)
+        for row in reader:
+            store.append(row)
+    store.clear_touched()
+    profiling.count('items_loaded', len(store))
+    return store
+
+
+def save_csv(store, path, indices=None):
+    """Save an ItemStore to an EASL model CSV file at `path` (writing
+    only the items at positions `indices`, if specified).
+    """
+    if indices is None:
+        indices = range(len(store))
+    with open(path, 'w', newline='') as f:
+        writer = csv.DictWriter(f, fieldnames=store.header)
+        writer.writeheader()
+        for index in indices:
+            writer.writerow(store.format_row(index))
+
+
+def update_from_csv(store, path):
+    """Add or update the items in the EASL model CSV file (e.g., delta
+    model file) at `path` to `store`.
+    """
+    with open(path) as f:
+        for row in csv.DictReader(f):
+            store[row['id']] = row
+
+
+def split_model_path(path):
+    """Split an EASL model path of the form `<dir>/<name>_<iter>.<ext>`
+    into the tuple (dir, name, iter, .ext).
+    """
+    (stem, ext) = os.path.splitext(os.path.basename(path))
+    pieces = stem.split('_')
+    return (os.path.dirname(path), '_'.join(pieces[:-1]), int(pieces[-1]), ext)
+
+
+def join_model_path(model_dir, model_name, iter_num, ext):
+    """Inverse of split_model_path."""
+    return os.path.join(model_dir, '{}_{}{}'.format(model_name, iter_num, ext))
+
+
+def delta_model_path(path):
+    """Return the path of the delta model file for the model at `path`
+    (`<dir>/<name>_<iter>.delta.csv`).
+    """
+    (model_dir, model_name, iter_num, _) = split_model_path(path)
+    return join_model_path(
+        model_dir, model_name, iter_num,
+        os.extsep + DELTA_MODEL_SUFFIX + os.extsep + 'csv')
+
+
+def resolve_model_path(path):
+    """Return the pair (snapshot path, delta paths) of files from which to
+    load the model at `path`: if `path` does not exist but a delta model
+    file for it does, the model is the most recent full snapshot before
+    it updated with each subsequent delta model file, in order.
+    """
+    delta_paths = []
+    while not os.path.exists(path):
+        delta_path = delta_model_path(path)
+        if not os.path.exists(delta_path):
+            raise Exception('model {} (or delta model {}) not found'.format(path, delta_path))
+        delta_paths.append(delta_path)
+        (model_dir, model_name, iter_num, ext) = split_model_path(path)
+        if iter_num == 0:
+            raise Exception('no full model snapshot found for {}'.format(path))
+        path = join_model_path(model_dir, model_name, iter_num - 1, ext)
+    return (path, delta_paths[::-1])
+
+
+def is_binary_model_path(path):
+    return os.path.splitext(path)[1] == os.extsep + BINARY_MODEL_EXTENSION
+
+
+def _replace_file(path, write):
+    # write to a temporary file and move it into place, so that a file
+    # that is currently memory-mapped is never truncated
+    tmp_path = path + os.extsep + 'tmp'
+    write(tmp_path)
+    os.replace(tmp_path, path)
+
+
+def load_binary(path):
+    """Load an ItemStore from the binary EASL model directory at `path`,
+    memory-mapping the numeric columns (copy-on-write, so the store can
+    be updated without modifying the files).
+    """
+    with open(os.path.join(path, BINARY_HEADER_FILE_NAME)) as f:
+        header_data = json.load(f)
+    store = ItemStore()
+    size = header_data['size']
+    text_columns = []
+    for column in header_data['header']:
+        store.header.append(column)
+        if column in NUMERIC_COLUMNS:
+            column_path = os.path.join(path, column + os.extsep + 'npy')
+            store.numeric[column] = np.load(column_path, mmap_mode='c' if size > 0 else None)
+        else:
+            text_columns.append(column)
+            store.text[column] = []
+    store._capacity = size
+
+    text_path = os.path.join(path, BINARY_TEXT_FILE_NAME)
+    with open(text_path, newline='') as f:
+        reader = csv.reader(f)
+        if next(reader) != text_columns:
+            raise Exception('text columns in {} do not match header'.format(text_path))
+        text_values = [store.text[column] for column in text_columns]
+        for row in reader:
+            for (values, value) in zip(text_values, row):
+                values.append(value)
+    store.ids = list(store.text['id'])
+    store.index = dict((item_id, index) for (index, item_id) in enumerate(store.ids))
+    if len(store.ids) != size:
+        raise Exception('expected {} items in {} but found {}'.format(size, text_path, len(store.ids)))
+    store.text_path = text_path
+    return store
+
+
+def save_binary(store, path):
+    """Save an ItemStore to a binary EASL model directory at `path`."""
+    if not os.path.isdir(path):
+        os.makedirs(path)
+    size = len(store)
+    for column in store.numeric:
+        def write_column(p):
+            with open(p, 'wb') as f:
+                np.save(f, store.column(column))
+        _replace_file(os.path.join(path, column + os.extsep + 'npy'), write_column)
+
+    text_columns = [column for column in store.header if column not in store.numeric]
+    text_path = os.path.join(path, BINARY_TEXT_FILE_NAME)
+    if store.text_path is None or os.path.abspath(store.text_path) != os.path.abspath(text_path):
+        if store.text_path is not None:
+            _replace_file(text_path, lambda p: shutil.copyfile(store.text_path, p))
+        else:
+            def write_text(p):
+                with open(p, 'w', newline='') as f:
+                    writer = csv.writer(f)
+                    writer.writerow(text_columns)
+                    writer.writerows(zip(*[store.text[column] for column in text_columns]))
+            _replace_file(text_path, write_text)
+
+    def write_header(p):
+        with open(p, 'w') as f:
+            json.dump(dict(header=store.header, size=size), f)
+    _replace_file(os.path.join(path, BINARY_HEADER_FILE_NAME), write_header)
+
+
+@profiling.timed('load_model')
+def load_model(path):
+    """Load an ItemStore from the EASL model at `path`, in binary format
+    if `path` has the binary model extension and CSV format otherwise.
+    If `path` does not exist, compose the model from the most recent
+    snapshot and subsequent delta model files (see resolve_model_path).
+    """
+    (snapshot_path, delta_paths) = resolve_model_path(path)
+    if is_binary_model_path(snapshot_path):
+        store = load_binary(snapshot_path)
+    else:
+        store = load_csv(snapshot_path)
+    for delta_path in delta_paths:
+        update_from_csv(store, delta_path)
+    store.clear_touched()
+    return store
+
+
+@profiling.timed('save_model')
+def save_model(store, path, delta=False):
+    """Save an ItemStore to the EASL model at `path`, in binary format
+    if `path` has the binary model extension and CSV format otherwise.
+    If `delta` is true, save only the items changed since the store was
+    loaded, to the delta model file for `path`, instead.
+    """
+    if delta:
+        indices = store.touched_since()
+        save_csv(store, delta_model_path(path), indices)
+        profiling.count('items_saved', len(indices))
+        stale_path = path
+    else:
+        profiling.count('items_saved', len(store))
+        if is_binary_model_path(path):
+            save_binary(store, path)
+        else:
+            save_csv(store, path)
+        try:
+            stale_path = delta_model_path(path)
+        except ValueError:
+            stale_path = None
+    # remove the other representation of this model, if any, left by a
+    # previous run
+    if stale_path is not None and os.path.isdir(stale_path):
+        shutil.rmtree(stale_path)
+    elif stale_path is not None and os.path.exists(stale_path):
+        os.remove(stale_path)
+
+
+def convert_model(in_path, out_path):
+    """Convert the EASL model at `in_path` to the format implied by
+    `out_path` (binary or CSV), writing it to `out_path`.
+    """
+    save_model(load_model(in_path), out_path)
@@ -0,0 +1,21 @@
+#!/usr/bin/env python
+
+
+from easl.store import convert_model, BINARY_MODEL_EXTENSION
+
+
+if __name__ == "__main__":
+    from argparse import ArgumentParser, ArgumentDefaultsHelpFormatter
+    parser = ArgumentParser(
+        formatter_class=ArgumentDefaultsHelpFormatter,
+        description='Convert an EASL model between CSV format and binary '
+                    'format (a directory with extension .{}, whose numeric '
+                    'columns are memory-mapped on load).  The output format '
+                    'is determined by the extension of the output '
+                    'path.'.format(BINARY_MODEL_EXTENSION),
+    )
+    parser.add_argument('in_model_path', help='Path to input EASL model')
+    parser.add_argument('out_model_path', help='Path to output EASL model')
+    args = parser.parse_args()
+
+    convert_model(args.in_model_path, args.out_model_path)
@@ -3,7 +3,9 @@
 
 import os
 
-from easl import EASL
+from easl import initialize
+from easl.easl import DEFAULT_CHUNK_SIZE
+from easl.store import BINARY_MODEL_EXTENSION
 
 
 if __name__ == "__main__":
@@ -16,13 +18,23 @@ if __name__ == "__main__":
                     '_0.csv to get the output EASL model CSV path).',
     )
     parser.add_argument('in_file_path', help='Path to input CSV file')
+    parser.add_argument('--running-stats', dest="param_running_stats", action='store_true',
+                        help="keep running score statistics for each item "
+                             "instead of its score history")
+    parser.add_argument('--binary', action='store_true',
+                        help='write model in binary format (replacing .csv '
+                             'with _0.{} instead of _0.csv)'.format(BINARY_MODEL_EXTENSION))
+    parser.add_argument('--chunk-size', type=int, default=DEFAULT_CHUNK_SIZE,
+                        help='number of rows to read, sanitize and write at a time')
+    parser.add_argument('--workers', type=int, default=1,
+                        help='number of processes among which to split '
+                             'sanitization of the rows')
     args = parser.parse_args()
 
     dir_path = os.path.dirname(args.in_file_path)
     file_name = os.path.splitext(os.path.basename(args.in_file_path))[0]
-    out_file_name = file_name + "_0" + os.extsep + "csv"
+    out_file_name = file_name + "_0" + os.extsep + (BINARY_MODEL_EXTENSION if args.binary else "csv")
     out_file_path = os.path.join(dir_path, out_file_name)
 
-    model = EASL()
-    model.initItem(args.in_file_path)
-    model.saveItem(out_file_path)
+    initialize(args.in_file_path, out_file_path, dict(param_running_stats=args.param_running_stats),
+               chunk_size=args.chunk_size, workers=args.workers)
@@ -2,6 +2,8 @@
 
 
 from easl import EASL, run
+from easl.hits import HIT_FORMATS
+from easl.profiling import profile_call
 
 
 if __name__ == "__main__":
@@ -25,6 +27,19 @@ if __name__ == "__main__":
     parser.add_argument('--match', dest="param_match", type=float,
                         default=EASL.DEFAULT_PARAMS['param_match'],
                         help="parameter gamma for match quality (default 0.1) ")
+    parser.add_argument('--match-window', dest="param_match_window", type=float,
+                        default=EASL.DEFAULT_PARAMS['param_match_window'],
+                        help="only score candidate items whose modes are within "
+                             "this many match quality standard deviations of "
+                             "the anchor's mode (if 0: score all items)")
+    parser.add_argument('--workers', dest="param_workers", type=int,
+                        default=EASL.DEFAULT_PARAMS['param_workers'],
+                        help="number of processes among which to split HIT "
+                             "generation (sampling of comparison items for "
+                             "each anchor)")
+    parser.add_argument('--seed', dest="param_seed", type=int,
+                        default=EASL.DEFAULT_PARAMS['param_seed'],
+                        help="seed for the model's random number generator")
     parser.add_argument('--hits', dest="param_hits", type=int,
                         default=EASL.DEFAULT_PARAMS['param_hits'],
                         help="number of HITs to generate (if 0: as "
@@ -39,9 +54,42 @@ if __name__ == "__main__":
     parser.add_argument('--sample-var', dest="param_sample_var", action='store_true',
                         help="use sample variance with heuristic for 0, 1 samples "
                              "(default: Beta variance heuristic)")
+    parser.add_argument('--running-stats', dest="param_running_stats", action='store_true',
+                        help="keep running score count, mean, and sum of squared "
+                             "deviations for each item instead of its score history")
+    parser.add_argument('--score-log', dest="param_score_log",
+                        help="path of file to which to append raw scores "
+                             "(as id,score lines) when using --running-stats")
+    parser.add_argument('--snapshot-interval', dest="param_snapshot_interval", type=int,
+                        default=EASL.DEFAULT_PARAMS['param_snapshot_interval'],
+                        help="write a full model every this many rounds and, in "
+                             "other rounds, only the changed items (to "
+                             "<name>_<iter>.delta.csv) (if 0: always write a "
+                             "full model)")
     parser.add_argument('--na-adjust', dest="param_na_adjust", action='store_true',
                         help="reduce variance and center mode by N/A count")
+    parser.add_argument('--hit-columns', dest="param_hit_columns", nargs='+',
+                        help="model columns to write to the HIT batch file "
+                             "(default: all columns, or those referenced by "
+                             "--hit-template)")
+    parser.add_argument('--hit-template', dest="param_hit_template",
+                        help="path of HIT template (HTML) file: write only the "
+                             "model columns it references (as ${sent1}) to the "
+                             "HIT batch file")
+    parser.add_argument('--hit-format', dest="param_hit_format", choices=HIT_FORMATS,
+                        default=EASL.DEFAULT_PARAMS['param_hit_format'],
+                        help="format (and extension) of the HIT batch file")
+
+    parser.add_argument('--profile',
+                        help="path of file to write a profile of the run to: "
+                             "cProfile statistics if it ends in .prof, otherwise "
+                             "a JSON report of the time spent in each phase and "
+                             "of counters such as items loaded and pairs scored "
+                             "(appended as one line if it ends in .jsonl)")
 
     args = parser.parse_args()
 
-    run(args.operation, args.model_path, dict(**vars(args)))
+    if args.profile:
+        profile_call(args.profile, run, args.operation, args.model_path, dict(**vars(args)))
+    else:
+        run(args.operation, args.model_path, dict(**vars(args)))
@@ -0,0 +1,83 @@
+#!/usr/bin/env python
+
+
+import csv
+import sys
+
+from easl import EASL
+from easl.simulate import sweep, DEFAULT_NOISE, DEFAULT_NA_RATE
+
+
+if __name__ == '__main__':
+    from argparse import ArgumentParser, ArgumentDefaultsHelpFormatter
+    parser = ArgumentParser(
+        formatter_class=ArgumentDefaultsHelpFormatter,
+        description='Simulate EASL in memory with annotators that answer '
+                    'according to a gold standard (plus noise), for each '
+                    'combination of the specified parameter values, and '
+                    'write the Spearman correlation between the item modes '
+                    'and the gold standard after each round (in CSV format).',
+    )
+    parser.add_argument('items_path',
+                        help='Path to CSV file of items (with columns id, sent)')
+    parser.add_argument('gold_standard_path',
+                        help='Path to gold standard CSV file (with columns '
+                             'id, sent, label)')
+    parser.add_argument('--rounds', type=int, default=100,
+                        help='number of rounds to simulate')
+    parser.add_argument('--item', dest='param_items', type=int, nargs='+',
+                        default=[EASL.DEFAULT_PARAMS['param_items']],
+                        help='numbers of items per hit')
+    parser.add_argument('--match', dest='param_match', type=float, nargs='+',
+                        default=[EASL.DEFAULT_PARAMS['param_match']],
+                        help='values of parameter gamma for match quality')
+    parser.add_argument('--hits', dest='param_hits', type=int, nargs='+',
+                        default=[EASL.DEFAULT_PARAMS['param_hits']],
+                        help='numbers of HITs per round (0: as many HITs as '
+                             'are necessary to show each item at least once)')
+    parser.add_argument('--mean-windows', dest='param_mean_windows', type=int, nargs='+',
+                        choices=(0, 1), default=[0],
+                        help='whether to use mean windows to compute HITs (0: '
+                             'original EASL method, 1: mean windows)')
+    parser.add_argument('--sample-var', dest='param_sample_var', action='store_true',
+                        help='use sample variance with heuristic for 0, 1 samples '
+                             '(default: Beta variance heuristic)')
+    parser.add_argument('--repeats', type=int, default=1,
+                        help='number of simulations of each parameter combination')
+    parser.add_argument('--noise', type=float, default=DEFAULT_NOISE,
+                        help='standard deviation of the noise added to the '
+                             'annotators\' scores (in [0, 1])')
+    parser.add_argument('--na-rate', type=float, default=DEFAULT_NA_RATE,
+                        help='probability that an annotator marks an item N/A')
+    parser.add_argument('--seed', type=int, default=EASL.DEFAULT_PARAMS['param_seed'],
+                        help='seed of the first repeat (repeat r uses seed + r)')
+    parser.add_argument('--workers', type=int, default=1,
+                        help='number of processes among which to split the '
+                             'simulations')
+    parser.add_argument('--output-path',
+                        help='path of CSV file to write results to (default: '
+                             'standard output)')
+    args = parser.parse_args()
+
+    param_grid = dict(
+        param_items=args.param_items,
+        param_match=args.param_match,
+        param_hits=args.param_hits,
+        param_mean_windows=[bool(v) for v in args.param_mean_windows],
+        param_sample_var=[args.param_sample_var],
+        # score histories grow with the number of rounds
+        param_running_stats=[True],
+    )
+    records = sweep(args.items_path, args.gold_standard_path, param_grid, args.rounds,
+                    repeats=args.repeats, workers=args.workers, noise=args.noise,
+                    na_rate=args.na_rate, seed=args.seed)
+
+    f = sys.stdout if args.output_path is None else open(args.output_path, 'w', newline='')
+    try:
+        writer = csv.DictWriter(f, fieldnames=sorted(param_grid) + [
+            'repeat', 'round', 'hits', 'annotations', 'spearman'])
+        writer.writeheader()
+        writer.writerows(records)
+    finally:
+        if f is not sys.stdout:
+            f.close()
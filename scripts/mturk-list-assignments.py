@@ -3,7 +3,7 @@
 
 import boto3
 
-from easl.mturk import list_assignments, PRODUCTION_ENDPOINT_URL, SANDBOX_ENDPOINT_URL
+from easl.mturk import list_assignments, DEFAULT_CONCURRENCY, PRODUCTION_ENDPOINT_URL, SANDBOX_ENDPOINT_URL
 
 
 if __name__ == '__main__':
@@ -23,6 +23,8 @@ if __name__ == '__main__':
                         help='Filter results by exact requester annotation match')
     parser.add_argument('--approve', action='store_true',
                         help='Approve all submitted assignments')
+    parser.add_argument('--concurrency', type=int, default=DEFAULT_CONCURRENCY,
+                        help='Maximum number of concurrent approval requests')
     parser.add_argument('--sandbox', action='store_true',
                         help='Connect to Mechanical Turk sandbox '
                              '(default: production)')
@@ -32,4 +34,4 @@ if __name__ == '__main__':
         endpoint_url=SANDBOX_ENDPOINT_URL if args.sandbox else PRODUCTION_ENDPOINT_URL)
     list_assignments(hit_type_id=args.hit_type_id, batch_id=args.batch_id,
                      requester_annotation=args.requester_annotation,
-                     approve=args.approve, client=client)
+                     approve=args.approve, concurrency=args.concurrency, client=client)
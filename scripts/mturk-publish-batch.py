@@ -4,7 +4,7 @@
 import boto3
 
 from easl.mturk import (
-    publish_batch, DEFAULT_LIFETIME, DEFAULT_MAX_ASSIGNMENTS,
+    publish_batch, DEFAULT_LIFETIME, DEFAULT_MAX_ASSIGNMENTS, DEFAULT_CONCURRENCY,
     PRODUCTION_ENDPOINT_URL, SANDBOX_ENDPOINT_URL,
 )
 
@@ -21,7 +21,8 @@ if __name__ == '__main__':
     parser.add_argument('hit_layout_id',
                         help='HIT layout id (from MTurk web interface)')
     parser.add_argument('batch_csv_path',
-                        help='Path to Mechanical Turk batch csv data')
+                        help='Path to Mechanical Turk batch data (CSV or JSON lines, '
+                             'optionally gzip-compressed)')
     parser.add_argument('--batch-id',
                         help='Identifier for this batch of HITs '
                              '(if not specified, generate uuid)')
@@ -29,6 +30,8 @@ if __name__ == '__main__':
                         help='Lifetype of HIT (in seconds)')
     parser.add_argument('--max-assignments', type=int, default=DEFAULT_MAX_ASSIGNMENTS,
                         help='Max number of assignments per HIT')
+    parser.add_argument('--concurrency', type=int, default=DEFAULT_CONCURRENCY,
+                        help='Max number of HITs to submit concurrently')
     parser.add_argument('--sandbox', action='store_true',
                         help='Connect to Mechanical Turk sandbox '
                              '(default: production)')
@@ -39,4 +42,4 @@ if __name__ == '__main__':
     publish_batch(args.hit_type_id, args.hit_layout_id, args.batch_csv_path,
                   batch_id=args.batch_id,
                   lifetime=args.lifetime, max_assignments=args.max_assignments,
-                  client=client)
+                  client=client, concurrency=args.concurrency)
@@ -9,10 +9,12 @@ setup(
     version='0.2dev4',
     packages=['easl'],
     scripts=glob(os.path.join('scripts', '*.py')),
+    # multiprocessing.shared_memory (for parallel HIT generation)
+    python_requires='>=3.8',
     install_requires=[
-        'numpy',
+        # numpy.random.default_rng and SeedSequence
+        'numpy>=1.17',
         'scipy',
         'boto3',
-        'xmltodict',
     ],
 )
@@ -1,7 +1,26 @@
+import numpy as np
 from pytest import raises, mark
 from numpy.testing import assert_allclose
 
-from easl import EASL
+from easl import EASL, Session, initialize, run
+
+
+# Posteriors spread out as after a number of rounds, for 30 items
+SPREAD_POSTERIORS = dict(mode=np.arange(30) / 30., var=0.001 * (np.arange(30) % 7 + 1))
+
+
+def add_items(easl, item_ids, **columns):
+    """Add the items with the specified ids (or, if `item_ids` is a
+    number, that many items `id0`, `id1`, ...) in their initial state
+    to `easl`, setting each of `columns` to the item's element of the
+    specified sequence.
+    """
+    if isinstance(item_ids, int):
+        item_ids = ['id{}'.format(i) for i in range(item_ids)]
+    for (i, id_) in enumerate(item_ids):
+        easl.items[id_] = dict(id=id_, sent='sentence for {}'.format(id_))
+        easl.items[id_].update(easl.initial_item_state())
+        easl.items[id_].update((column, values[i]) for (column, values) in columns.items())
 
 
 @mark.parametrize('na_count', [0, 1, 2])
@@ -32,14 +51,56 @@ def test_variance(na_count):
     assert_allclose(easl.variance(1.5, 2.5, na_count, '0.5 1'), 3.75 / (4 * 4 * 5))
 
 
+@mark.parametrize('na_adjust', [False, True])
+@mark.parametrize('sample_var', [False, True])
+def test_posterior_arrays(na_adjust, sample_var):
+    easl = EASL({'param_na_adjust': na_adjust, 'param_sample_var': sample_var})
+    items = [
+        (1, 1, 0, ''),
+        (1, 1, 2, ''),
+        (1.5, 1.5, 1, '0.5'),
+        (1.5, 2.5, 0, '0.5 1'),
+        (3.25, 1.75, 3, '0.75 1 0.5'),
+        (1.2, 4.8, 1, '0.1 0 0 0.1'),
+    ]
+    (alpha, beta, na_count, score_strs) = [np.array(column) for column in zip(*items)]
+    modes = easl.modes(alpha, beta, na_count)
+    means = easl.means(alpha, beta, na_count)
+    score_count = np.array([len(s.split()) for s in score_strs])
+    score_m2 = np.array([np.var([float(x) for x in s.split()] or [0.]) * len(s.split()) for s in score_strs])
+    variances = easl.variances(alpha, beta, na_count, score_count, score_m2)
+    for (i, item) in enumerate(items):
+        assert_allclose(modes[i], easl.mode(*item))
+        assert_allclose(means[i], easl.mean(*item))
+        assert_allclose(variances[i], easl.variance(*item))
+    with raises(Exception):
+        easl.modes(np.array([1.5, 0.5]), np.array([1.5, 0.5]), np.array([0, 0]))
+
+
+def test_update_posteriors():
+    easl = EASL({'param_running_stats': True})
+    add_items(easl, 3)
+    easl.observe_batch(np.array([0, 0, 1, 1, 2]), np.array([1., 0.5, 0.75, 1., 0.]),
+                       np.array([False, False, False, True, True]))
+
+    easl.params['param_na_adjust'] = True
+    easl.params['param_sample_var'] = True
+    epoch = easl.items.touch_epoch()
+    easl.update_posteriors()
+    assert easl.items.touched_since(epoch).tolist() == [0, 1, 2]
+    assert_allclose(easl.items.column('mode'), [
+        easl.mode(easl.items[id_]['alpha'], easl.items[id_]['beta'], easl.items[id_]['na_count'], '')
+        for id_ in ('id0', 'id1', 'id2')])
+    assert_allclose(easl.items.column('mode'), [0.75, 0.5, 0.5])
+    assert_allclose(easl.items.column('var'), [0.125, 0.75, 1.])
+
+
 @mark.parametrize('total_num_items,num_items,num_hits,expected_num_hits',
                   [(30, 7, 4, 4), (30, 7, 0, 5)])
 def test_get_next_k_0(total_num_items, num_items, num_hits, expected_num_hits):
     easl = EASL({'param_items': num_items, 'param_hits': num_hits})
-    item_ids = set('id{}'.format(i) for i in range(total_num_items))
-    for id_ in item_ids:
-        easl.items[id_] = dict(id=id_, sent='sentence for {}'.format(id_))
-        easl.items[id_].update(easl.INITIAL_ITEM_STATE)
+    add_items(easl, total_num_items)
+    item_ids = set(easl.items.ids)
 
     hits = easl.get_next_k(0)
 
@@ -54,3 +115,266 @@ def test_get_next_k_0(total_num_items, num_items, num_hits, expected_num_hits):
     assert len(observed_item_ids) == expected_num_hits * num_items
     assert len(set(observed_item_ids)) == min(total_num_items, expected_num_hits * num_items)
     assert item_ids.issuperset(observed_item_ids)
+
+
+def test_observe(tmpdir):
+    easl = EASL({'param_items': 2})
+    add_items(easl, ['a', 'b', 'c'])
+
+    results_path = str(tmpdir.join('results.csv'))
+    with open(results_path, 'w') as f:
+        f.write('Input.id1,Input.id2,Answer.range1,Answer.range2,Answer.na1,Answer.na2\n'
+                'a,b,50,100,,on\n'
+                'c,a,0,25,,\n'
+                'b,a,75,0,on,\n')
+    easl.observe(results_path)
+
+    assert_allclose(easl.items['a']['alpha'], 1.75)
+    assert_allclose(easl.items['a']['beta'], 3.25)
+    assert easl.items['a']['na_count'] == 0
+    assert easl.items['a']['scores'] == ' 0.50 0.25 0.00'
+    assert_allclose(easl.items['a']['mode'], easl.mode(1.75, 3.25, 0, ' 0.50 0.25 0.00'))
+    assert_allclose(easl.items['a']['var'], easl.variance(1.75, 3.25, 0, ' 0.50 0.25 0.00'))
+    assert easl.items['b']['alpha'] == 1
+    assert easl.items['b']['na_count'] == 2
+    assert easl.items['b']['scores'] == ''
+    assert_allclose(easl.items['c']['beta'], 2)
+    assert easl.items['c']['scores'] == ' 0.00'
+    assert_allclose(easl.items['c']['mode'], 0)
+
+
+@mark.parametrize('sample_var', [False, True])
+def test_observe_running_stats(tmpdir, sample_var):
+    results_path = str(tmpdir.join('results.csv'))
+    with open(results_path, 'w') as f:
+        f.write('Input.id1,Input.id2,Answer.range1,Answer.range2,Answer.na1,Answer.na2\n'
+                'a,b,50,100,,on\n'
+                'c,a,0,25,,\n'
+                'b,a,75,0,on,\n'
+                'a,c,33,67,,\n')
+
+    models = []
+    for running_stats in (False, True):
+        easl = EASL({'param_items': 2, 'param_sample_var': sample_var,
+                     'param_running_stats': running_stats,
+                     'param_score_log': str(tmpdir.join('scores.log')) if running_stats else None})
+        add_items(easl, ['a', 'b', 'c'])
+        easl.observe(results_path)
+        easl.observe(results_path)
+        easl.saveItem(str(tmpdir.join('model_{}_1.csv'.format(int(running_stats)))))
+        models.append(easl)
+
+    (history_model, stats_model) = models
+    assert 'scores' not in stats_model.headerModel
+    assert stats_model.items['a']['score_count'] == 8
+    assert stats_model.items['b']['score_count'] == 0
+    for column in ('alpha', 'beta', 'na_count', 'mode', 'var'):
+        assert_allclose(stats_model.items.column(column), history_model.items.column(column))
+    with open(str(tmpdir.join('scores.log'))) as f:
+        assert f.read().split('\n')[:3] == ['a,0.50', 'c,0.00', 'a,0.25']
+
+
+def test_score_log_conversion(tmpdir):
+    model_path = str(tmpdir.join('model_0.csv'))
+    score_log_path = str(tmpdir.join('scores.log'))
+    model = EASL()
+    add_items(model, ['a', 'b'])
+    model.items['a']['scores'] = ' 0.50 0.25'
+    model.saveItem(model_path)
+
+    # the history is only logged once the converted model is saved
+    params = {'param_items': 2, 'param_running_stats': True, 'param_score_log': score_log_path}
+    for _ in range(2):
+        run('generate', model_path, params)
+    assert not tmpdir.join('scores.log').check()
+    model = EASL(params)
+    model.loadItem(model_path)
+    assert model.items['a']['score_count'] == 2
+    model.saveItem(str(tmpdir.join('model_1.csv')))
+    model.saveItem(str(tmpdir.join('model_2.csv')))
+    with open(score_log_path) as f:
+        assert f.read() == 'a,0.50\na,0.25\n'
+
+
+@mark.parametrize('background', [False, True])
+def test_session(tmpdir, background):
+    model_path = str(tmpdir.join('model_0.csv'))
+    model = EASL()
+    add_items(model, ['a', 'b', 'c', 'd'])
+    model.saveItem(model_path)
+
+    with Session(model_path, {'param_items': 2, 'param_snapshot_interval': 2}) as session:
+        assert session.next_batch() == str(tmpdir.join('model_hit_1.csv'))
+        assert tmpdir.join('model_hit_1.csv').check()
+        for iter_num in (1, 2):
+            session.observe_results([
+                {'Input.id1': 'a', 'Input.id2': 'b', 'Answer.range1': '50', 'Answer.range2': '100'},
+            ])
+            assert session.iter_num == iter_num
+            session.checkpoint(background=background)
+            session.next_batch()
+        assert session.model.items['b']['alpha'] == 3
+
+    assert tmpdir.join('model_1.delta.csv').check()
+    assert tmpdir.join('model_2.csv').check()
+    assert tmpdir.join('model_hit_3.csv').check()
+    model = EASL()
+    model.loadItem(str(tmpdir.join('model_1.csv')))
+    assert model.items['b']['alpha'] == 2
+    model.loadItem(str(tmpdir.join('model_2.csv')))
+    assert model.items['b']['alpha'] == 3
+
+
+def test_get_next_k_exclude():
+    easl = EASL({'param_items': 3, 'param_hits': 4})
+    add_items(easl, 10, mode=np.arange(10) / 10., var=0.01 * np.arange(1, 11))
+    assert sorted(easl.get_next_k(1)) == ['id6', 'id7', 'id8', 'id9']
+    next_items = easl.get_next_k(1, k=2, exclude={'id9', 'id7'})
+    assert sorted(next_items) == ['id6', 'id8']
+    assert all(len(compare_ids) == 2 for compare_ids in next_items.values())
+
+    # no more HITs than items that are not excluded
+    next_items = easl.get_next_k(1, k=10, exclude={'id9', 'id7'})
+    assert sorted(next_items) == ['id{}'.format(i) for i in (0, 1, 2, 3, 4, 5, 6, 8)]
+
+    easl.params['param_mean_windows'] = True
+    next_items = easl.get_next_k(1, k=2, exclude={'id4', 'id5'})
+    assert next_items == {'id1': ['id2', 'id3'], 'id6': ['id7', 'id8']}
+    with raises(Exception):
+        easl.get_next_k(1, k=3, exclude={'id4', 'id5'})
+
+
+def test_get_next_k_mean_windows():
+    easl = EASL({'param_items': 3, 'param_hits': 2, 'param_mean_windows': True})
+    add_items(easl, 10, mode=np.arange(10) / 10.)
+    hits = easl.get_next_k(1)
+    assert hits == {'id2': ['id3', 'id4'], 'id5': ['id6', 'id7']}
+
+    # the mode order is updated with the observed items, even after the
+    # changes are marked saved
+    mode_order = easl.mode_order()
+    easl.observe_batch(np.array([0, 9]), np.array([0.5, 0.5]), np.array([False, False]))
+    easl.reset_changes()
+    easl.get_next_k(1)
+    assert easl.mode_order() is mode_order
+    modes = easl.items.column('mode')
+    assert mode_order.order.tolist() == np.lexsort((mode_order.keys, modes)).tolist()
+
+
+@mark.parametrize('num_hits', [1, 4, 30])
+@mark.parametrize('match_window', [0, 0.5, 3])
+@mark.parametrize('workers', [1, 3])
+def test_get_next_k_match(num_hits, match_window, workers):
+    easl = EASL({'param_items': 5, 'param_hits': num_hits, 'param_match_window': match_window,
+                 'param_workers': workers})
+    add_items(easl, 30, mode=np.arange(30) / 30., var=np.where(np.arange(30) < 20, 0.01, 0.05))
+
+    hits = easl.get_next_k(1)
+
+    assert len(hits) == num_hits
+    if num_hits <= 10:
+        assert all(int(anchor_item[2:]) >= 20 for anchor_item in hits)
+    for (anchor_item, rel_items) in hits.items():
+        assert len(rel_items) == 4
+        assert len(set(rel_items)) == 4
+        assert anchor_item not in rel_items
+
+
+@mark.parametrize('workers', [1, 2])
+def test_get_next_k_match_window_mode_order(workers):
+    easl = EASL({'param_items': 3, 'param_hits': 4, 'param_match_window': 3., 'param_workers': workers})
+    add_items(easl, 30, **SPREAD_POSTERIORS)
+    easl.get_next_k(1)
+    mode_order = easl._mode_order
+    assert mode_order is not None
+    easl.observe_batch(np.array([0, 29]), np.array([0.9, 0.1]), np.zeros(2, dtype=bool))
+    next_items = easl.get_next_k(1)
+    # the order is updated rather than rebuilt
+    assert easl._mode_order is mode_order
+    assert mode_order.order.tolist() == np.lexsort((mode_order.keys, easl.items.column('mode'))).tolist()
+    assert all(len(set(compare_ids)) == 2 for compare_ids in next_items.values())
+
+
+def test_get_next_k_worker_pool():
+    easl = EASL({'param_items': 3, 'param_hits': 4, 'param_workers': 2})
+    add_items(easl, 30, **SPREAD_POSTERIORS)
+    easl.get_next_k(1)
+    executor = easl._worker_pool.executor()
+    easl.get_next_k(2)
+    # the processes are kept from call to call
+    assert easl._worker_pool.executor() is executor
+    easl.close()
+    assert easl._worker_pool is None
+
+
+def test_get_next_k_match_cache():
+    hits = []
+    for match_cache in (False, True):
+        easl = EASL({'param_items': 3, 'param_hits': 4, 'param_match_cache': match_cache})
+        add_items(easl, 30, **SPREAD_POSTERIORS)
+        hits.append([])
+        for iter_num in range(1, 5):
+            next_items = easl.get_next_k(iter_num)
+            hits[-1].append(next_items)
+            # answer only the first HIT (the others expire)
+            (anchor_id, compare_ids) = sorted(next_items.items())[0]
+            indices = np.array([easl.items.index[item_id] for item_id in [anchor_id] + compare_ids])
+            easl.observe_batch(indices, np.array([0.2, 0.5, 0.8]), np.zeros(3, dtype=bool))
+            easl.reset_changes()
+    assert hits[0] == hits[1]
+    assert len(easl.match_cache(0.1).log_weights) == 4
+
+
+@mark.parametrize('iter_num,params', [
+    (0, {}),
+    (1, {}),
+    (1, {'param_mean_windows': True}),
+    (1, {'param_workers': 2}),
+])
+def test_get_next_k_seed(iter_num, params):
+    hits = []
+    for seed in (1, 1, 2):
+        easl = EASL(dict(params, param_items=3, param_hits=5, param_seed=seed))
+        add_items(easl, 30)
+        hits.append(dict((anchor, list(rel_items)) for (anchor, rel_items) in easl.get_next_k(iter_num).items()))
+    assert hits[0] == hits[1]
+    assert hits[0] != hits[2]
+
+
+ITEMS_CSV = (
+    'id,sent,source\n'
+    '1,plain sentence,a\n'
+    '2,"a sentence, with a comma",b\n'
+    '\n'
+    '3,fish & chips <b>bold</b> "quoted" it\'s,c\n'
+    '4,emoji \U0001F600 and café,d\n'
+    '5&,another plain sentence,\n'
+)
+
+
+@mark.parametrize('running_stats', [False, True])
+@mark.parametrize('chunk_size,workers', [(10000, 1), (2, 1), (1, 2)])
+def test_initialize(tmpdir, running_stats, chunk_size, workers):
+    items_path = str(tmpdir.join('items.csv'))
+    with open(items_path, 'w', encoding='utf-8') as f:
+        f.write(ITEMS_CSV)
+    params = {'param_running_stats': running_stats}
+    model = EASL(params)
+    model.initItem(items_path)
+    model.saveItem(str(tmpdir.join('expected_0.csv')))
+
+    initialize(items_path, str(tmpdir.join('items_0.csv')), params, chunk_size=chunk_size, workers=workers)
+    with open(str(tmpdir.join('expected_0.csv')), 'rb') as f:
+        expected = f.read()
+    with open(str(tmpdir.join('items_0.csv')), 'rb') as f:
+        assert f.read() == expected
+    assert b'fish &amp; chips &lt;b&gt;' in expected
+    assert b"data-emoji-bytes='[240, 159, 152, 128]'" in expected
+
+
+def test_initialize_duplicate_ids(tmpdir):
+    items_path = str(tmpdir.join('items.csv'))
+    with open(items_path, 'w') as f:
+        f.write('id,sent\n1,a\n2,b\n1,c\n')
+    with raises(ValueError):
+        initialize(items_path, str(tmpdir.join('items_0.csv')), chunk_size=2)
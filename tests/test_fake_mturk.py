@@ -0,0 +1,161 @@
+import csv
+import os
+import time
+
+from botocore.exceptions import ClientError
+from pytest import mark, raises
+
+from easl import EASL, profiling
+from easl.annotator import GoldAnnotator
+from easl.fake_mturk import FakeMTurkClient
+from easl.mturk import loop, publish_batch, wait_hits, parse_answer, iter_hit_assignment_pairs, EXPIRE_AT
+
+TEMPLATE_PATH = os.path.join(os.path.dirname(__file__), '..', 'templates', 'political', 'template_political.html')
+
+
+def create_model(tmpdir, num_items=12):
+    gold_path = str(tmpdir.join('gold.csv'))
+    model_path = str(tmpdir.join('model_0.csv'))
+    with open(gold_path, 'w') as f:
+        f.write('id,sent,label\n')
+        for i in range(num_items):
+            f.write('{0},sentence {0},{1}\n'.format(i, i - num_items / 2))
+    model = EASL()
+    for i in range(num_items):
+        model.items[str(i)] = dict(id=str(i), sent='sentence {}'.format(i))
+        model.items[str(i)].update(model.INITIAL_ITEM_STATE)
+    model.saveItem(model_path)
+    return (gold_path, model_path)
+
+
+def test_gold_annotator(tmpdir):
+    (gold_path, _) = create_model(tmpdir)
+    annotator = GoldAnnotator(gold_path, noise=0.)
+    (scores, is_na) = annotator.annotate(['0', '6', '11'])
+    assert scores.tolist() == [0., 0.55, 1.]
+    assert not is_na.any()
+    (_, is_na) = GoldAnnotator(gold_path, na_rate=1.).annotate(['0', '6'])
+    assert is_na.all()
+
+
+def test_fake_mturk_client(tmpdir):
+    (gold_path, _) = create_model(tmpdir)
+    client = FakeMTurkClient(gold_path, work_time=(0., 0.05), seed=1)
+    hit_ids = []
+    for i in range(5):
+        response = client.create_hit_with_hit_type(
+            HITTypeId='TYPE', HITLayoutId='LAYOUT', LifetimeInSeconds=60, MaxAssignments=2,
+            UniqueRequestToken=str(i), RequesterAnnotation='',
+            HITLayoutParameters=[dict(Name='id1', Value='0'), dict(Name='id2', Value='11')])
+        hit_ids.append(response['HIT']['HITId'])
+    with raises(ClientError):
+        client.create_hit_with_hit_type(HITTypeId='TYPE', LifetimeInSeconds=60, UniqueRequestToken='0')
+
+    time.sleep(0.1)
+    pages = list(client.get_paginator('list_reviewable_hits').paginate(HITTypeId='TYPE', MaxResults=2))
+    assert [len(page['HITs']) for page in pages] == [2, 2, 1]
+    assignments = [
+        assignment
+        for page in client.get_paginator('list_assignments_for_hit').paginate(HITId=hit_ids[0])
+        for assignment in page['Assignments']]
+    assert len(assignments) == 2
+    answers = parse_answer(assignments[0]['Answer'])
+    assert set(answers) == {'range1', 'range2'}
+    assert int(answers['range1']) < int(answers['range2'])
+
+    client.approve_assignment(AssignmentId=assignments[0]['AssignmentId'])
+    assert client.get_assignment(
+        AssignmentId=assignments[0]['AssignmentId'])['Assignment']['AssignmentStatus'] == 'Approved'
+    with raises(ClientError):
+        client.approve_assignment(AssignmentId=assignments[0]['AssignmentId'])
+    assert len(list(iter_hit_assignment_pairs(hit_type_id='TYPE', client=client))) == 10
+
+
+@mark.parametrize('hit_format', ['csv', 'jsonl.gz'])
+def test_fake_mturk_publish_and_wait(tmpdir, hit_format):
+    (gold_path, model_path) = create_model(tmpdir)
+    hit_path = str(tmpdir.join('model_hit_1.' + hit_format))
+    model = EASL({'param_items': 3, 'param_hit_template': TEMPLATE_PATH})
+    model.loadItem(model_path)
+    model.generateHits(hit_path, model.get_next_k(0))
+
+    client = FakeMTurkClient(gold_path, latency=0.001, throttle_rate=0.2, work_time=(0., 0.05), seed=4)
+    batch_data = publish_batch('TYPE', 'LAYOUT', hit_path, client=client, concurrency=4, backoff=0.001)
+    assert len(client.hits) == 4
+    assert all(len(hit['_Params']) == 6 for hit in client.hits.values())
+    assert client.num_throttled > 0
+
+    hit_ids = [hit['HITId'] for hit in batch_data['hits']]
+    client.throttle_rate = 0.
+    hit_assignments = wait_hits(hit_ids, interval=0.01, client=client, concurrency=4)
+    assert all(len(hit_assignments[hit_id]) == 1 for hit_id in hit_ids)
+
+
+def test_fake_mturk_loop(tmpdir):
+    (gold_path, model_path) = create_model(tmpdir)
+    client = FakeMTurkClient(gold_path, throttle_rate=0.1, work_time=(0., 0.02), seed=3)
+    profiler = profiling.enable()
+    try:
+        loop(model_path, {'param_items': 3, 'param_hits': 4}, 'TYPE', 'LAYOUT', 3,
+             client=client, interval=0.01, concurrency=4)
+    finally:
+        profiling.disable()
+
+    assert len(client.hits) == 12
+    assert all(assignment['AssignmentStatus'] == 'Approved' for assignment in client.assignments.values())
+    with open(str(tmpdir.join('model_result_3.csv'))) as f:
+        assert len(list(csv.DictReader(f))) == 4
+    model = EASL()
+    model.loadItem(str(tmpdir.join('model_3.csv')))
+    assert sum(model.items.column('alpha') + model.items.column('beta')) == 2 * 12 + 3 * 4 * 3
+
+    report = profiler.report()
+    assert report['totals']['round']['count'] == 3
+    assert report['counters']['hits_published'] == 12
+    assert report['counters']['assignments_approved'] == 12
+    assert report['counters']['api_calls'] == client.num_requests
+    assert report['counters']['api_retries'] == client.num_throttled
+
+
+class StragglingClient(FakeMTurkClient):
+    # the last HIT of each batch of 4 is only worked on once it has
+    # expired
+
+    def create_hit_with_hit_type(self, **kwargs):
+        response = super(StragglingClient, self).create_hit_with_hit_type(**kwargs)
+        hit_id = response['HIT']['HITId']
+        if len(self.hits) % 4 == 0:
+            with self.lock:
+                self.pending[hit_id] = [(float('inf'), assignment_id) for (_, assignment_id) in self.pending[hit_id]]
+        return response
+
+    def update_expiration_for_hit(self, HITId, ExpireAt):
+        response = super(StragglingClient, self).update_expiration_for_hit(HITId, ExpireAt)
+        with self.lock:
+            self.pending[HITId] = [(0., assignment_id) for (_, assignment_id) in self.pending[HITId]]
+        return response
+
+
+def test_fake_mturk_loop_stragglers(tmpdir):
+    (gold_path, model_path) = create_model(tmpdir)
+    client = StragglingClient(gold_path, work_time=(0., 0.02), seed=3)
+    profiler = profiling.enable()
+    try:
+        loop(model_path, {'param_items': 3, 'param_hits': 4}, 'TYPE', 'LAYOUT', 3,
+             client=client, interval=0.01, concurrency=4, completion=0.75)
+    finally:
+        profiling.disable()
+
+    # the incomplete HIT of each round is expired, and its assignment
+    # applied with the next round's (or, in the last round, approved)
+    assert [hit['Expiration'] == EXPIRE_AT for hit in client.hits.values()] == [False, False, False, True] * 3
+    assert all(assignment['AssignmentStatus'] == 'Approved' for assignment in client.assignments.values())
+    num_rows = []
+    for round_num in range(1, 4):
+        with open(str(tmpdir.join('model_result_{}.csv'.format(round_num)))) as f:
+            num_rows.append(len(list(csv.DictReader(f))))
+    assert num_rows == [3, 4, 4]
+    model = EASL()
+    model.loadItem(str(tmpdir.join('model_3.csv')))
+    assert sum(model.items.column('alpha') + model.items.column('beta')) == 2 * 12 + 3 * sum(num_rows)
+    assert profiler.report()['counters']['hits_expired'] == 3
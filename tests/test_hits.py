@@ -0,0 +1,79 @@
+import csv
+import os
+
+import numpy as np
+from pytest import mark, raises
+
+from easl import EASL
+from easl.hits import write_hit_batch, iter_hit_batch, template_columns, template_answer_names, HIT_FORMATS
+from easl.store import ItemStore
+
+
+TEMPLATE_PATH = os.path.join(os.path.dirname(__file__), '..', 'templates', 'political', 'template_political.html')
+
+
+def create_store():
+    store = ItemStore(['id', 'sent', 'alpha', 'mode'])
+    for i in range(5):
+        store.append(dict(id=str(i), sent='sentence, "{}"'.format(i), alpha=i + 1, mode=i / 8.))
+    return store
+
+
+@mark.parametrize('hit_format', HIT_FORMATS)
+def test_write_hit_batch(tmpdir, hit_format):
+    hit_path = str(tmpdir.join('model_hit_1.' + hit_format))
+    store = create_store()
+    write_hit_batch(hit_path, store, np.array([[4, 0, 2], [1, 3, -1]]), ['sent', 'mode'])
+    hits = list(iter_hit_batch(hit_path))
+    assert hits == [
+        dict(sent1='sentence, "4"', sent2='sentence, "0"', sent3='sentence, "2"',
+             mode1='0.5', mode2='0', mode3='0.25'),
+        dict(sent1='sentence, "1"', sent2='sentence, "3"', sent3='',
+             mode1='0.125', mode2='0.375', mode3=''),
+    ]
+    if hit_format == 'csv':
+        with open(hit_path) as f:
+            assert next(csv.reader(f)) == ['sent1', 'sent2', 'sent3', 'mode1', 'mode2', 'mode3']
+
+
+def test_template_columns():
+    assert template_columns(TEMPLATE_PATH) == ['id', 'sent']
+
+
+def test_template_answer_names():
+    assert template_answer_names(TEMPLATE_PATH) == ['range1', 'range2', 'range3', 'range4', 'range5', 'Comments']
+
+
+def test_generate_hits(tmpdir):
+    model_path = str(tmpdir.join('model_0.csv'))
+    model = EASL()
+    for i in range(7):
+        model.items[str(i)] = dict(id=str(i), sent='sentence {}'.format(i))
+        model.items[str(i)].update(model.INITIAL_ITEM_STATE)
+    model.saveItem(model_path)
+
+    model = EASL({'param_items': 3})
+    model.loadItem(model_path)
+    model.loadItem(model_path)
+    assert len(model.headerHits) == 3 * len(model.headerModel)
+    hit_path = str(tmpdir.join('model_hit_1.csv'))
+    model.generateHits(hit_path, model.get_next_k(0))
+    with open(hit_path) as f:
+        hits = list(csv.DictReader(f))
+    assert len(hits) == 3
+    for hit in hits:
+        assert list(hit) == model.headerHits
+        for i in range(1, 4):
+            assert hit['sent{}'.format(i)] == 'sentence ' + hit['id{}'.format(i)]
+            assert hit['alpha{}'.format(i)] == '1'
+
+    model = EASL({'param_items': 3, 'param_hit_template': TEMPLATE_PATH})
+    model.loadItem(model_path)
+    model.generateHits(hit_path, model.get_next_k(0))
+    with open(hit_path) as f:
+        assert next(csv.reader(f)) == ['id1', 'id2', 'id3', 'sent1', 'sent2', 'sent3']
+
+    model = EASL({'param_hit_columns': ['id', 'label']})
+    model.loadItem(model_path)
+    with raises(Exception):
+        model.generateHits(hit_path, model.get_next_k(0))
@@ -38,7 +38,8 @@ def script_data(request):
 # because the anchors for all num_hits HITs are removed from the candidates for
 # the other (num_items - 1) items in each HIT
 @mark.parametrize('update_generate, num_hits,num_items,bool_flags,overlap',
-                  list(it.product((False, True), (0, 1, 30), (1, 5), ('', '--sample-var', '--na-adjust'), (0,))) +
+                  list(it.product((False, True), (0, 1, 30), (1, 5),
+                                  ('', '--sample-var', '--na-adjust', '--sample-var --running-stats'), (0,))) +
                   list(it.product((False, True), (1, 30), (1, 5), ('--mean-windows',), (0, 2))))
 def test_scripts(script_data, update_generate, num_hits, num_items, bool_flags, overlap):
     prefix = script_data['prefix']
@@ -80,3 +81,74 @@ def test_scripts(script_data, update_generate, num_hits, num_items, bool_flags,
                 overlap=overlap,
                 round=round_num,
             ).strip().split())
+
+
+@mark.parametrize('binary,snapshot_interval', [(False, 2), (True, 0), (True, 2)])
+def test_scripts_model_formats(script_data, binary, snapshot_interval):
+    prefix = script_data['prefix']
+    ext = 'easl' if binary else 'csv'
+    check_call(
+        'python {script} {prefix}political.csv {binary_flag}'.format(
+            script=os.path.join('scripts', 'easl-initialize.py'),
+            prefix=prefix,
+            binary_flag='--binary' if binary else '').split())
+    for round_num in range(NUM_ROUNDS):
+        check_call(
+            'python {script} generate {prefix}political_{round}.{ext} --hits 10'.format(
+                script=os.path.join('scripts', 'easl-main.py'),
+                prefix=prefix,
+                round=round_num,
+                ext=ext,
+            ).split())
+        simulate_hit_results(
+            '{prefix}political_hit_{next_round}.csv'.format(prefix=prefix, next_round=round_num + 1),
+            '{prefix}political_result_{next_round}.csv'.format(prefix=prefix, next_round=round_num + 1))
+        check_call(
+            'python {script} update {prefix}political_{round}.{ext} --hits 10 '
+            '--snapshot-interval {snapshot_interval}'.format(
+                script=os.path.join('scripts', 'easl-main.py'),
+                prefix=prefix,
+                round=round_num,
+                ext=ext,
+                snapshot_interval=snapshot_interval,
+            ).split())
+    for round_num in range(NUM_ROUNDS + 1):
+        model_path = os.path.join(prefix, 'political_{}.{}'.format(round_num, ext))
+        delta_path = os.path.join(prefix, 'political_{}.delta.csv'.format(round_num))
+        if snapshot_interval and round_num % snapshot_interval != 0:
+            assert not os.path.exists(model_path)
+            assert os.path.exists(delta_path)
+        else:
+            assert os.path.exists(model_path)
+            assert not os.path.exists(delta_path)
+    check_call(
+        'python {script} {prefix}political_{round}.{ext} {prefix}political_{round}.csv.out'.format(
+            script=os.path.join('scripts', 'easl-convert.py'),
+            prefix=prefix,
+            round=NUM_ROUNDS,
+            ext=ext,
+        ).split())
+    check_call(
+        'python {script} {prefix}political_{round}.{ext} experiments/political/political_gold.csv'.format(
+            script=os.path.join('scripts', 'easl-evaluate.py'),
+            prefix=prefix,
+            round=NUM_ROUNDS,
+            ext=ext,
+        ).split())
+    safe_remove(os.path.join(prefix, 'political_{}.csv.out'.format(NUM_ROUNDS)))
+    for round_num in range(NUM_ROUNDS + 1):
+        safe_remove(os.path.join(prefix, 'political_{}.delta.csv'.format(round_num)))
+        if binary and os.path.isdir(os.path.join(prefix, 'political_{}.easl'.format(round_num))):
+            shutil.rmtree(os.path.join(prefix, 'political_{}.easl'.format(round_num)))
+
+
+def test_scripts_simulate(tmpdir):
+    output_path = str(tmpdir.join('simulation.csv'))
+    check_call(
+        'python {script} experiments/political/political.csv experiments/political/political_gold.csv '
+        '--rounds 3 --hits 10 --item 3 5 --mean-windows 0 1 --workers 2 --output-path {output_path}'.format(
+            script=os.path.join('scripts', 'easl-simulate.py'),
+            output_path=output_path,
+        ).split())
+    with open(output_path) as f:
+        assert len(f.readlines()) == 1 + 2 * 2 * 3
@@ -0,0 +1,200 @@
+import numpy as np
+from numpy.testing import assert_allclose
+from pytest import mark
+
+from easl import profiling
+from easl.parallel import sample_matches_parallel
+from easl.match import (
+    match_quality, log_match_quality, iter_log_match_weights, sample_matches, sample_matches_windowed,
+    variance_buckets, MatchCache,
+)
+from easl.store import ItemStore
+
+
+def _scalar_match_quality(m_j, var_j, m_i, var_i, gamma):
+    csq = 2. * gamma**2 + var_j + var_i
+    return np.sqrt(2.0 * gamma**2 / csq) * np.exp(-((m_j - m_i)**2) / (2.0 * csq))
+
+
+def test_match_quality():
+    modes = np.array([0.5, 0.1, 0.9, 0.3])
+    variances = np.array([0.0833, 0.01, 0.02, 0.05])
+    quality = match_quality(modes[:2], variances[:2], modes, variances, 0.1)
+    assert quality.shape == (2, 4)
+    for j in range(2):
+        for i in range(4):
+            assert_allclose(
+                quality[j, i],
+                _scalar_match_quality(modes[j], variances[j], modes[i], variances[i], 0.1))
+
+
+def test_log_match_quality():
+    modes = np.array([0.5, 0.1, 0.9, 0.3])
+    variances = np.array([0.0833, 0.01, 0.02, 0.05])
+    assert_allclose(
+        log_match_quality(modes[1:3], variances[1:3], modes, variances, 0.2),
+        np.log(match_quality(modes[1:3], variances[1:3], modes, variances, 0.2)))
+
+
+def test_iter_log_match_weights():
+    modes = np.linspace(0, 1, 7)
+    variances = np.full(7, 0.0833)
+    anchor_indices = np.array([3, 0, 6])
+    blocks = list(iter_log_match_weights(anchor_indices, modes, variances, 0.1, block_size=14))
+    assert [(start, end) for (start, end, _) in blocks] == [(0, 2), (2, 3)]
+    for (start, end, log_weights) in blocks:
+        for (j, anchor) in enumerate(anchor_indices[start:end]):
+            assert log_weights[j, anchor] == -np.inf
+            for i in range(7):
+                if i != anchor:
+                    assert_allclose(
+                        np.exp(log_weights[j, i]),
+                        _scalar_match_quality(modes[anchor], variances[anchor], modes[i], variances[i], 0.1))
+
+
+def test_sample_matches():
+    modes = np.linspace(0, 1, 50)
+    variances = np.full(50, 0.01)
+    anchor_indices = np.array([0, 25, 49])
+    selected = sample_matches(anchor_indices, modes, variances, 0.1, 4, block_size=60)
+    assert selected.shape == (3, 4)
+    for (anchor, matches) in zip(anchor_indices, selected):
+        assert anchor not in matches
+        assert len(set(matches)) == 4
+
+
+def test_sample_matches_windowed():
+    modes = np.linspace(0, 1, 200)
+    variances = np.linspace(0.001, 0.01, 200)
+    gamma = 0.05
+    anchor_indices = np.array([0, 100, 199])
+    window = 1.
+    (selected, dropped_mass) = sample_matches_windowed(anchor_indices, modes, variances, gamma, 4, window)
+    assert selected.shape == (3, 4)
+    for (j, anchor) in enumerate(anchor_indices):
+        assert anchor not in selected[j]
+        assert len(set(selected[j])) == 4
+        half_width = window * np.sqrt(2 * gamma ** 2 + variances[anchor] + variances.max())
+        assert np.all(np.abs(modes[selected[j]] - modes[anchor]) <= half_width)
+
+        quality = match_quality(modes[anchor:anchor + 1], variances[anchor:anchor + 1], modes, variances, gamma)[0]
+        quality[anchor] = 0
+        outside = np.abs(modes - modes[anchor]) > half_width
+        assert 0 < quality[outside].sum() / quality.sum() <= dropped_mass[j]
+
+    (_, dropped_mass) = sample_matches_windowed(anchor_indices, modes, variances, gamma, 4, 100.)
+    assert np.all(dropped_mass == 0)
+    (selected, _) = sample_matches_windowed(anchor_indices, modes, variances, gamma, 50, 0.1)
+    assert selected.shape == (3, 50)
+
+
+def test_variance_buckets():
+    variances = np.array([0.0001, 0.0005, 0.002, 0.01, 1 / 12.])
+    assert variance_buckets(variances, 0.02).tolist() == [0, 0, 1, 3, 6]
+    assert variance_buckets(np.zeros(3), 0.).tolist() == [0, 0, 0]
+
+
+@mark.parametrize('block_size', [100, 2 ** 22])
+def test_sample_matches_windowed_high_variance(block_size):
+    # one unobserved item only widens the windows of its own bucket
+    rng = np.random.default_rng(0)
+    modes = rng.random(1000)
+    variances = rng.uniform(0.0001, 0.001, 1000)
+    variances[0] = 1 / 12.
+    gamma = 0.02
+    anchor_indices = np.array([10, 200, 400, 401, 600, 999])
+    profiler = profiling.enable()
+    try:
+        (selected, dropped_mass) = sample_matches_windowed(
+            anchor_indices, modes, variances, gamma, 4, 3., rng=rng, block_size=block_size)
+    finally:
+        profiling.disable()
+    assert profiler.counters['pairs_scored'] < 0.5 * len(anchor_indices) * len(modes)
+    buckets = variance_buckets(variances, gamma)
+    bucket_max_vars = np.array([variances[buckets == bucket].max(initial=0.) for bucket in range(buckets.max() + 1)])
+    for (j, anchor) in enumerate(anchor_indices):
+        assert anchor not in selected[j]
+        assert len(set(selected[j])) == 4
+
+        # the items outside the window of their bucket hold at most the
+        # dropped mass
+        quality = match_quality(modes[anchor:anchor + 1], variances[anchor:anchor + 1], modes, variances, gamma)[0]
+        quality[anchor] = 0
+        outside = np.abs(modes - modes[anchor]) > 3. * np.sqrt(
+            2 * gamma ** 2 + variances[anchor] + bucket_max_vars[buckets])
+        assert quality[outside].sum() / quality.sum() <= dropped_mass[j] < 1
+
+
+@mark.parametrize('window', [0., 2.])
+def test_sample_matches_parallel(window):
+    modes = np.linspace(0, 1, 100)
+    variances = np.full(100, 0.01)
+    anchor_indices = np.array([0, 10, 20, 50, 99])
+    results = [
+        sample_matches_parallel(anchor_indices, modes, variances, 0.1, 4, 2,
+                                np.random.SeedSequence(42), window=window)
+        for _ in range(2)]
+    for (selected, dropped_mass) in results:
+        assert selected.shape == (5, 4)
+        for (anchor, matches) in zip(anchor_indices, selected):
+            assert anchor not in matches
+            assert len(set(matches)) == 4
+        assert (dropped_mass is None) == (not window)
+    assert np.array_equal(results[0][0], results[1][0])
+
+
+def test_match_cache():
+    rng = np.random.default_rng(0)
+    store = ItemStore(['id', 'mode', 'var'])
+    for i in range(50):
+        store.append(dict(id=str(i), mode=rng.random(), var=rng.uniform(0.001, 0.05)))
+    modes = store.column('mode')
+    variances = store.column('var')
+    cache = MatchCache(store, 0.1)
+    for round_num in range(5):
+        anchor_indices = np.array([3, 7, 11, 2 * round_num + 20])
+        cached = list(cache.iter_log_match_weights(anchor_indices, modes, variances, block_size=100))
+        expected = list(iter_log_match_weights(anchor_indices, modes, variances, 0.1, block_size=100))
+        assert [(start, end) for (start, end, _) in cached] == [(0, 2), (2, 4)]
+        for ((_, _, log_weights), (_, _, expected_log_weights)) in zip(cached, expected):
+            assert_allclose(log_weights, expected_log_weights)
+        assert sorted(cache.log_weights) == sorted(anchor_indices.tolist())
+
+        # change some items, including (sometimes) an anchor
+        touched = rng.choice(50, 5, replace=False)
+        modes[touched] = rng.random(len(touched))
+        variances[touched] = rng.uniform(0.001, 0.05, len(touched))
+        store.mark_touched(touched)
+
+    rng_1 = np.random.default_rng(1)
+    rng_2 = np.random.default_rng(1)
+    assert sample_matches(anchor_indices, modes, variances, 0.1, 4, rng=rng_1, cache=cache).tolist() == \
+        sample_matches(anchor_indices, modes, variances, 0.1, 4, rng=rng_2).tolist()
+
+
+def test_match_cache_max_bytes():
+    rng = np.random.default_rng(0)
+    store = ItemStore(['id', 'mode', 'var'])
+    for i in range(50):
+        store.append(dict(id=str(i), mode=rng.random(), var=rng.uniform(0.001, 0.05)))
+    modes = store.column('mode')
+    variances = store.column('var')
+    # room for the weights of 3 anchors
+    cache = MatchCache(store, 0.1, max_bytes=3 * 50 * 8 + 7)
+    assert cache.max_rows(50) == 3
+
+    anchor_indices = np.array([3, 7, 11, 20, 25])
+    for _ in range(2):
+        cached = list(cache.iter_log_match_weights(anchor_indices, modes, variances, block_size=100))
+        expected = list(iter_log_match_weights(anchor_indices, modes, variances, 0.1, block_size=100))
+        for ((_, _, log_weights), (_, _, expected_log_weights)) in zip(cached, expected):
+            assert_allclose(log_weights, expected_log_weights)
+        assert sorted(cache.log_weights) == [3, 7, 11]
+
+    # rows of anchors not in the call are evicted to make room
+    list(cache.iter_log_match_weights(np.array([11, 30, 31, 32]), modes, variances, block_size=100))
+    assert sorted(cache.log_weights) == [11, 30, 31]
+
+    cache = MatchCache(store, 0.1, max_bytes=0)
+    list(cache.iter_log_match_weights(anchor_indices, modes, variances))
+    assert cache.log_weights == {}
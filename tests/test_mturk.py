@@ -0,0 +1,328 @@
+import csv
+import datetime
+import os
+import threading
+import time
+
+from botocore.exceptions import ClientError
+from pytest import mark, raises
+
+from easl import EASL
+from easl.mturk import (
+    publish_batch, call_with_retry, collect_assignments, wait_hits, stream, approve_assignments,
+    parse_answer, write_results, model_answer_names,
+)
+
+
+TEMPLATE_PATH = os.path.join(os.path.dirname(__file__), '..', 'templates', 'political', 'template_political_na.html')
+
+
+def throttling_error():
+    return ClientError({'Error': {'Code': 'ThrottlingException', 'Message': 'Rate exceeded'}},
+                       'CreateHITWithHITType')
+
+
+class StubClient(object):
+    def __init__(self, throttle_every=0):
+        self.throttle_every = throttle_every
+        self.lock = threading.Lock()
+        self.num_calls = 0
+        self.hits_by_token = {}
+
+    def create_hit_with_hit_type(self, **kwargs):
+        with self.lock:
+            self.num_calls += 1
+            throttle = self.throttle_every and self.num_calls % self.throttle_every == 0
+        time.sleep(0.01)
+        if throttle:
+            raise throttling_error()
+        with self.lock:
+            token = kwargs['UniqueRequestToken']
+            if token not in self.hits_by_token:
+                self.hits_by_token[token] = dict(
+                    HITId='HIT{}'.format(len(self.hits_by_token)),
+                    HITLayoutParameters=kwargs['HITLayoutParameters'],
+                )
+            return dict(HIT=self.hits_by_token[token])
+
+
+class StubPaginator(object):
+    def __init__(self, method):
+        self.method = method
+
+    def paginate(self, **kwargs):
+        yield self.method(**kwargs)
+
+
+class StubAssignmentClient(object):
+    def __init__(self, arrival_polls):
+        # HIT id -> number of polls of that HIT before its assignment
+        # arrives (None if it never does)
+        self.arrival_polls = arrival_polls
+        self.lock = threading.Lock()
+        self.polls = dict((hit_id, 0) for hit_id in arrival_polls)
+
+    def get_paginator(self, name):
+        assert name == 'list_assignments_for_hit'
+        return StubPaginator(self.list_assignments_for_hit)
+
+    def list_assignments_for_hit(self, HITId):
+        with self.lock:
+            self.polls[HITId] += 1
+            num_polls = self.polls[HITId]
+        if num_polls == 1 and HITId == 'throttled':
+            raise throttling_error()
+        arrival = self.arrival_polls[HITId]
+        if arrival is None or num_polls < arrival:
+            return dict(Assignments=[])
+        return dict(Assignments=[dict(AssignmentId='{}-a'.format(HITId), AssignmentStatus='Submitted')])
+
+
+ANSWER_XML = ('<QuestionFormAnswers>{}</QuestionFormAnswers>')
+ANSWER_FIELD_XML = ('<Answer><QuestionIdentifier>{}</QuestionIdentifier>'
+                    '<FreeText>{}</FreeText></Answer>')
+
+
+class StubAnnotatingClient(StubClient):
+    def __init__(self, slow_every=3):
+        super(StubAnnotatingClient, self).__init__()
+        # every `slow_every`-th HIT takes three polls to complete, the
+        # others one
+        self.slow_every = slow_every
+        self.polls = {}
+        self.approved = []
+        # HIT id -> ids of the items in the HIT, for HITs not yet complete
+        self.in_flight = {}
+        # number of items shared with HITs in flight, for each new HIT
+        self.num_shared = []
+
+    def create_hit_with_hit_type(self, **kwargs):
+        response = super(StubAnnotatingClient, self).create_hit_with_hit_type(**kwargs)
+        hit = response['HIT']
+        hit.update(HITTypeId=kwargs['HITTypeId'], HITLayoutId=kwargs['HITLayoutId'],
+                   RequesterAnnotation=kwargs['RequesterAnnotation'])
+        item_ids = set(p['Value'] for p in kwargs['HITLayoutParameters'] if p['Name'].startswith('id'))
+        with self.lock:
+            self.num_shared.append(sum(len(item_ids & other) for other in self.in_flight.values()))
+            self.in_flight[hit['HITId']] = item_ids
+        return response
+
+    def get_paginator(self, name):
+        assert name == 'list_assignments_for_hit'
+        return StubPaginator(self.list_assignments_for_hit)
+
+    def list_assignments_for_hit(self, HITId):
+        with self.lock:
+            self.polls[HITId] = self.polls.get(HITId, 0) + 1
+            hit = [h for h in self.hits_by_token.values() if h['HITId'] == HITId][0]
+            hit_num = int(HITId[len('HIT'):])
+        if self.polls[HITId] < (3 if hit_num % self.slow_every == 0 else 1):
+            return dict(Assignments=[])
+        with self.lock:
+            self.in_flight.pop(HITId, None)
+        params = dict((p['Name'], p['Value']) for p in hit['HITLayoutParameters'])
+        num_items = len([k for k in params if k.startswith('id')])
+        accept_time = datetime.datetime(2020, 1, 1)
+        return dict(Assignments=[dict(
+            AssignmentId='{}-a'.format(HITId),
+            WorkerId='W1',
+            AssignmentStatus='Submitted',
+            AcceptTime=accept_time,
+            SubmitTime=accept_time + datetime.timedelta(seconds=30),
+            Answer=ANSWER_XML.format(''.join(
+                ANSWER_FIELD_XML.format('range{}'.format(i), 50) for i in range(1, num_items + 1))),
+        )])
+
+    def approve_assignment(self, AssignmentId):
+        with self.lock:
+            self.approved.append(AssignmentId)
+
+
+def write_batch(path, num_hits):
+    with open(path, 'w') as f:
+        f.write('id1,sent1,id2,sent2,alpha1\n')
+        for i in range(num_hits):
+            f.write('{0}a,sentence {0}a,{0}b,sentence {0}b,1\n'.format(i))
+
+
+def test_call_with_retry():
+    calls = []
+
+    def method(x):
+        calls.append(x)
+        if len(calls) < 3:
+            raise throttling_error()
+        return x
+
+    assert call_with_retry(method, backoff=0.001, x=5) == 5
+    assert calls == [5, 5, 5]
+
+    del calls[:]
+    with raises(ClientError):
+        call_with_retry(method, max_retries=1, backoff=0.001, x=5)
+    assert len(calls) == 2
+
+
+def test_publish_batch_concurrent(tmpdir):
+    batch_path = str(tmpdir.join('batch.csv'))
+    write_batch(batch_path, 40)
+    client = StubClient(throttle_every=3)
+
+    batch_data = publish_batch('TYPE', 'LAYOUT', batch_path, client=client, concurrency=8, backoff=0.001)
+
+    hits = batch_data['hits']
+    assert len(hits) == 40
+    assert len(client.hits_by_token) == 40
+    assert client.num_calls > 40
+    for (i, hit) in enumerate(hits):
+        params = dict((p['Name'], p['Value']) for p in hit['HITLayoutParameters'])
+        assert params == dict(id1='{}a'.format(i), sent1='sentence {}a'.format(i),
+                              id2='{}b'.format(i), sent2='sentence {}b'.format(i))
+        assert batch_data['hit_params'][hit['HITId']] == params
+
+
+def test_collect_assignments():
+    client = StubAssignmentClient(dict(h1=1, h2=3, throttled=2, h4=2))
+    pairs = list(collect_assignments(['h1', 'h2', 'throttled', 'h4'], interval=0.001, client=client,
+                                     concurrency=4, backoff=0.001))
+    assert [hit_id for (hit_id, _) in pairs] == ['h1', 'throttled', 'h4', 'h2']
+    assert [assignment['AssignmentId'] for (_, assignment) in pairs] == ['h1-a', 'throttled-a', 'h4-a', 'h2-a']
+    # complete HITs are not polled again
+    assert client.polls == dict(h1=1, h2=3, throttled=2, h4=2)
+
+
+def test_wait_hits_completion():
+    hit_ids = ['h{}'.format(i) for i in range(20)]
+    arrival_polls = dict((hit_id, 1) for hit_id in hit_ids)
+    arrival_polls['h19'] = None
+    client = StubAssignmentClient(arrival_polls)
+    hit_assignments = wait_hits(hit_ids, interval=0.001, client=client, completion=0.95, concurrency=4)
+    assert list(hit_assignments) == hit_ids
+    assert hit_assignments['h19'] == []
+    assert all(len(hit_assignments[hit_id]) == 1 for hit_id in hit_ids[:19])
+    assert client.polls['h19'] == 1
+
+
+@mark.parametrize('mean_windows', [False, True])
+def test_stream(tmpdir, mean_windows):
+    model_path = str(tmpdir.join('model_0.csv'))
+    model = EASL()
+    for i in range(20):
+        id_ = 'id{}'.format(i)
+        model.items[id_] = dict(id=id_, sent='sentence for {}'.format(id_))
+        model.items[id_].update(model.INITIAL_ITEM_STATE)
+    model.saveItem(model_path)
+
+    client = StubAnnotatingClient()
+    stream(model_path, {'param_items': 2, 'param_mean_windows': mean_windows}, 'TYPE', 'LAYOUT', 10, 4,
+           client=client, interval=0.001)
+
+    # HITs are replaced as they complete, without waiting for the
+    # slow ones
+    assert len(client.hits_by_token) == 10
+    assert len(client.approved) == 10
+    assert max(client.polls.values()) == 3
+    model = EASL()
+    iter_num = max(int(p.purebasename.split('_')[1]) for p in tmpdir.listdir('model_[0-9]*.csv'))
+    assert iter_num > 1
+    model.loadItem(str(tmpdir.join('model_{}.csv'.format(iter_num))))
+    assert sum(model.items.column('alpha')) == 20 + 10
+    if mean_windows:
+        # replacement HITs do not repeat items of HITs in flight
+        assert client.num_shared == [0] * 10
+
+
+class StubApprovalClient(object):
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.attempts = {}
+        self.approved = set()
+
+    def approve_assignment(self, AssignmentId):
+        with self.lock:
+            self.attempts[AssignmentId] = self.attempts.get(AssignmentId, 0) + 1
+            attempt = self.attempts[AssignmentId]
+        if AssignmentId == 'bad':
+            raise ClientError({'Error': {'Code': 'RequestError', 'Message': 'Invalid assignment'}},
+                              'ApproveAssignment')
+        if attempt == 1 and AssignmentId.endswith('0'):
+            raise throttling_error()
+        with self.lock:
+            self.approved.add(AssignmentId)
+
+
+def test_approve_assignments():
+    client = StubApprovalClient()
+    assignment_ids = ['a{}'.format(i) for i in range(30)] + ['bad']
+    report = approve_assignments(assignment_ids, client=client, concurrency=8, backoff=0.001)
+    assert report['approved'] == assignment_ids[:-1]
+    assert list(report['failed']) == ['bad']
+    assert client.approved == set(assignment_ids[:-1])
+    assert client.attempts['a10'] == 2
+    assert client.attempts['bad'] == 1
+
+
+def test_parse_answer():
+    answer = (
+        '<?xml version="1.0" encoding="UTF-8"?>'
+        '<QuestionFormAnswers xmlns="http://mechanicalturk.amazonaws.com/'
+        'AWSMechanicalTurkDataSchemas/2005-10-01/QuestionFormAnswers.xsd">'
+        '<Answer><QuestionIdentifier>range1</QuestionIdentifier><FreeText>42</FreeText></Answer>'
+        '<Answer><QuestionIdentifier>na1</QuestionIdentifier><FreeText>on</FreeText></Answer>'
+        '<Answer><QuestionIdentifier>choice</QuestionIdentifier>'
+        '<SelectionIdentifier>b</SelectionIdentifier></Answer>'
+        '<Answer><QuestionIdentifier>comment</QuestionIdentifier><FreeText/></Answer>'
+        '</QuestionFormAnswers>')
+    assert parse_answer(answer) == dict(range1='42', na1='on', choice='b', comment=None)
+    assert parse_answer(ANSWER_XML.format(ANSWER_FIELD_XML.format('range1', 7))) == dict(range1='7')
+
+
+def test_write_results(tmpdir):
+    results_path = str(tmpdir.join('results.csv'))
+    accept_time = datetime.datetime(2020, 1, 1)
+    hit = dict(HITId='H', HITTypeId='T', HITLayoutId='L', RequesterAnnotation='{}')
+    params = dict(id1='a', sent1='first', id2='b', sent2='second')
+
+    def iter_triples():
+        # the first assignment has no N/A answers, the last an
+        # unexpected field
+        for (i, answers) in enumerate([
+                dict(range1=10, range2=20),
+                dict(range1=30, na2='on'),
+                dict(range1=50, range2=60, comment='hi')]):
+            assignment = dict(
+                AssignmentId='A{}'.format(i), WorkerId='W', AcceptTime=accept_time,
+                SubmitTime=accept_time + datetime.timedelta(seconds=61.2),
+                Answer=ANSWER_XML.format(''.join(ANSWER_FIELD_XML.format(k, v) for (k, v) in answers.items())))
+            yield (hit, assignment, params)
+
+    write_results(results_path, iter_triples())
+    with open(results_path) as f:
+        rows = list(csv.DictReader(f))
+    assert len(rows) == 3
+    assert [row['Answer.comment'] for row in rows] == ['', '', 'hi']
+    assert [(row['Answer.range2'], row['Answer.na2']) for row in rows] == [('20', ''), ('', 'on'), ('60', '')]
+    assert rows[0]['Input.sent2'] == 'second'
+    assert rows[0]['WorkTimeInSeconds'] == '61'
+
+
+def test_write_results_template(tmpdir):
+    results_path = str(tmpdir.join('results.csv'))
+    accept_time = datetime.datetime(2020, 1, 1)
+    hit = dict(HITId='H', HITTypeId='T', HITLayoutId='L', RequesterAnnotation='{}')
+    params = dict(id1='a', sent1='first', id2='b', sent2='second')
+    answer_names = model_answer_names(EASL({'param_hit_template': TEMPLATE_PATH}))
+    assert answer_names == ['na1', 'range1', 'na2', 'range2', 'na3', 'range3', 'na4', 'range4', 'na5', 'range5',
+                            'Comments']
+    assert model_answer_names(EASL()) is None
+
+    assignment = dict(
+        AssignmentId='A', WorkerId='W', AcceptTime=accept_time, SubmitTime=accept_time,
+        Answer=ANSWER_XML.format(ANSWER_FIELD_XML.format('range1', 10) + ANSWER_FIELD_XML.format('Comments', 'hi')))
+    write_results(results_path, [(hit, assignment, params)], answer_names=answer_names)
+    with open(results_path) as f:
+        reader = csv.DictReader(f)
+        rows = list(reader)
+    assert 'Answer.range5' in reader.fieldnames
+    assert rows[0]['Answer.Comments'] == 'hi'
+    assert rows[0]['Answer.range1'] == '10'
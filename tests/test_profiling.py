@@ -0,0 +1,70 @@
+import json
+import pstats
+
+from pytest import mark
+
+from easl import EASL, run
+from easl import profiling
+
+
+def test_profiler():
+    profiler = profiling.enable()
+    try:
+        with profiling.span('outer'):
+            with profiling.span('inner', index=1):
+                profiling.count('things', 2)
+            with profiling.span('inner', index=2):
+                profiling.count('things')
+    finally:
+        assert profiling.disable() is profiler
+    profiling.count('things')
+
+    report = profiler.report()
+    assert [(s['name'], s['parent']) for s in report['spans']] == [
+        ('inner', 'outer'), ('inner', 'outer'), ('outer', None)]
+    assert report['spans'][1]['attributes'] == dict(index=2)
+    assert report['totals']['inner']['count'] == 2
+    assert report['totals']['outer']['duration'] >= report['totals']['inner']['duration']
+    assert report['counters'] == dict(things=3)
+
+
+def create_model(tmpdir, num_items=20):
+    model_path = str(tmpdir.join('model_0.csv'))
+    model = EASL()
+    for i in range(num_items):
+        model.items[str(i)] = dict(id=str(i), sent='sentence {}'.format(i))
+        model.items[str(i)].update(model.INITIAL_ITEM_STATE)
+        model.items[str(i)].update(mode=i / num_items)
+    model.saveItem(model_path)
+    return model_path
+
+
+@mark.parametrize('workers', [1, 2])
+def test_profile_call_report(tmpdir, workers):
+    model_path = create_model(tmpdir)
+    with open(str(tmpdir.join('model_result_1.csv')), 'w') as f:
+        f.write('Input.id1,Input.id2,Answer.range1,Answer.range2\n0,1,10,90\n2,3,50,50\n')
+    report_path = str(tmpdir.join('profile.jsonl'))
+    params = {'param_items': 2, 'param_hits': 4, 'param_workers': workers}
+    for _ in range(2):
+        profiling.profile_call(report_path, run, 'update-generate', model_path, params)
+
+    with open(report_path) as f:
+        reports = [json.loads(line) for line in f]
+    assert len(reports) == 2
+    report = reports[0]
+    assert set(report['totals']) >= {
+        'total', 'load_model', 'observe', 'parse_results', 'update_model', 'checkpoint', 'save_model',
+        'next_batch', 'get_next_k', 'write_hits'}
+    assert report['counters'] == dict(
+        items_loaded=20, answers_observed=4, items_updated=4, items_saved=20, hits_selected=4,
+        hits_written=4, pairs_scored=4 * 20)
+    assert profiling.active_profiler() is None
+
+
+def test_profile_call_cprofile(tmpdir):
+    model_path = create_model(tmpdir)
+    profile_path = str(tmpdir.join('profile.prof'))
+    profiling.profile_call(profile_path, run, 'generate', model_path, {'param_items': 2})
+    stats = pstats.Stats(profile_path)
+    assert any(name == 'get_next_k' for (_, _, name) in stats.stats)
@@ -0,0 +1,75 @@
+import numpy as np
+from numpy.testing import assert_allclose
+from pytest import raises
+
+from easl.selection import top_k_random_ties, gumbel_top_k, ModeOrder
+from easl.store import ItemStore
+
+
+def test_top_k_random_ties():
+    values = np.array([0.1, 0.5, 0.3, 0.5, 0.3, 0.3, 0.0])
+    assert top_k_random_ties(values, 0).tolist() == []
+    assert sorted(top_k_random_ties(values, 2).tolist()) == [1, 3]
+    assert len(top_k_random_ties(values, 10)) == 7
+
+    tie_counts = np.zeros(len(values))
+    for _ in range(3000):
+        selected = top_k_random_ties(values, 3)
+        assert set(selected[:2].tolist()) == {1, 3}
+        tie_counts[selected[2]] += 1
+    assert tie_counts[[0, 1, 3, 6]].sum() == 0
+    assert_allclose(tie_counts[[2, 4, 5]] / 3000, 1. / 3, atol=0.05)
+
+
+def test_gumbel_top_k():
+    weights = np.array([1., 2., 3., 4., 0.])
+    with np.errstate(divide='ignore'):
+        log_weights = np.log(weights)
+
+    samples = gumbel_top_k(np.tile(log_weights, (20000, 1)), 2)
+    assert samples.shape == (20000, 2)
+    assert np.all(samples[:, 0] != samples[:, 1])
+    assert not np.any(samples == 4)
+
+    # compare with drawing one index at a time and renormalizing
+    p = weights / weights.sum()
+    first_counts = np.bincount(samples[:, 0], minlength=5) / 20000.
+    assert_allclose(first_counts, p, atol=0.02)
+    included = np.array([
+        p[i] + sum(p[j] * p[i] / (1 - p[j]) for j in range(5) if j != i)
+        for i in range(5)])
+    included_counts = np.bincount(samples.ravel(), minlength=5) / 20000.
+    assert_allclose(included_counts, included, atol=0.02)
+
+    assert sorted(gumbel_top_k(log_weights, 4).tolist()) == [0, 1, 2, 3]
+    with raises(ValueError):
+        gumbel_top_k(log_weights, 5)
+
+
+def test_mode_order():
+    rng = np.random.default_rng(0)
+    store = ItemStore(['id', 'mode'])
+    for i in range(200):
+        # many ties, as in a fresh model
+        store.append(dict(id=str(i), mode=0.5 if i < 150 else rng.random()))
+    mode_order = ModeOrder(store, rng=rng)
+    modes = store.column('mode')
+    for round_num in range(20):
+        touched = rng.choice(len(store), 15, replace=False)
+        modes[touched] = np.round(rng.random(len(touched)), 1)
+        store.mark_touched(touched)
+        if round_num % 5 == 0:
+            store.append(dict(id='new{}'.format(round_num), mode=0.5))
+            modes = store.column('mode')
+        mode_order.update()
+        assert mode_order.order.tolist() == np.lexsort((mode_order.keys, modes)).tolist()
+        assert mode_order.sorted_modes.tolist() == modes[mode_order.order].tolist()
+
+    windows = mode_order.windows(3, 4, overlap=1)
+    assert windows.shape == (3, 4)
+    assert windows[0, 3] == windows[1, 0]
+    start = (len(store) - 10) // 2
+    assert windows.ravel().tolist() == mode_order.order[[
+        start + i for i in (0, 1, 2, 3, 3, 4, 5, 6, 6, 7, 8, 9)]].tolist()
+    with raises(Exception):
+        mode_order.windows(100, 5)
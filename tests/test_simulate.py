@@ -0,0 +1,33 @@
+from pytest import mark
+
+from easl.simulate import simulate, sweep, iter_param_grid
+
+
+ITEMS_PATH = 'experiments/political/political.csv'
+GOLD_PATH = 'experiments/political/political_gold.csv'
+
+
+@mark.parametrize('mean_windows', [False, True])
+def test_simulate(mean_windows):
+    params = {'param_items': 5, 'param_hits': 30, 'param_mean_windows': mean_windows,
+              'param_running_stats': True}
+    records = simulate(ITEMS_PATH, GOLD_PATH, params, 20, noise=0.05, seed=1)
+    assert [record['round'] for record in records] == list(range(1, 21))
+    assert records[0]['hits'] == 30
+    assert records[-1]['annotations'] == 20 * 30 * 5
+    assert records[-1]['spearman'] > 0.8
+    assert records == simulate(ITEMS_PATH, GOLD_PATH, params, 20, noise=0.05, seed=1)
+
+
+def test_iter_param_grid():
+    assert list(iter_param_grid({'param_items': [3, 5], 'param_match': [0.1]})) == [
+        {'param_items': 3, 'param_match': 0.1}, {'param_items': 5, 'param_match': 0.1}]
+
+
+def test_sweep():
+    param_grid = {'param_items': [3, 5], 'param_hits': [20], 'param_running_stats': [True]}
+    records = sweep(ITEMS_PATH, GOLD_PATH, param_grid, 3, repeats=2, workers=2)
+    assert len(records) == 2 * 2 * 3
+    assert set((record['param_items'], record['repeat']) for record in records) == set(
+        [(3, 0), (3, 1), (5, 0), (5, 1)])
+    assert records == sweep(ITEMS_PATH, GOLD_PATH, param_grid, 3, repeats=2, workers=1)
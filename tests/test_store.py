@@ -0,0 +1,126 @@
+import numpy as np
+from numpy.testing import assert_allclose
+
+from easl.store import (
+    ItemStore, load_csv, save_csv, load_binary, save_binary, load_model, save_model, convert_model,
+    format_value, resolve_model_path,
+)
+
+
+def test_format_value():
+    assert format_value(1.) == '1'
+    assert format_value(np.float64(0.5)) == '0.5'
+    assert format_value(0.0833) == '0.0833'
+    assert format_value(np.int64(3)) == '3'
+    assert format_value('1 0.5') == '1 0.5'
+
+
+def test_item_store():
+    store = ItemStore(['id', 'sent', 'alpha', 'na_count', 'scores'])
+    store.append(dict(id='a', sent='first', alpha=1, na_count=0, scores=''))
+    store['b'] = dict(sent='second', alpha='2.5', na_count='1', scores='0.50')
+    for i in range(20):
+        store['c{}'.format(i)] = dict(sent='more', alpha=1, na_count=0, scores='')
+
+    assert len(store) == 22
+    assert list(store)[:2] == ['a', 'b']
+    assert 'b' in store and 'z' not in store
+    assert store.index['b'] == 1
+    assert store['b']['alpha'] == 2.5
+    assert store['b']['na_count'] == 1
+    assert store['b']['sent'] == 'second'
+    assert store.column('alpha').dtype == np.float64
+    assert store.column('na_count').dtype == np.int64
+
+    store['a']['alpha'] += 0.5
+    store.column('na_count')[0] += 2
+    assert dict(store['a']) == dict(id='a', sent='first', alpha=1.5, na_count=2, scores='')
+
+    store['a'].update(beta=3)
+    assert store.header == ['id', 'sent', 'alpha', 'na_count', 'scores', 'beta']
+    assert store['a']['beta'] == 3
+    assert store['b']['beta'] == 0
+
+
+MODEL_CSV = ('id,sent,alpha,beta,mode,var,na_count,scores\r\n'
+             '1,"a, sentence",1,1,0.5,0.0833,0,\r\n'
+             '2,another,1.5,2.25,0.2857142857142857,0.05,1, 0.50 0.25\r\n')
+
+
+def test_csv_round_trip(tmpdir):
+    in_path = str(tmpdir.join('model_0.csv'))
+    out_path = str(tmpdir.join('model_1.csv'))
+    with open(in_path, 'w', newline='') as f:
+        f.write(MODEL_CSV)
+    store = load_csv(in_path)
+    assert store.ids == ['1', '2']
+    assert_allclose(store.column('beta'), [1., 2.25])
+    save_csv(store, out_path)
+    with open(out_path, newline='') as f:
+        assert f.read() == MODEL_CSV
+
+
+def test_binary_round_trip(tmpdir):
+    csv_path = str(tmpdir.join('model_0.csv'))
+    binary_path = str(tmpdir.join('model_0.easl'))
+    out_path = str(tmpdir.join('model_1.csv'))
+    with open(csv_path, 'w', newline='') as f:
+        f.write(MODEL_CSV)
+    convert_model(csv_path, binary_path)
+    assert tmpdir.join('model_0.easl', 'alpha.npy').check()
+
+    store = load_model(binary_path)
+    assert isinstance(store.column('alpha'), np.memmap)
+    assert store.ids == ['1', '2']
+    assert store['1']['sent'] == 'a, sentence'
+    assert store['2']['scores'] == ' 0.50 0.25'
+    assert_allclose(store.column('mode'), [0.5, 0.2857142857142857])
+
+    convert_model(binary_path, out_path)
+    with open(out_path, newline='') as f:
+        assert f.read() == MODEL_CSV
+
+
+def test_binary_update_in_place(tmpdir):
+    csv_path = str(tmpdir.join('model_0.csv'))
+    binary_path = str(tmpdir.join('model_0.easl'))
+    with open(csv_path, 'w', newline='') as f:
+        f.write(MODEL_CSV)
+    save_binary(load_csv(csv_path), binary_path)
+
+    store = load_binary(binary_path)
+    store.column('alpha')[0] += 1
+    assert_allclose(load_binary(binary_path).column('alpha'), [1., 1.5])
+    save_binary(store, binary_path)
+    assert_allclose(store.column('alpha'), [2., 1.5])
+    assert_allclose(load_binary(binary_path).column('alpha'), [2., 1.5])
+    store['3'] = dict(sent='third', alpha=1)
+    save_binary(store, binary_path)
+    assert load_binary(binary_path).ids == ['1', '2', '3']
+
+
+def test_delta_models(tmpdir):
+    with open(str(tmpdir.join('model_0.csv')), 'w', newline='') as f:
+        f.write(MODEL_CSV)
+
+    store = load_model(str(tmpdir.join('model_0.csv')))
+    store['2']['alpha'] = 3.5
+    save_model(store, str(tmpdir.join('model_1.csv')), delta=True)
+    assert not tmpdir.join('model_1.csv').check()
+    with open(str(tmpdir.join('model_1.delta.csv'))) as f:
+        assert len(f.readlines()) == 2
+
+    store = load_model(str(tmpdir.join('model_1.csv')))
+    store['3'] = dict(sent='third', alpha=1, beta=1, mode=0.5, var=0.0833, na_count=0, scores='')
+    save_model(store, str(tmpdir.join('model_2.csv')), delta=True)
+
+    assert resolve_model_path(str(tmpdir.join('model_2.csv'))) == (
+        str(tmpdir.join('model_0.csv')),
+        [str(tmpdir.join('model_1.delta.csv')), str(tmpdir.join('model_2.delta.csv'))])
+    store = load_model(str(tmpdir.join('model_2.csv')))
+    assert store.ids == ['1', '2', '3']
+    assert_allclose(store.column('alpha'), [1., 3.5, 1.])
+
+    save_model(store, str(tmpdir.join('model_2.csv')))
+    assert not tmpdir.join('model_2.delta.csv').check()
+    assert resolve_model_path(str(tmpdir.join('model_2.csv'))) == (str(tmpdir.join('model_2.csv')), [])